@@ -0,0 +1,348 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+import torch
+
+import split_learning
+from split_learning.schemas.message import MessageType, WireFormat, WSMessage
+from split_learning.schemas.trace import TraceEvent
+from split_learning.transport.base import use_uvloop
+from split_learning.transport.connect import SCHEMES, connect
+from split_learning.utils.metrics import percentile
+from split_learning.utils.serde import (
+    codecs,
+    decode_message,
+    encode_message,
+    encode_message_b64,
+    encode_tensor,
+    hello_message,
+)
+from split_learning.utils.trace import read_trace, synthesize_message
+
+# logger
+_logger = logging.getLogger(__name__)
+
+# (send time in seconds from the client's start, or None for no pacing; message)
+Schedule = List[Tuple[Optional[float], WSMessage]]
+
+
+def summarize(latencies: List[float], steps: int, sent_bytes: int, elapsed: float):
+    latencies = sorted(latencies)
+    elapsed = max(elapsed, 1e-9)
+    return {
+        "steps": steps,
+        "msgs_per_s": steps / elapsed,
+        "sent_mb_per_s": sent_bytes / elapsed / 1e6,
+        "p50_ms": 1000 * percentile(latencies, 0.5),
+        "p95_ms": 1000 * percentile(latencies, 0.95),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "max_ms": 1000 * latencies[-1] if latencies else 0.0,
+    }
+
+
+class ClientStats:
+    def __init__(self, index: int):
+        self.index = index
+        self.latencies: List[float] = []
+        self.sent_bytes = 0
+        self.elapsed = 0.0
+
+    def summary(self, warmup: int = 0) -> dict:
+        """Throughput over all steps, latency percentiles after `warmup`."""
+        return summarize(
+            self.latencies[warmup:],
+            len(self.latencies),
+            self.sent_bytes,
+            self.elapsed,
+        )
+
+
+def synthetic_schedule(
+    message_type: MessageType,
+    shape: Tuple[int, ...],
+    codec: str,
+    num_classes: int,
+    steps: int,
+) -> Schedule:
+    activations, activations_meta = encode_tensor(torch.randn(shape), codec)
+    raw, meta = {"tensor": activations}, {"tensor": activations_meta}
+    if message_type == MessageType.ACTIVATIONS_AND_LABELS:
+        raw["labels"], meta["labels"] = encode_tensor(
+            torch.randint(0, num_classes, shape[:1])
+        )
+    message = WSMessage(type=message_type, data={}, raw=raw, meta=meta)
+    return [(None, message)] * steps
+
+
+def trace_schedule(
+    events: List[TraceEvent], speed: float, num_classes: int, steps: Optional[int]
+) -> Schedule:
+    """Replay the tensor messages of a recorded client, at `speed` (0: unpaced)."""
+    events = [e for e in events if e.nbytes][:steps]
+    # messages of the same kind share one synthetic payload
+    messages: Dict[str, WSMessage] = {}
+    # but each step gets its own seq, the server pairs U-shape messages by it:
+    # recorded seq -> replayed seq, middle grads reuse their step's
+    seqs: Dict[Any, int] = {}
+    next_seq = 0
+    schedule = []
+    for event in events:
+        key = event.json(include={"type", "meta", "nbytes"})
+        if key not in messages:
+            messages[key] = synthesize_message(event, num_classes=num_classes)
+        message = messages[key]
+        if "seq" in event.data:
+            seq = event.data["seq"]
+            if event.type != MessageType.MIDDLE_GRADS or seq not in seqs:
+                seqs[seq] = next_seq
+                next_seq += 1
+            message = message.copy(update={"data": {**message.data, "seq": seqs[seq]}})
+        start = (event.time - events[0].time) / speed if speed > 0 else None
+        schedule.append((start, message))
+    return schedule
+
+
+async def run_client(
+    index: int,
+    uri: str,
+    schedule: Schedule,
+    wire_format: WireFormat,
+    max_in_flight: int,
+) -> ClientStats:
+    stats = ClientStats(index)
+    async with await connect(uri) as connection:
+        hello = hello_message([wire_format, WireFormat.B64_JSON])
+        await connection.send(encode_message_b64(hello))
+        hello_response = decode_message(await connection.recv())
+        connection_format = WireFormat(hello_response.data["wire_format"])
+
+        # encoded once, so that the generator is not the bottleneck
+        encoded = {}
+        for _, message in schedule:
+            if id(message) not in encoded:
+                encoded[id(message)] = encode_message(message, connection_format)
+
+        # replies come back in order
+        sent_at = deque()
+        slots = asyncio.Semaphore(max_in_flight)
+
+        async def receive_replies():
+            for _ in schedule:
+                await connection.recv()
+                stats.latencies.append(time.perf_counter() - sent_at.popleft())
+                slots.release()
+
+        receiver = asyncio.create_task(receive_replies())
+        start = time.perf_counter()
+        for send_time, message in schedule:
+            if send_time is not None:
+                delay = start + send_time - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await slots.acquire()
+            data = encoded[id(message)]
+            sent_at.append(time.perf_counter())
+            await connection.send(data)
+            stats.sent_bytes += memoryview(data).nbytes
+        await receiver
+        stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+async def monitor_loop_lag(lags: List[float], interval: float = 0.01):
+    """Record how late the generator's own event loop wakes up."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run_clients(
+    uri: str, schedules: List[Schedule], wire_format: WireFormat, max_in_flight: int
+) -> Tuple[List[ClientStats], float]:
+    lags = []
+    monitor = asyncio.create_task(monitor_loop_lag(lags))
+    try:
+        stats = await asyncio.gather(
+            *[
+                run_client(i, uri, schedule, wire_format, max_in_flight)
+                for i, schedule in enumerate(schedules)
+            ]
+        )
+    finally:
+        monitor.cancel()
+    return stats, max(lags, default=0.0)
+
+
+@click.command()
+@click.option(
+    "--uri",
+    "uri",
+    type=str,
+    default="ws://127.0.0.1:8000/ws",
+    help=f"server uri, one of {', '.join(s + '://' for s in SCHEMES)}",
+)
+@click.option("--clients", "num_clients", type=int, default=None)
+@click.option(
+    "--steps",
+    "steps",
+    type=int,
+    default=None,
+    help="messages per client (default: 200, or the whole trace)",
+)
+@click.option("--warmup", "warmup", type=int, default=10)
+@click.option("--max-in-flight", "max_in_flight", type=int, default=1)
+# synthetic messages
+@click.option(
+    "--type",
+    "message_type",
+    type=click.Choice(["train", "inference"]),
+    default="train",
+)
+@click.option(
+    "--shape",
+    "shape",
+    type=str,
+    default="128,16,7,7",
+    help="activation shape (CNN2DClient outputs by default)",
+)
+@click.option("--num-classes", "num_classes", type=int, default=10)
+@click.option(
+    "--activation-codec",
+    "activation_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+)
+# trace replay
+@click.option(
+    "--trace",
+    "trace_path",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="replay a trace recorded with `scripts/server.py --record-trace`",
+)
+@click.option(
+    "--speed",
+    "speed",
+    type=float,
+    default=1.0,
+    help="trace replay speed (0: send as fast as replies allow)",
+)
+# connection
+@click.option(
+    "--wire-format",
+    "wire_format",
+    type=click.Choice([f.value for f in WireFormat]),
+    default=WireFormat.FRAME.value,
+)
+@click.option("--uvloop", "uvloop", is_flag=True, help="use uvloop, if installed")
+@click.option(
+    "-o",
+    "--output",
+    "output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write per-client results as json",
+)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(
+    uri: str,
+    num_clients: Optional[int],
+    steps: Optional[int],
+    warmup: int,
+    max_in_flight: int,
+    message_type: str,
+    shape: str,
+    num_classes: int,
+    activation_codec: str,
+    trace_path: Optional[str],
+    speed: float,
+    wire_format: str,
+    uvloop: bool,
+    output: Optional[str],
+    log_level: int,
+):
+    """Load a split learning server with concurrent synthetic clients."""
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+
+    if trace_path is not None:
+        traces = list(read_trace(trace_path).values())
+        if not traces:
+            raise click.UsageError(f"{trace_path} has no recorded messages")
+        num_clients = num_clients or len(traces)
+        # with more clients than recorded, recorded clients are replayed again
+        schedules = [
+            trace_schedule(traces[i % len(traces)], speed, num_classes, steps)
+            for i in range(num_clients)
+        ]
+        _logger.info(f"Replaying {len(traces)} recorded clients as {num_clients}")
+    else:
+        num_clients = num_clients or 4
+        message_types = {
+            "train": MessageType.ACTIVATIONS_AND_LABELS,
+            "inference": MessageType.ACTIVATIONS,
+        }
+        schedule = synthetic_schedule(
+            message_types[message_type],
+            tuple(int(d) for d in shape.split(",")),
+            activation_codec,
+            num_classes,
+            steps or 200,
+        )
+        schedules = [schedule] * num_clients
+
+    if uvloop and not use_uvloop():
+        _logger.warning("uvloop is not installed, using asyncio")
+    _logger.info(f"Connecting {num_clients} clients to {uri} ...")
+    stats, loop_lag = asyncio.run(
+        run_clients(uri, schedules, WireFormat(wire_format), max_in_flight)
+    )
+
+    summaries = {str(s.index): s.summary(warmup) for s in stats}
+    # throughput of all clients together
+    summaries["all"] = summarize(
+        [latency for s in stats for latency in s.latencies[warmup:]],
+        sum(len(s.latencies) for s in stats),
+        sum(s.sent_bytes for s in stats),
+        max(s.elapsed for s in stats),
+    )
+
+    print(
+        f"{'client':<8}{'steps':>8}{'msgs/s':>10}{'MB/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for name, summary in summaries.items():
+        print(
+            f"{name:<8}{summary['steps']:>8}{summary['msgs_per_s']:>10.1f}"
+            f"{summary['sent_mb_per_s']:>10.1f}{summary['p50_ms']:>10.2f}"
+            f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}"
+            f"{summary['max_ms']:>10.2f}"
+        )
+    if loop_lag > 0.05:
+        _logger.warning(
+            f"The generator's event loop stalled for up to {1000 * loop_lag:.0f} ms, "
+            "latencies include its own delays"
+        )
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump({"clients": summaries, "loop_lag_s": loop_lag}, f, indent=2)
+        _logger.info(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import logging
+import sys
+import time
+
+import click
+import torch
+from mpi4py import MPI
+
+import split_learning
+from split_learning.models.vision.cnn_2d import CNN2DClient
+from split_learning.schemas.message import MessageType, WireFormat, WSMessage
+from split_learning.transport.mpi import transports
+from split_learning.utils.metrics import percentile
+from split_learning.utils.serde import deserialize_message_tensor, encode_tensor
+
+# logger
+_logger = logging.getLogger(__name__)
+
+
+def configurations():
+    for name in transports:
+        if name == "pickle":
+            for wire_format in WireFormat:
+                yield name, wire_format
+        else:
+            yield name, None
+
+
+def echo(transport, steps: int):
+    """Answer every activations message with gradients of the same shape."""
+    for _ in range(steps):
+        source, message = transport.recv()
+        grads = deserialize_message_tensor(message, "tensor")
+        payload, meta = encode_tensor(grads)
+        response = WSMessage(
+            type=MessageType.GRADS,
+            data={"loss": 0.0, "seq": message.data.get("seq")},
+            raw={"tensor": payload},
+            meta={"tensor": meta},
+        )
+        transport.isend(response, source)
+        transport.release(message)
+    transport.flush()
+
+
+def round_trips(transport, activations, labels, steps: int):
+    times = []
+    for seq in range(steps):
+        start = time.perf_counter()
+        payload, meta = encode_tensor(activations)
+        labels_payload, labels_meta = encode_tensor(labels)
+        request = WSMessage(
+            type=MessageType.ACTIVATIONS_AND_LABELS,
+            data={"seq": seq},
+            raw={"tensor": payload, "labels": labels_payload},
+            meta={"tensor": meta, "labels": labels_meta},
+        )
+        transport.isend(request, 0)
+        _, response = transport.recv(source=0)
+        deserialize_message_tensor(response, "tensor")
+        transport.release(response)
+        times.append(time.perf_counter() - start)
+    transport.flush()
+    return times
+
+
+@click.command()
+@click.option("--batch-size", "batch_size", type=int, default=128)
+@click.option("--steps", "steps", type=int, default=200)
+@click.option("--warmup", "warmup", type=int, default=20)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(batch_size: int, steps: int, warmup: int, log_level: int):
+    """Round-trip time of CNN2D activations/gradients over each MPI transport.
+
+    Run with two ranks on one host:
+
+        mpirun -n 2 python benchmarks/mpi_transport.py
+    """
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    if comm.Get_size() != 2:
+        raise click.UsageError("Run with exactly 2 ranks")
+
+    # activations
+    model = CNN2DClient(in_channels=1, dim_out=10, img_size=28)
+    with torch.no_grad():
+        activations = model(torch.randn(batch_size, 1, 28, 28)).contiguous()
+    labels = torch.randint(0, 10, (batch_size,))
+    nbytes = activations.numel() * activations.element_size()
+
+    if rank == 1:
+        _logger.info(f"Activations of {tuple(activations.shape)}, {nbytes} bytes")
+        print(
+            f"{'transport':<10}{'wire format':<14}{'p50 ms':>10}{'p99 ms':>10}"
+            f"{'steps/s':>10}{'MB/s':>10}"
+        )
+
+    for name, wire_format in configurations():
+        transport = transports[name](comm)
+        if wire_format is not None:
+            transport.wire_formats[1 - rank] = wire_format
+
+        comm.Barrier()
+        if rank == 0:
+            echo(transport, warmup + steps)
+            continue
+
+        times = round_trips(transport, activations, labels, warmup + steps)
+        times = sorted(times[warmup:])
+        total = sum(times)
+        print(
+            f"{name:<10}{wire_format.value if wire_format else '-':<14}"
+            f"{1000 * percentile(times, 0.5):>10.3f}"
+            f"{1000 * percentile(times, 0.99):>10.3f}"
+            f"{len(times) / total:>10.1f}"
+            f"{2 * nbytes * len(times) / total / 1e6:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import logging
+import sys
+from typing import Callable, Dict, Optional, Tuple
+
+import click
+import torch
+from torch import nn
+from torchvision import models as vision_models
+
+import split_learning
+from split_learning.models.planner import (
+    candidate_cuts,
+    estimate_step_time,
+    profile_cut,
+    recommend_cut,
+)
+from split_learning.models.vision.cnn_2d import CNN2D
+from split_learning.utils.serde import codecs
+
+# logger
+_logger = logging.getLogger(__name__)
+
+
+def cnn2d() -> Tuple[nn.Module, Tuple[int, ...]]:
+    return CNN2D(in_channels=1, dim_out=10, img_size=28), (1, 28, 28)
+
+
+def resnet18() -> Tuple[nn.Module, Tuple[int, ...]]:
+    # the CIFAR-10 variant, as trained in the demo
+    model = vision_models.resnet18(pretrained=False)
+    model.conv1 = nn.Conv2d(3, 64, kernel_size=3, stride=1, padding=1, bias=False)
+    model.maxpool = nn.Identity()
+    model.fc = nn.Linear(model.fc.in_features, 10)
+    return model, (3, 32, 32)
+
+
+models: Dict[str, Callable[[], Tuple[nn.Module, Tuple[int, ...]]]] = {
+    "cnn2d": cnn2d,
+    "resnet18": resnet18,
+}
+
+
+@click.command()
+@click.option("--model", "model_name", type=click.Choice(list(models)), default="cnn2d")
+@click.option("--batch-size", "batch_size", type=int, default=32)
+@click.option("--fine", "fine", is_flag=True, help="consider every valid graph node")
+@click.option("--repeat", "repeat", type=int, default=5)
+@click.option("--min-time", "min_time", type=float, default=0.2)
+@click.option("--threads", "threads", type=int, default=None, help="torch threads")
+# link and fleet
+@click.option(
+    "--client-speed",
+    "client_speeds",
+    type=float,
+    multiple=True,
+    default=[1.0],
+    help="client speed relative to this machine (0.1: ten times slower), repeatable",
+)
+@click.option("--server-speed", "server_speed", type=float, default=1.0)
+@click.option("--bandwidth-mbps", "bandwidth_mbps", type=float, default=100.0)
+@click.option(
+    "--upload-mbps",
+    "upload_mbps",
+    type=float,
+    default=None,
+    help="upload bandwidth, if lower than --bandwidth-mbps",
+)
+@click.option("--rtt-ms", "rtt_ms", type=float, default=20.0)
+@click.option(
+    "--activation-codec",
+    "activation_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+)
+@click.option(
+    "--grad-codec", "grad_codec", type=click.Choice(list(codecs)), default="raw"
+)
+@click.option(
+    "-o",
+    "--output",
+    "output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write profiles and recommendations as json",
+)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(
+    model_name: str,
+    batch_size: int,
+    fine: bool,
+    repeat: int,
+    min_time: float,
+    threads: Optional[int],
+    client_speeds: Tuple[float, ...],
+    server_speed: float,
+    bandwidth_mbps: float,
+    upload_mbps: Optional[float],
+    rtt_ms: float,
+    activation_codec: str,
+    grad_codec: str,
+    output: Optional[str],
+    log_level: int,
+):
+    """Profile the cut points of a model and recommend one per client speed."""
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+    if threads is not None:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+
+    model, input_shape = models[model_name]()
+    inputs = torch.randn(batch_size, *input_shape)
+    labels = torch.randint(0, 10, (batch_size,))
+
+    profiles = []
+    for cut in candidate_cuts(model, fine=fine):
+        _logger.info(f"Profiling {model_name} cut after {cut} ...")
+        profiles.append(
+            profile_cut(
+                model,
+                cut,
+                inputs,
+                labels,
+                activation_codec=activation_codec,
+                grad_codec=grad_codec,
+                repeat=repeat,
+                min_time=min_time,
+            )
+        )
+
+    link = dict(
+        server_speed=server_speed,
+        bandwidth=bandwidth_mbps * 1e6,
+        upload_bandwidth=upload_mbps * 1e6 if upload_mbps is not None else None,
+        rtt=rtt_ms / 1000,
+    )
+    estimates = {
+        speed: [estimate_step_time(p, client_speed=speed, **link) for p in profiles]
+        for speed in client_speeds
+    }
+    best = {
+        speed: recommend_cut(profiles, client_speed=speed, **link).cut
+        for speed in client_speeds
+    }
+
+    width = max([len(p.cut) for p in profiles] + [3]) + 2
+    header = (
+        f"{'cut':<{width}}{'KB/sample':>10}{'client MFLOP':>14}{'client ms':>11}"
+        f"{'server MFLOP':>14}{'server ms':>11}{'up KB':>9}{'down KB':>9}"
+    )
+    header += "".join(f"{f'x{speed:g} ms':>12}" for speed in client_speeds)
+    print(header)
+    for i, p in enumerate(profiles):
+        row = (
+            f"{p.cut:<{width}}{p.activation_bytes_per_sample / 1e3:>10.2f}"
+            f"{p.client_flops / 1e6:>14.1f}{1000 * p.client_s:>11.2f}"
+            f"{p.server_flops / 1e6:>14.1f}{1000 * p.server_s:>11.2f}"
+            f"{p.upload_bytes / 1e3:>9.1f}{p.download_bytes / 1e3:>9.1f}"
+        )
+        for speed in client_speeds:
+            mark = "*" if best[speed] == p.cut else " "
+            row += f"{1000 * estimates[speed][i]:>11.2f}{mark}"
+        print(row)
+    print()
+    for speed in client_speeds:
+        print(f"client speed x{speed:g}: cut after {best[speed]}")
+
+    if output is not None:
+        report = {
+            "model": model_name,
+            "link": link,
+            "profiles": [p.dict() for p in profiles],
+            "estimates": {
+                str(speed): dict(zip([p.cut for p in profiles], times))
+                for speed, times in estimates.items()
+            },
+            "recommended": {str(speed): cut for speed, cut in best.items()},
+        }
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        _logger.info(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
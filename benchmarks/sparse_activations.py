@@ -0,0 +1,119 @@
+import logging
+import sys
+import time
+
+import click
+import torch
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+import split_learning
+from split_learning.models.vision.cnn_2d import CNN2DClient
+from split_learning.utils import datasets as datasets
+from split_learning.utils.serde import codecs, encode_tensor, get_codec
+
+# logger
+_logger = logging.getLogger(__name__)
+
+
+def time_codec(codec: str, activations, repeat: int):
+    payloads, metas = zip(*[encode_tensor(a, codec) for a in activations])
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for a in activations:
+            encode_tensor(a, codec)
+    encode_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for payload, meta in zip(payloads, metas):
+            get_codec(codec).decode(payload, meta)
+    decode_time = (time.perf_counter() - start) / repeat
+
+    decoded = [get_codec(codec).decode(p, m) for p, m in zip(payloads, metas)]
+    lossless = all(torch.equal(a, d) for a, d in zip(activations, decoded))
+    encoded_bytes = sum(memoryview(p).nbytes for p in payloads)
+    return encoded_bytes, encode_time, decode_time, lossless
+
+
+@click.command()
+@click.option("--batch-size", "batch_size", type=int, default=128)
+@click.option("--num-batches", "num_batches", type=int, default=20)
+@click.option("--repeat", "repeat", type=int, default=3)
+@click.option(
+    "--eval-mode",
+    "eval_mode",
+    is_flag=True,
+    help="disable dropout (inference activations)",
+)
+@click.option(
+    "--codec",
+    "codec_names",
+    type=click.Choice(list(codecs)),
+    multiple=True,
+    default=[c for c in codecs if c == "raw" or c.startswith("sparse")],
+)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(
+    batch_size: int,
+    num_batches: int,
+    repeat: int,
+    eval_mode: bool,
+    codec_names: tuple,
+    log_level: int,
+):
+    """Compression ratio and throughput of sparse codecs on CNN2DClient outputs."""
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+
+    # dataset
+    mnist_transform = transforms.Compose(
+        [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
+    )
+    dataset_mnist = datasets.mnist(split="test", transform=mnist_transform)
+    loader = DataLoader(dataset_mnist, batch_size=batch_size, shuffle=True)
+
+    # activations
+    model = CNN2DClient(in_channels=1, dim_out=10, img_size=28)
+    model.train(not eval_mode)
+    activations = []
+    with torch.no_grad():
+        for i, data in enumerate(loader):
+            if i >= num_batches:
+                break
+            activations.append(model(data["image"]).contiguous())
+
+    dense_bytes = sum(a.numel() * a.element_size() for a in activations)
+    zeros = sum(int((a == 0).sum()) for a in activations)
+    total = sum(a.numel() for a in activations)
+    _logger.info(
+        f"{len(activations)} batches of {tuple(activations[0].shape)}, "
+        f"{zeros / total:.1%} zeros"
+    )
+
+    print(
+        f"{'codec':<14}{'ratio':>8}{'encode MB/s':>14}{'decode MB/s':>14}"
+        f"{'lossless':>10}"
+    )
+    for codec in codec_names:
+        encoded_bytes, encode_time, decode_time, lossless = time_codec(
+            codec, activations, repeat
+        )
+        print(
+            f"{codec:<14}{dense_bytes / encoded_bytes:>8.2f}"
+            f"{dense_bytes / encode_time / 1e6:>14.1f}"
+            f"{dense_bytes / decode_time / 1e6:>14.1f}"
+            f"{str(lossless):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
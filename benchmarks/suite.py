@@ -0,0 +1,335 @@
+import json
+import logging
+import platform
+import sys
+import timeit
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import click
+import torch
+from torch import nn
+
+import split_learning
+from split_learning.models.vision.cnn_2d import CNN2DClient, CNN2DServer
+from split_learning.models.vision.resnet import ResNet18Client, ResNet18Server
+from split_learning.schemas.message import MessageType, WSMessage
+from split_learning.utils.metrics import percentile
+from split_learning.utils.serde import (
+    decode_message_b64,
+    decode_message_frame,
+    deserialize_tensor,
+    encode_message_b64,
+    encode_message_frame,
+    serialize_tensor,
+    tensor_meta,
+)
+
+# logger
+_logger = logging.getLogger(__name__)
+
+# ResNet18 children: conv1, bn1, relu, maxpool, layer1-4, avgpool, fc
+RESNET18_CUT_LAYERS = list(range(9))
+
+# (cut layer, client, server, input shape without the batch dimension)
+Split = Tuple[int, nn.Module, nn.Module, Tuple[int, ...]]
+
+
+def cnn2d_splits() -> Iterator[Split]:
+    model_kwargs = dict(in_channels=1, dim_out=10, img_size=28)
+    client, server = CNN2DClient(**model_kwargs), CNN2DServer(**model_kwargs)
+    yield client.cut_layer, client, server, (1, 28, 28)
+
+
+def resnet18_splits() -> Iterator[Split]:
+    # the CIFAR-10 variant, as trained in the demo
+    for cut_layer in RESNET18_CUT_LAYERS:
+        client = ResNet18Client(cut_layer, conv1_swap=True)
+        server = ResNet18Server(cut_layer, num_classes=10)
+        yield cut_layer, client, server, (3, 32, 32)
+
+
+models: Dict[str, Callable[[], Iterator[Split]]] = {
+    "cnn2d": cnn2d_splits,
+    "resnet18": resnet18_splits,
+}
+
+
+# cases
+
+
+def serde_cases(
+    activations: torch.Tensor, labels: torch.Tensor
+) -> Iterator[Tuple[str, Callable[[], object], int]]:
+    """(name, function, bytes processed) for each serialization step."""
+    payload = serialize_tensor(activations)
+    nbytes = payload.nbytes
+    fields = dict(
+        type=MessageType.ACTIVATIONS_AND_LABELS,
+        data={"seq": 0},
+        raw={"tensor": payload, "labels": serialize_tensor(labels)},
+        meta={"tensor": tensor_meta(activations), "labels": tensor_meta(labels)},
+    )
+    message = WSMessage(**fields)
+    b64 = encode_message_b64(message)
+    frame = bytes(encode_message_frame(message))
+    # as received from a transport
+    received = bytes(payload)
+
+    yield "serialize_tensor", lambda: serialize_tensor(activations), nbytes
+    yield "deserialize_tensor", lambda: deserialize_tensor(received), nbytes
+    yield "validate_message", lambda: WSMessage(**fields), nbytes
+    yield "encode_message_b64", lambda: encode_message_b64(message), nbytes
+    yield "decode_message_b64", lambda: decode_message_b64(b64), nbytes
+    yield "encode_message_frame", lambda: encode_message_frame(message), nbytes
+    yield "decode_message_frame", lambda: decode_message_frame(frame), nbytes
+
+
+def model_cases(
+    client: nn.Module, server: nn.Module, inputs: torch.Tensor, labels: torch.Tensor
+) -> Iterator[Tuple[str, Callable[[], object], int]]:
+    """(name, function, bytes processed) for each half, forward and backward."""
+    client.train()
+    server.train()
+    with torch.no_grad():
+        activations = client(inputs)
+    grads = torch.randn_like(activations)
+    nbytes = activations.numel() * activations.element_size()
+
+    def client_backward():
+        client.zero_grad(set_to_none=True)
+        client(inputs).backward(grads)
+
+    def server_backward():
+        server.zero_grad(set_to_none=True)
+        received = activations.detach().requires_grad_()
+        # halves can start with an in-place op (ResNet's ReLU), not allowed on leaves
+        outputs = server(received.clone())
+        nn.functional.cross_entropy(outputs, labels).backward()
+
+    yield "client/forward", lambda: client(inputs), nbytes
+    yield "client/forward_backward", client_backward, nbytes
+    yield "server/forward", lambda: server(activations), nbytes
+    yield "server/forward_backward", server_backward, nbytes
+
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """Median and min time per call, over `repeat` runs of at least `min_time`."""
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    loops = max(1, int(loops * min_time / 0.2))
+    times = sorted(t / loops for t in timer.repeat(repeat, loops))
+    return {
+        "median_s": percentile(times, 0.5),
+        "min_s": times[0],
+        "runs": repeat,
+        "loops": loops,
+    }
+
+
+def environment() -> dict:
+    return {
+        "split_learning": split_learning.__version__,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "threads": torch.get_num_threads(),
+    }
+
+
+# regressions
+
+
+def compare_results(
+    baseline: dict, current: dict, threshold: float
+) -> List[Tuple[str, float, float, float, str]]:
+    """(name, baseline, current, ratio, status) for benchmarks in both runs."""
+    rows = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        if baseline["results"][name].get("shape") != result.get("shape"):
+            _logger.warning(f"Skipping {name}: shapes differ from the baseline")
+            continue
+        before, after = baseline["results"][name]["median_s"], result["median_s"]
+        ratio = after / before if before > 0 else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = ""
+        rows.append((name, before, after, ratio, status))
+    return rows
+
+
+def print_comparison(rows: List[Tuple[str, float, float, float, str]]) -> int:
+    width = max([len(r[0]) for r in rows] + [9]) + 2
+    print(f"{'benchmark':<{width}}{'base ms':>12}{'now ms':>12}{'ratio':>8}")
+    for name, before, after, ratio, status in rows:
+        row = f"{name:<{width}}{1000 * before:>12.3f}{1000 * after:>12.3f}{ratio:>8.2f}"
+        print(f"{row}  {status}".rstrip())
+    regressions = [r for r in rows if r[4] == "regression"]
+    if regressions:
+        _logger.warning(f"{len(regressions)} of {len(rows)} benchmarks regressed")
+    return len(regressions)
+
+
+def setup_logging(log_level: int):
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+
+
+@click.group()
+@click.version_option(split_learning.__version__)
+def main():
+    """Serialization and model micro-benchmarks, with regression checks."""
+
+
+@main.command()
+@click.option(
+    "--model",
+    "model_names",
+    type=click.Choice(list(models)),
+    multiple=True,
+    default=list(models),
+)
+@click.option("--batch-size", "batch_size", type=int, default=32)
+@click.option("--repeat", "repeat", type=int, default=5)
+@click.option(
+    "--min-time",
+    "min_time",
+    type=float,
+    default=0.2,
+    help="minimum seconds per timed run",
+)
+@click.option("--threads", "threads", type=int, default=None, help="torch threads")
+@click.option("--skip-models", "skip_models", is_flag=True, help="serde only")
+@click.option(
+    "-k",
+    "--filter",
+    "pattern",
+    type=str,
+    default=None,
+    help="only run benchmarks whose name contains this",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write results as json",
+)
+@click.option(
+    "--baseline",
+    "baseline_path",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="compare against saved results, failing on regressions",
+)
+@click.option("--threshold", "threshold", type=float, default=0.1)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+def run(
+    model_names: tuple,
+    batch_size: int,
+    repeat: int,
+    min_time: float,
+    threads: Optional[int],
+    skip_models: bool,
+    pattern: Optional[str],
+    output: Optional[str],
+    baseline_path: Optional[str],
+    threshold: float,
+    log_level: int,
+):
+    """Run the benchmarks on CPU."""
+    setup_logging(log_level)
+    if threads is not None:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+
+    results = {}
+    print(f"{'benchmark':<60}{'median ms':>12}{'min ms':>12}{'MB/s':>10}")
+    for model_name in model_names:
+        for cut_layer, client, server, input_shape in models[model_name]():
+            inputs = torch.randn(batch_size, *input_shape)
+            labels = torch.randint(0, 10, (batch_size,))
+            with torch.no_grad():
+                activations = client.eval()(inputs).contiguous()
+            _logger.info(f"{model_name} cut {cut_layer}: {tuple(activations.shape)}")
+
+            prefix = f"{model_name}/cut{cut_layer}"
+            cases = [
+                (f"serde/{prefix}/{n}", f, b)
+                for n, f, b in serde_cases(activations, labels)
+            ]
+            if not skip_models:
+                cases += [
+                    (f"model/{prefix}/{n}", f, b)
+                    for n, f, b in model_cases(client, server, inputs, labels)
+                ]
+
+            for name, fn, nbytes in cases:
+                if pattern is not None and pattern not in name:
+                    continue
+                result = measure(fn, repeat, min_time)
+                result.update(
+                    nbytes=nbytes, shape=list(activations.shape), batch_size=batch_size
+                )
+                results[name] = result
+                print(
+                    f"{name:<60}{1000 * result['median_s']:>12.3f}"
+                    f"{1000 * result['min_s']:>12.3f}"
+                    f"{nbytes / result['median_s'] / 1e6:>10.1f}"
+                )
+
+    report = {"environment": environment(), "results": results}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        _logger.info(f"Results written to {output}")
+
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print()
+        if print_comparison(compare_results(baseline, report, threshold)):
+            sys.exit(1)
+
+
+@main.command()
+@click.argument("baseline_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    "threshold",
+    type=float,
+    default=0.1,
+    help="slowdown of the median (fraction) counted as a regression",
+)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+def compare(baseline_path: str, current_path: str, threshold: float, log_level: int):
+    """Compare two result files, exiting with 1 on regressions."""
+    setup_logging(log_level)
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    if baseline["environment"] != current["environment"]:
+        _logger.warning("Results come from different environments")
+    if print_comparison(compare_results(baseline, current, threshold)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import multiprocessing
+import sys
+import time
+
+import click
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from uvicorn import Config, Server
+
+import split_learning
+from split_learning.transport import tcp
+from split_learning.transport.base import use_uvloop
+from split_learning.transport.connect import connect
+from split_learning.utils.metrics import percentile
+
+# logger
+_logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+
+
+def serve_websocket(port: int, loop: str):
+    """Echo server on the same stack as `scripts/server.py` (FastAPI, uvicorn)."""
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        try:
+            while True:
+                await websocket.send_bytes(await websocket.receive_bytes())
+        except WebSocketDisconnect:
+            pass
+
+    config = Config(
+        app=app, host=HOST, port=port, ws_max_size=2**31, loop=loop, log_level="error"
+    )
+    Server(config=config).run()
+
+
+def serve_tcp(port: int, loop: str):
+    async def echo(connection: tcp.TcpConnection):
+        try:
+            while True:
+                await connection.send(await connection.recv())
+        except ConnectionError:
+            pass
+
+    async def main():
+        server = await tcp.serve(echo, HOST, port)
+        await server.serve_forever()
+
+    if loop == "uvloop":
+        use_uvloop()
+    asyncio.run(main())
+
+
+async def round_trips(uri: str, size: int, steps: int, warmup: int):
+    payload = bytes(size)
+    times = []
+    async with await connect(uri, max_size=None) as connection:
+        for _ in range(warmup + steps):
+            start = time.perf_counter()
+            await connection.send(payload)
+            await connection.recv()
+            times.append(time.perf_counter() - start)
+    return sorted(times[warmup:])
+
+
+async def wait_for(uri: str, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = await connect(uri)
+            await connection.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+@click.command()
+@click.option(
+    "--size",
+    "sizes",
+    type=int,
+    multiple=True,
+    default=[1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024],
+    help="message sizes in bytes",
+)
+@click.option("--steps", "steps", type=int, default=200)
+@click.option("--warmup", "warmup", type=int, default=20)
+@click.option("--port", "port", type=int, default=8100)
+@click.option(
+    "--loop",
+    "loop",
+    type=click.Choice(["asyncio", "uvloop"]),
+    default="asyncio",
+)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(sizes: tuple, steps: int, warmup: int, port: int, loop: str, log_level: int):
+    """Loopback echo latency and throughput of the websocket and TCP transports."""
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+    if loop == "uvloop" and not use_uvloop():
+        raise click.UsageError("uvloop is not installed")
+
+    transports = {
+        "websocket": (serve_websocket, f"ws://{HOST}:{port}/ws"),
+        "tcp": (serve_tcp, f"tcp://{HOST}:{port + 1}"),
+    }
+
+    print(
+        f"{'transport':<11}{'size':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'msgs/s':>10}{'MB/s':>10}"
+    )
+    for i, (name, (serve, uri)) in enumerate(transports.items()):
+        server = multiprocessing.Process(
+            target=serve, args=(port + i, loop), daemon=True
+        )
+        server.start()
+        try:
+            asyncio.run(wait_for(uri))
+            for size in sizes:
+                times = asyncio.run(round_trips(uri, size, steps, warmup))
+                total = sum(times)
+                print(
+                    f"{name:<11}{size:>10}"
+                    f"{1000 * percentile(times, 0.5):>10.3f}"
+                    f"{1000 * percentile(times, 0.99):>10.3f}"
+                    f"{len(times) / total:>10.1f}"
+                    f"{2 * size * len(times) / total / 1e6:>10.1f}"
+                )
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import timeit
+from typing import List, Optional, Sequence
+
+import torch
+from torch import nn
+from torch.utils.flop_counter import FlopCounterMode
+
+from split_learning.models.splitter import cut_points, split_model
+from split_learning.schemas.planner import CutProfile
+from split_learning.utils.metrics import percentile
+from split_learning.utils.serde import encode_tensor
+
+# A training step is estimated as: client forward/backward, upload of the
+# activations and labels, server forward/backward, download of the gradients
+# and one round trip of latency. Compute times are measured locally and scaled
+# by the relative speed of each side, transfers by the link bandwidth.
+
+
+def candidate_cuts(model: nn.Module, fine: bool = False) -> List[str]:
+    """Valid cuts after the model's children (or after any node with `fine`).
+
+    The last node is left out, a server half needs something to compute.
+    """
+    if fine:
+        return cut_points(model)[:-1]
+    children = [name for name, _ in model.named_children()]
+    return [name for name in cut_points(model, children)[:-1] if name in children]
+
+
+def _median_time(fn, repeat: int, min_time: float) -> float:
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    loops = max(1, int(loops * min_time / 0.2))
+    return percentile(sorted(t / loops for t in timer.repeat(repeat, loops)), 0.5)
+
+
+def _count_flops(fn) -> int:
+    with FlopCounterMode(display=False) as counter:
+        fn()
+    return counter.get_total_flops()
+
+
+def profile_cut(
+    model: nn.Module,
+    cut: str,
+    inputs: torch.Tensor,
+    labels: torch.Tensor,
+    activation_codec: str = "raw",
+    grad_codec: str = "raw",
+    repeat: int = 5,
+    min_time: float = 0.2,
+) -> CutProfile:
+    """Time and count the forward/backward of both halves of `model` cut at `cut`."""
+    client, server = split_model(model, [cut])
+    client.train()
+    server.train()
+
+    activations = client(inputs).detach()
+    grads = torch.randn_like(activations)
+
+    def client_step():
+        client.zero_grad(set_to_none=True)
+        client(inputs).backward(grads)
+
+    def server_step():
+        server.zero_grad(set_to_none=True)
+        received = activations.clone().requires_grad_()
+        # halves can start with an in-place op (ResNet's ReLU), not allowed on leaves
+        outputs = server(received.clone())
+        nn.functional.cross_entropy(outputs, labels).backward()
+        return received.grad
+
+    server_grads = server_step()
+    upload, _ = encode_tensor(activations.contiguous(), activation_codec)
+    labels_payload, _ = encode_tensor(labels)
+    download, _ = encode_tensor(server_grads.contiguous(), grad_codec)
+    activation_bytes = memoryview(upload).nbytes
+
+    profile = CutProfile(
+        cut=cut,
+        batch_size=inputs.shape[0],
+        activation_shape=list(activations.shape),
+        client_flops=_count_flops(client_step),
+        server_flops=_count_flops(server_step),
+        client_s=_median_time(client_step, repeat, min_time),
+        server_s=_median_time(server_step, repeat, min_time),
+        activation_bytes=activation_bytes,
+        upload_bytes=activation_bytes + memoryview(labels_payload).nbytes,
+        download_bytes=memoryview(download).nbytes,
+    )
+    model.zero_grad(set_to_none=True)
+    return profile
+
+
+def estimate_step_time(
+    profile: CutProfile,
+    client_speed: float = 1.0,
+    server_speed: float = 1.0,
+    bandwidth: float = 100e6,
+    rtt: float = 0.02,
+    upload_bandwidth: Optional[float] = None,
+) -> float:
+    """Estimated seconds per training step.
+
+    Speeds are relative to the profiling machine (0.1: ten times slower),
+    bandwidths in bits per second (`upload_bandwidth` defaults to `bandwidth`)
+    and the round trip time in seconds.
+    """
+    upload_bandwidth = upload_bandwidth or bandwidth
+    return (
+        profile.client_s / client_speed
+        + 8 * profile.upload_bytes / upload_bandwidth
+        + profile.server_s / server_speed
+        + 8 * profile.download_bytes / bandwidth
+        + rtt
+    )
+
+
+def recommend_cut(profiles: Sequence[CutProfile], **link) -> CutProfile:
+    """The cut with the lowest estimated step time (see `estimate_step_time`)."""
+    return min(profiles, key=lambda p: estimate_step_time(p, **link))
@@ -0,0 +1,157 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from torch import fx, nn
+
+# A model is traced with torch.fx and its graph partitioned at named nodes, so
+# functional ops in `forward` (flatten, residual adds, ...) stay in the half
+# that runs them, unlike slicing `children()`. Each cut must leave exactly one
+# tensor live across it: the activations exchanged between client and server.
+
+
+class _SplitTracer(fx.Tracer):
+    """Keeps the modules named as cut points as single (leaf) nodes."""
+
+    def __init__(self, leaves: Sequence[str]):
+        super().__init__()
+        self.leaves = set(leaves)
+
+    def is_leaf_module(self, m: nn.Module, module_qualified_name: str) -> bool:
+        return module_qualified_name in self.leaves or super().is_leaf_module(
+            m, module_qualified_name
+        )
+
+
+def trace(model: nn.Module, leaves: Sequence[str] = ()) -> fx.GraphModule:
+    """Symbolically trace `model`, keeping the submodules in `leaves` whole."""
+    tracer = _SplitTracer(leaves)
+    graph = tracer.trace(model)
+    return fx.GraphModule(tracer.root, graph, model.__class__.__name__)
+
+
+def cut_points(model: nn.Module, leaves: Sequence[str] = ()) -> List[str]:
+    """Names of the nodes `model` can be cut after, in execution order."""
+    graph_module = trace(model, leaves)
+    nodes = list(graph_module.graph.nodes)
+    return [
+        node.name
+        for i, node in enumerate(nodes)
+        if node.op not in ("placeholder", "output") and _is_cut(nodes, i)
+    ]
+
+
+def _is_cut(nodes: List[fx.Node], index: int) -> bool:
+    """Whether the output of `nodes[index]` is all that later nodes depend on."""
+    later = set(nodes[index + 1 :])
+    return all(
+        node is nodes[index] or not (set(node.users) & later)
+        for node in nodes[: index + 1]
+    )
+
+
+def _find_node(nodes: List[fx.Node], name: str) -> int:
+    for i, node in enumerate(nodes):
+        if node.name == name or (node.op == "call_module" and node.target == name):
+            return i
+    raise ValueError(f"Invalid cut point: {name}")
+
+
+def split_model(
+    model: nn.Module,
+    cuts: Sequence[str],
+    example_inputs: Optional[Tuple[torch.Tensor, ...]] = None,
+    **tolerances,
+) -> List[fx.GraphModule]:
+    """Split `model` after each node (or submodule) named in `cuts`.
+
+    Returns one part more than there are cuts, e.g. client and server halves,
+    or front, middle and back for U-shape. Parts share the parameters of
+    `model`. With `example_inputs`, the chained parts are checked to match the
+    unsplit model (see `verify_split`).
+    """
+    graph_module = trace(model, leaves=cuts)
+    nodes = list(graph_module.graph.nodes)
+    indices = [_find_node(nodes, name) for name in cuts]
+    if indices != sorted(set(indices)):
+        raise ValueError(f"Cut points are not in execution order: {list(cuts)}")
+    for name, index in zip(cuts, indices):
+        if not _is_cut(nodes, index):
+            raise ValueError(f"Cannot cut at {name}, later nodes use earlier values")
+
+    output = next(n for n in nodes if n.op == "output")
+    inputs = [n for n in nodes if n.op == "placeholder"]
+    body = [n for n in nodes if n.op not in ("placeholder", "output")]
+    # each part runs the nodes after the previous cut, up to and including its own
+    bounds = [body.index(nodes[i]) + 1 for i in indices]
+    parts = []
+    for part, (start, end) in enumerate(zip([0] + bounds, bounds + [len(body)])):
+        graph = fx.Graph()
+        env: Dict[fx.Node, fx.Node] = {}
+        if part == 0:
+            for node in inputs:
+                env[node] = graph.node_copy(node)
+        else:
+            env[nodes[indices[part - 1]]] = graph.placeholder("x")
+        for node in body[start:end]:
+            env[node] = graph.node_copy(node, lambda n: env[n])
+        if part < len(indices):
+            graph.output(env[nodes[indices[part]]])
+        else:
+            graph.output(fx.map_arg(output.args[0], lambda n: env[n]))
+        graph.lint()
+        parts.append(
+            fx.GraphModule(graph_module, graph, f"{model.__class__.__name__}{part}")
+        )
+
+    if example_inputs is not None:
+        verify_split(model, parts, example_inputs, **tolerances)
+    return parts
+
+
+def split_children(model: nn.Module, cut_layers: Sequence[int]) -> List[fx.GraphModule]:
+    """Split `model` after each of its children at `cut_layers` (indices)."""
+    names = [name for name, _ in model.named_children()]
+    return split_model(model, [names[i] for i in cut_layers])
+
+
+@torch.no_grad()
+def verify_split(
+    model: nn.Module,
+    parts: Sequence[nn.Module],
+    example_inputs: Tuple[torch.Tensor, ...],
+    rtol: float = 1e-5,
+    atol: float = 1e-6,
+):
+    """Raise if the parts, chained, do not compute the same outputs as `model`.
+
+    Runs in eval mode (dropout off, batch norm on running stats).
+    """
+    modules = [model, *parts]
+    training = [m.training for m in modules]
+    try:
+        for m in modules:
+            m.eval()
+        expected = model(*example_inputs)
+        x = parts[0](*example_inputs)
+        for part in parts[1:]:
+            x = part(x)
+    finally:
+        for m, mode in zip(modules, training):
+            m.train(mode)
+
+    for a, b in zip(_flatten(expected), _flatten(x)):
+        if a.shape != b.shape or not torch.allclose(a, b, rtol=rtol, atol=atol):
+            difference = (a - b).abs().max().item() if a.shape == b.shape else None
+            raise ValueError(
+                "Split model outputs differ from the unsplit model "
+                f"(shapes {tuple(a.shape)} and {tuple(b.shape)}, "
+                f"max difference {difference})"
+            )
+
+
+def _flatten(outputs) -> List[torch.Tensor]:
+    if isinstance(outputs, torch.Tensor):
+        return [outputs]
+    if isinstance(outputs, dict):
+        outputs = list(outputs.values())
+    return [t for o in outputs for t in _flatten(o)]
@@ -1,6 +1,10 @@
+from typing import Tuple
+
 import torch
 import torch.nn as nn
 
+from split_learning.models.splitter import split_children
+
 
 # Model (simple CNN adapted from 'PyTorch: A 60 Minute Blitz')
 # Follows closely to LeNet-5 architecture
@@ -64,15 +68,15 @@ class CNN2DClient(nn.Module):
     def __init__(
         self,
         model: nn.Module = None,
+        cut_layer: int = 1,
         **kwargs,
     ):
         super().__init__()
 
-        self.cut_layer = 1
+        self.cut_layer = cut_layer
 
         self.model = model if model is not None else CNN2D(**kwargs)
-        children = list(self.model.children())[: self.cut_layer + 1]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, [self.cut_layer])[0]
 
     def forward(self, x):
         return self.model(x)
@@ -82,15 +86,72 @@ class CNN2DServer(nn.Module):
     def __init__(
         self,
         model: nn.Module = None,
+        cut_layer: int = 1,
+        **kwargs,
+    ):
+        super().__init__()
+
+        self.cut_layer = cut_layer
+
+        self.model = model if model is not None else CNN2D(**kwargs)
+        self.model = split_children(self.model, [self.cut_layer])[1]
+
+    def forward(self, x: torch.Tensor):
+        return self.model(x)
+
+
+# U-shape
+
+
+class CNN2DFrontClient(nn.Module):
+    def __init__(
+        self,
+        model: nn.Module = None,
+        cut_layer: Tuple[int, int] = (0, 1),
+        **kwargs,
+    ):
+        super().__init__()
+
+        self.cut_layer = cut_layer[0]
+
+        self.model = model if model is not None else CNN2D(**kwargs)
+        self.model = split_children(self.model, cut_layer)[0]
+
+    def forward(self, x: torch.Tensor):
+        return self.model(x)
+
+
+class CNN2DUServer(nn.Module):
+    def __init__(
+        self,
+        model: nn.Module = None,
+        cut_layer: Tuple[int, int] = (0, 1),
+        **kwargs,
+    ):
+        super().__init__()
+
+        self.cut_layer = cut_layer
+
+        self.model = model if model is not None else CNN2D(**kwargs)
+        self.model = split_children(self.model, cut_layer)[1]
+
+    def forward(self, x: torch.Tensor):
+        return self.model(x)
+
+
+class CNN2DBackClient(nn.Module):
+    def __init__(
+        self,
+        model: nn.Module = None,
+        cut_layer: Tuple[int, int] = (0, 1),
         **kwargs,
     ):
         super().__init__()
 
-        self.cut_layer = 1
+        self.cut_layer = cut_layer[1]
 
         self.model = model if model is not None else CNN2D(**kwargs)
-        children = list(self.model.children())[self.cut_layer + 1 :]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, cut_layer)[2]
 
     def forward(self, x: torch.Tensor):
         return self.model(x)
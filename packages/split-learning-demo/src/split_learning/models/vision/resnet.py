@@ -3,6 +3,8 @@ from typing import Tuple
 from torch import nn
 from torchvision import models
 
+from split_learning.models.splitter import split_children
+
 
 class ResNet18Client(nn.Module):
     def __init__(
@@ -23,8 +25,7 @@ class ResNet18Client(nn.Module):
             )
             self.model.maxpool = nn.Identity()
 
-        children = list(self.model.children())[: cut_layer + 1]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, [self.cut_layer])[0]
 
     def forward(self, x):
         return self.model(x)
@@ -49,8 +50,7 @@ class ResNet18Server(nn.Module):
                 nn.Flatten(), nn.Linear(num_ftrs, num_classes)
             )
 
-        children = list(self.model.children())[cut_layer + 1 :]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, [self.cut_layer])[1]
 
     def forward(self, x):
         return self.model(x)
@@ -78,8 +78,7 @@ class ResNet18FrontClient(nn.Module):
             )
             self.model.maxpool = nn.Identity()
 
-        children = list(self.model.children())[: cut_layer + 1]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, cut_layer)[0]
 
     def forward(self, x):
         return self.model(x)
@@ -104,8 +103,7 @@ class ResNet18BackClient(nn.Module):
                 nn.Flatten(), nn.Linear(num_ftrs, num_classes)
             )
 
-        children = list(self.model.children())[cut_layer + 1 :]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, cut_layer)[2]
 
     def forward(self, x):
         return self.model(x)
@@ -123,14 +121,7 @@ class ResNet18UServer(nn.Module):
         self.cut_layer = cut_layer
 
         self.model = model if model is not None else models.resnet18(pretrained=False)
-        children = list(self.model.children())[cut_layer[0] + 1 : cut_layer[1] + 1]
-        self.model = nn.Sequential(*children)
+        self.model = split_children(self.model, cut_layer)[1]
 
     def forward(self, x):
-        for i, l in enumerate(self.model):
-            if i <= self.cut_layer[0]:
-                continue
-            elif i > self.cut_layer[1]:
-                break
-            x = l(x)
-        return nn.functional.softmax(x, dim=1)
+        return self.model(x)
@@ -1,26 +1,49 @@
 import base64
 from enum import Enum
-from typing import Any, Dict
+from typing import Any, Dict, List, Union
 
 from pydantic import BaseModel, validator
 
 
 # enum
+# frame headers encode the type by its position here: append new types only
 class MessageType(str, Enum):
     ACTIVATIONS = "activations"
     ACTIVATIONS_AND_LABELS = "activations_and_labels"
     GRADS = "grads"
     LABELS = "labels"
     LOGITS = "logits"
+    HELLO = "hello"
+    BYE = "bye"
+    # U-shape: the client keeps the first and last layers (and the labels)
+    FRONT_ACTIVATIONS = "front_activations"
+    MIDDLE_ACTIVATIONS = "middle_activations"
+    MIDDLE_GRADS = "middle_grads"
+
+
+class WireFormat(str, Enum):
+    B64_JSON = "b64json"
+    FRAME = "frame"
+
+
+class TensorMeta(BaseModel):
+    dtype: str = "float32"
+    shape: List[int] = []
+    codec: str = "raw"
 
 
 class WSMessage(BaseModel):
     type: MessageType
     data: Dict[str, Any] = {}
-    raw: Dict[str, bytes] = {}
+    raw: Dict[str, Union[bytes, memoryview]] = {}
+    meta: Dict[str, TensorMeta] = {}
 
     class Config:
-        json_encoders = {bytes: lambda x: base64.b64encode(x).decode("utf-8")}
+        arbitrary_types_allowed = True
+        json_encoders = {
+            bytes: lambda x: base64.b64encode(x).decode("utf-8"),
+            memoryview: lambda x: base64.b64encode(x).decode("utf-8"),
+        }
 
     @validator("raw", pre=True)
     def decode_base64(cls, value: Dict[str, str]) -> Dict[str, bytes]:
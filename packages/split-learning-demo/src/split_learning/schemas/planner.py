@@ -0,0 +1,25 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class CutProfile(BaseModel):
+    """Measured cost of one training step with a model cut at `cut`.
+
+    Times are medians on the profiling machine, FLOPs and bytes are per batch.
+    """
+
+    cut: str
+    batch_size: int
+    activation_shape: List[int]
+    client_flops: int
+    server_flops: int
+    client_s: float
+    server_s: float
+    activation_bytes: int
+    upload_bytes: int
+    download_bytes: int
+
+    @property
+    def activation_bytes_per_sample(self) -> float:
+        return self.activation_bytes / self.batch_size
@@ -0,0 +1,16 @@
+from typing import Any, Dict
+
+from pydantic import BaseModel
+
+from split_learning.schemas.message import MessageType, TensorMeta
+
+
+class TraceEvent(BaseModel):
+    """A received message without its payloads, as recorded by the server."""
+
+    time: float
+    client: int
+    type: MessageType
+    data: Dict[str, Any] = {}
+    meta: Dict[str, TensorMeta] = {}
+    nbytes: Dict[str, int] = {}
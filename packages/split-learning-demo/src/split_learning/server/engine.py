@@ -0,0 +1,243 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from split_learning.utils.metrics import percentile
+
+
+def _set_result(future: asyncio.Future, result: Any):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exception: BaseException):
+    if not future.done():
+        future.set_exception(exception)
+
+
+class _Job:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        future: asyncio.Future,
+        fn: Callable,
+        args: tuple,
+        batched: bool = False,
+        max_batch_size: Optional[int] = None,
+        max_batch_delay: Optional[float] = None,
+    ):
+        self.loop = loop
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.batched = batched
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.submitted = time.monotonic()
+
+    def set_result(self, result: Any):
+        self.loop.call_soon_threadsafe(_set_result, self.future, result)
+
+    def set_exception(self, exception: BaseException):
+        self.loop.call_soon_threadsafe(_set_exception, self.future, exception)
+
+
+class BatchStats:
+    """Batch fill and queue delay of the batches run for one batched function."""
+
+    def __init__(self, window: int = 1000):
+        self.batches = 0
+        self.items = 0
+        self.fills = deque(maxlen=window)
+        self.queue_delays = deque(maxlen=window)
+
+    def record(self, size: int, max_size: int, queue_delays: List[float]):
+        self.batches += 1
+        self.items += size
+        self.fills.append(size / max_size)
+        self.queue_delays.extend(queue_delays)
+
+    def summary(self) -> Dict[str, float]:
+        delays = sorted(self.queue_delays)
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / max(self.batches, 1),
+            "mean_fill": sum(self.fills) / max(len(self.fills), 1),
+            "queue_delay_p50_ms": 1000 * percentile(delays, 0.5),
+            "queue_delay_p99_ms": 1000 * percentile(delays, 0.99),
+        }
+
+
+class ComputeEngine:
+    """Runs server compute on a dedicated worker thread, off the event loop.
+
+    Jobs are executed one at a time in submission order, so the model and
+    optimizer are only ever touched from the worker thread. `submit` waits
+    while the queue holds `max_queue_depth` jobs, or while the submitting
+    connection already has `max_pending` jobs queued or running; a
+    connection that stops submitting stops reading from its socket, which
+    pushes back on that client only.
+
+    Jobs submitted with `submit_batched` are coalesced: a run of consecutive
+    batched jobs sharing the same function is collected for up to
+    `max_batch_delay` seconds (or `max_batch_size` jobs) and executed as a
+    single `fn(items)` call, which must return one result per item. Both
+    limits can be overridden per call, and `batch_stats` records batch fill
+    and queue delay per function name.
+    """
+
+    def __init__(
+        self,
+        max_queue_depth: int = 64,
+        max_pending: int = 2,
+        max_batch_size: int = 1,
+        max_batch_delay: float = 0.005,
+        name: str = "compute-engine",
+    ):
+        self.max_queue_depth = max_queue_depth
+        self.max_pending = max_pending
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+
+        self._jobs = queue.Queue()
+        self._next: Optional[_Job] = None
+        self._slots = None
+        self._pending: Dict[Hashable, asyncio.Semaphore] = {}
+        self.batch_stats: Dict[str, BatchStats] = {}
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._worker.start()
+
+    def stop(self):
+        self._jobs.put(None)
+        self._worker.join()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._jobs.qsize()
+
+    def _get(self, timeout: Optional[float] = None) -> Optional[_Job]:
+        if self._next is not None:
+            job, self._next = self._next, None
+            return job
+        return self._jobs.get(timeout=timeout)
+
+    def _limits(self, job: _Job):
+        max_batch_size = job.max_batch_size or self.max_batch_size
+        max_batch_delay = job.max_batch_delay
+        if max_batch_delay is None:
+            max_batch_delay = self.max_batch_delay
+        return max_batch_size, max_batch_delay
+
+    def _collect(self, first: _Job) -> List[_Job]:
+        batch = [first]
+        max_batch_size, max_batch_delay = self._limits(first)
+        deadline = time.monotonic() + max_batch_delay
+        while len(batch) < max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._get(timeout=remaining)
+            except queue.Empty:
+                break
+            # anything else runs right after the batch, keeping the order
+            if job is None or not job.batched or job.fn is not first.fn:
+                self._next = job
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        while True:
+            job = self._get()
+            if job is None:
+                return
+
+            if job.batched:
+                batch = [j for j in self._collect(job) if not j.future.cancelled()]
+                if not batch:
+                    continue
+
+                now = time.monotonic()
+                stats = self.batch_stats.setdefault(job.fn.__name__, BatchStats())
+                stats.record(
+                    len(batch),
+                    self._limits(job)[0],
+                    [now - j.submitted for j in batch],
+                )
+                try:
+                    results = job.fn([j.args[0] for j in batch])
+                except BaseException as e:
+                    for j in batch:
+                        j.set_exception(e)
+                else:
+                    for j, result in zip(batch, results):
+                        j.set_result(result)
+                continue
+
+            if job.future.cancelled():
+                continue
+            try:
+                result = job.fn(*job.args)
+            except BaseException as e:
+                job.set_exception(e)
+            else:
+                job.set_result(result)
+
+    async def _submit(
+        self, key: Hashable, fn: Callable, args: tuple, **job_kwargs
+    ) -> asyncio.Future:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_queue_depth)
+        pending = self._pending.setdefault(key, asyncio.Semaphore(self.max_pending))
+
+        await pending.acquire()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            pending.release()
+            raise
+
+        def release(_):
+            pending.release()
+            self._slots.release()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(release)
+        self._jobs.put(_Job(loop, future, fn, args, **job_kwargs))
+        return future
+
+    async def submit(self, key: Hashable, fn: Callable, *args) -> asyncio.Future:
+        """Queue `fn(*args)` for connection `key`, returning a future for its result."""
+        return await self._submit(key, fn, args, batched=False)
+
+    async def submit_batched(
+        self,
+        key: Hashable,
+        fn: Callable,
+        item: Any,
+        max_batch_size: Optional[int] = None,
+        max_batch_delay: Optional[float] = None,
+    ) -> asyncio.Future:
+        """Queue `item` to be processed by `fn(items)` together with other items."""
+        return await self._submit(
+            key,
+            fn,
+            (item,),
+            batched=True,
+            max_batch_size=max_batch_size,
+            max_batch_delay=max_batch_delay,
+        )
+
+    async def run(self, key: Hashable, fn: Callable, *args) -> Any:
+        return await (await self.submit(key, fn, *args))
+
+    def close(self, key: Hashable):
+        self._pending.pop(key, None)
@@ -0,0 +1,105 @@
+import copy
+import io
+import threading
+import time
+from typing import Optional
+
+import torch
+from torch import nn
+
+try:
+    import onnxruntime as ort
+except ImportError:  # pragma: no cover
+    ort = None
+
+BACKENDS = ["torch", "torchscript", "onnxruntime"]
+
+
+class InferenceReplica:
+    """Frozen copy of a training model, used only for inference.
+
+    The replica is re-snapshotted from the training model every
+    `every_steps` training steps and/or `every_seconds` seconds (checked on
+    each `step`). It never builds autograd graphs and is always in eval
+    mode, so it can run on its own thread while the training model keeps
+    changing. With the `torchscript` or `onnxruntime` backends, each
+    snapshot is exported on its first call, using that call's input.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        every_steps: Optional[int] = None,
+        every_seconds: Optional[float] = None,
+        backend: str = "torch",
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid backend: {backend}")
+        if backend == "onnxruntime" and ort is None:
+            raise ImportError("The onnxruntime backend requires `onnxruntime`")
+
+        self.model = model
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.backend = backend
+
+        self.version = 0
+        self._steps = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        module = copy.deepcopy(getattr(self.model, "module", self.model))
+        module.eval()
+        module.requires_grad_(False)
+
+        with self._lock:
+            self._snapshot = (module, None)
+            self.version += 1
+        self._steps = 0
+        self._refreshed = time.monotonic()
+
+    def step(self):
+        """Count a training step, refreshing the replica when it is due."""
+        self._steps += 1
+        due_steps = self.every_steps is not None and self._steps >= self.every_steps
+        due_seconds = (
+            self.every_seconds is not None
+            and time.monotonic() - self._refreshed >= self.every_seconds
+        )
+        if due_steps or due_seconds:
+            self.refresh()
+
+    def _export(self, module: nn.Module, x: torch.Tensor):
+        if self.backend == "torchscript":
+            with torch.inference_mode():
+                return torch.jit.freeze(torch.jit.trace(module, x))
+
+        buffer = io.BytesIO()
+        torch.onnx.export(
+            module,
+            x,
+            buffer,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        )
+        return ort.InferenceSession(
+            buffer.getvalue(), providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        module, compiled = self._snapshot
+        if self.backend != "torch" and compiled is None:
+            compiled = self._export(module, x)
+            with self._lock:
+                # unless a newer snapshot was taken in the meantime
+                if self._snapshot[0] is module:
+                    self._snapshot = (module, compiled)
+
+        if self.backend == "onnxruntime":
+            (output,) = compiled.run(None, {"input": x.cpu().numpy()})
+            return torch.from_numpy(output)
+
+        with torch.inference_mode():
+            return (compiled or module)(x)
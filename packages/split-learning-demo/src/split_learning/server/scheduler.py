@@ -0,0 +1,63 @@
+from typing import Iterable, List, Optional, Tuple
+
+from split_learning.schemas.message import WSMessage
+from split_learning.transport.mpi import MPITransport
+
+POLICIES = ["round-robin", "first-come", "parallel"]
+
+
+class ClientScheduler:
+    """Decides which client ranks the server receives from next.
+
+    - `round-robin` takes one message from each client in turn, waiting for
+      slow clients.
+    - `first-come` takes the first message to arrive from any client.
+    - `parallel` waits for a message like `first-come`, then also takes the
+      messages already waiting from other clients (up to `max_batch_size`),
+      so they can be processed as one batch.
+
+    Clients are served until each one has been `finish`ed.
+    """
+
+    def __init__(
+        self,
+        transport: MPITransport,
+        clients: Iterable[int],
+        policy: str = "first-come",
+        max_batch_size: Optional[int] = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid policy: {policy}")
+
+        self.transport = transport
+        self.active = list(clients)
+        self.policy = policy
+        self.max_batch_size = max_batch_size or len(self.active)
+        self._turn = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.active)
+
+    def next(self) -> List[Tuple[int, WSMessage]]:
+        if self.policy == "round-robin":
+            self._turn %= len(self.active)
+            source = self.active[self._turn]
+            self._turn += 1
+            return [self.transport.recv(source=source)]
+
+        first = self.transport.probe()
+        sources = [first]
+        if self.policy == "parallel":
+            for source in self.active:
+                if len(sources) >= self.max_batch_size:
+                    break
+                if source != first and self.transport.iprobe(source):
+                    sources.append(source)
+        return [self.transport.recv(source=source) for source in sources]
+
+    def finish(self, client: int):
+        """Stop serving `client`, after it said goodbye."""
+        index = self.active.index(client)
+        if index < self._turn:
+            self._turn -= 1
+        self.active.pop(index)
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Union
+
+from split_learning.schemas.message import WSMessage
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
+
+class Connection:
+    """A client connection exchanging encoded messages, whatever the transport.
+
+    `send` takes encoded messages, or `WSMessage`s when `in_place` is set
+    (they are then encoded straight into the transport's buffers). `recv`
+    returns the next encoded message, which stays valid until the next
+    `recv`.
+    """
+
+    in_place = False
+
+    async def send(self, data: Union[bytes, WSMessage]):
+        raise NotImplementedError
+
+    async def recv(self) -> bytes:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self) -> "Connection":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def use_uvloop() -> bool:
+    """Run new event loops on uvloop, if it is installed."""
+    if uvloop is None:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
@@ -0,0 +1,30 @@
+from typing import Optional
+from urllib.parse import urlparse
+
+from split_learning.transport import shm, tcp, websocket
+from split_learning.transport.base import Connection
+
+SCHEMES = ["ws", "wss", "tcp", "shm"]
+
+
+async def connect(
+    uri: str,
+    max_size: Optional[int] = 64 * 1024 * 1024,
+    capacity: int = 64 * 1024 * 1024,
+) -> Connection:
+    """Connect to a server, with the transport given by the scheme of `uri`.
+
+    - `ws://host:port/path` (or `wss://`) for the websocket endpoint
+    - `tcp://host:port` for length-prefixed frames over raw TCP
+    - `shm:///path/to/socket` for shared memory, from the same host
+
+    `max_size` caps websocket messages, `capacity` sizes shared memory rings.
+    """
+    url = urlparse(uri)
+    if url.scheme in ("ws", "wss"):
+        return await websocket.connect(uri, max_size=max_size)
+    if url.scheme == "tcp":
+        return await tcp.connect(url.hostname, url.port)
+    if url.scheme == "shm":
+        return await shm.connect(url.path, capacity=capacity)
+    raise ValueError(f"Invalid transport: {url.scheme}")
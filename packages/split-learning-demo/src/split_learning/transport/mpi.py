@@ -0,0 +1,173 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from mpi4py import MPI
+
+from split_learning.schemas.message import MessageType, WireFormat, WSMessage
+from split_learning.utils.serde import TensorPool, decode_message, encode_message
+
+# Every message starts with a `TAG_HEADER` message, which is what `probe`
+# looks for. For buffer transports it is a fixed header (the length of the json
+# envelope), followed by the json envelope (type, data, tensor metas and
+# payload sizes) and one buffer per raw payload. Only the header is matched
+# with `MPI.ANY_SOURCE`; the rest is received from the header's source,
+# relying on MPI's ordering between a pair of ranks.
+
+TAG_HEADER = 1
+TAG_ENVELOPE = 2
+TAG_PAYLOAD = 3
+
+HEADER_WORDS = 2
+
+
+class PendingSend:
+    """Requests of a non-blocking send, keeping its buffers alive until done."""
+
+    def __init__(self, requests: List[MPI.Request], buffers: list):
+        self.requests = requests
+        self.buffers = buffers
+
+    def test(self) -> bool:
+        return MPI.Request.Testall(self.requests)
+
+    def wait(self):
+        MPI.Request.Waitall(self.requests)
+        self.buffers = []
+
+
+class MPITransport:
+    """Sends and receives `WSMessage`s between ranks of `comm`.
+
+    `wire_formats` holds the negotiated wire format per peer rank, for
+    transports that encode messages.
+    """
+
+    def __init__(self, comm: MPI.Comm):
+        self.comm = comm
+        self.wire_formats: Dict[int, WireFormat] = {}
+        self._pending: List[PendingSend] = []
+
+    def _track(self, pending: PendingSend) -> PendingSend:
+        self._pending = [p for p in self._pending if not p.test()] + [pending]
+        return pending
+
+    def isend(self, message: WSMessage, dest: int) -> PendingSend:
+        raise NotImplementedError
+
+    def send(self, message: WSMessage, dest: int):
+        self.isend(message, dest).wait()
+
+    def recv(self, source: int = MPI.ANY_SOURCE) -> Tuple[int, WSMessage]:
+        raise NotImplementedError
+
+    def probe(self, source: int = MPI.ANY_SOURCE) -> int:
+        """Wait for a message from `source`, returning the rank it comes from."""
+        status = MPI.Status()
+        self.comm.Probe(source=source, tag=TAG_HEADER, status=status)
+        return status.Get_source()
+
+    def iprobe(self, source: int = MPI.ANY_SOURCE) -> bool:
+        """Whether a message from `source` can be received without waiting."""
+        return self.comm.Iprobe(source=source, tag=TAG_HEADER)
+
+    def release(self, message: WSMessage):
+        """Give back the receive buffers of `message`, once it is no longer used."""
+
+    def flush(self):
+        """Wait for all outstanding sends."""
+        for pending in self._pending:
+            pending.wait()
+        self._pending = []
+
+
+class PickleTransport(MPITransport):
+    """Lowercase `comm.isend`/`comm.recv` of encoded messages (pickled bytes)."""
+
+    def isend(self, message: WSMessage, dest: int) -> PendingSend:
+        encoded = encode_message(
+            message, self.wire_formats.get(dest, WireFormat.B64_JSON)
+        )
+        request = self.comm.isend(encoded, dest=dest, tag=TAG_HEADER)
+        return self._track(PendingSend([request], []))
+
+    def recv(self, source: int = MPI.ANY_SOURCE) -> Tuple[int, WSMessage]:
+        status = MPI.Status()
+        data = self.comm.recv(source=source, tag=TAG_HEADER, status=status)
+        return status.Get_source(), decode_message(data)
+
+
+class BufferTransport(MPITransport):
+    """Uppercase `Isend`/`Recv` of raw payloads, without pickling or base64.
+
+    Payloads are received into reusable byte buffers from `pool`, and the
+    received message's `raw` fields are views of them: tensors deserialized
+    from it share that memory until the message is given back with
+    `release`. Sends are non-blocking; their buffers are kept until MPI is
+    done with them, see `flush`.
+    """
+
+    def __init__(self, comm: MPI.Comm, pool: Optional[TensorPool] = None):
+        super().__init__(comm)
+        self.pool = pool or TensorPool(capacity=8)
+        self._header = np.zeros(HEADER_WORDS, dtype=np.int64)
+        self._buffers: Dict[int, List[torch.Tensor]] = {}
+
+    def isend(self, message: WSMessage, dest: int) -> PendingSend:
+        payloads = [np.frombuffer(v, dtype=np.uint8) for v in message.raw.values()]
+        envelope = json.dumps(
+            {
+                "type": message.type.value,
+                "data": message.data,
+                "meta": {k: m.dict() for k, m in message.meta.items()},
+                "raw": {k: p.nbytes for k, p in zip(message.raw, payloads)},
+            }
+        ).encode("utf-8")
+        header = np.array([len(envelope), len(payloads)], dtype=np.int64)
+
+        requests = [
+            self.comm.Isend([header, MPI.INT64_T], dest=dest, tag=TAG_HEADER),
+            self.comm.Isend([envelope, MPI.BYTE], dest=dest, tag=TAG_ENVELOPE),
+        ]
+        for payload in payloads:
+            requests.append(
+                self.comm.Isend([payload, MPI.BYTE], dest=dest, tag=TAG_PAYLOAD)
+            )
+
+        return self._track(PendingSend(requests, [header, envelope, payloads]))
+
+    def recv(self, source: int = MPI.ANY_SOURCE) -> Tuple[int, WSMessage]:
+        status = MPI.Status()
+        self.comm.Recv(
+            [self._header, MPI.INT64_T], source=source, tag=TAG_HEADER, status=status
+        )
+        source = status.Get_source()
+        envelope_nbytes = int(self._header[0])
+
+        envelope = bytearray(envelope_nbytes)
+        self.comm.Recv([envelope, MPI.BYTE], source=source, tag=TAG_ENVELOPE)
+        envelope = json.loads(envelope)
+
+        raw, buffers = {}, []
+        for key, nbytes in envelope["raw"].items():
+            buffer = self.pool.acquire((nbytes,), dtype=torch.uint8)
+            self.comm.Recv([buffer.numpy(), MPI.BYTE], source=source, tag=TAG_PAYLOAD)
+            raw[key] = memoryview(buffer.numpy())
+            buffers.append(buffer)
+
+        message = WSMessage(
+            type=MessageType(envelope["type"]),
+            data=envelope["data"],
+            raw=raw,
+            meta=envelope["meta"],
+        )
+        self._buffers[id(message)] = buffers
+        return source, message
+
+    def release(self, message: WSMessage):
+        for buffer in self._buffers.pop(id(message), []):
+            self.pool.release(buffer)
+
+
+transports = {"pickle": PickleTransport, "buffer": BufferTransport}
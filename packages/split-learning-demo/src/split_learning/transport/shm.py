@@ -0,0 +1,255 @@
+import asyncio
+import json
+import uuid
+import weakref
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Union
+
+import numpy as np
+
+from split_learning.schemas.message import WSMessage
+from split_learning.transport.base import Connection
+from split_learning.utils.serde import FRAME_ALIGN, encode_message_frame
+
+# Each direction of a connection is a single-producer, single-consumer ring
+# in its own shared memory segment: a control block with the write (`head`)
+# and release (`tail`) counters on separate cache lines, then the data. Every
+# record is a `FRAME_ALIGN` byte header holding its length, followed by the
+# message, so frames written into the ring keep their payloads aligned.
+# Records never wrap around: when one does not fit before the end, a `WRAP`
+# marker sends the reader back to the start.
+#
+# The unix socket the client connects to only carries a json handshake line
+# (the segment names) and then one byte per record written.
+
+CONTROL_SIZE = 2 * FRAME_ALIGN
+WRAP = np.iinfo(np.uint64).max
+NOTIFY = b"\x01"
+
+# segments that tensors decoded in place still map, closed once those are gone
+_lingering: List[shared_memory.SharedMemory] = []
+
+
+class RingFull(BufferError):
+    pass
+
+
+def _align(size: int) -> int:
+    return (size + FRAME_ALIGN - 1) // FRAME_ALIGN * FRAME_ALIGN
+
+
+class ShmRing:
+    """A ring of variable-size records in a shared memory segment."""
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 64 * 1024 * 1024):
+        if name is None:
+            self.capacity = _align(capacity)
+            self.shm = shared_memory.SharedMemory(
+                name=f"split-learning-{uuid.uuid4().hex[:16]}",
+                create=True,
+                size=CONTROL_SIZE + self.capacity,
+            )
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # the creating process owns (and unlinks) the segment
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+            self.capacity = capacity
+            self.owner = False
+
+        buf = self.shm.buf
+        self._head = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=0)
+        self._tail = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=FRAME_ALIGN)
+        self._data = buf[CONTROL_SIZE : CONTROL_SIZE + self.capacity]
+        if self.owner:
+            self._head[0] = self._tail[0] = 0
+
+        # producer: the record being written, as (start, end) counters
+        self._reserved = None
+        # consumer: the next record to read, and the ends of unreleased ones
+        self._cursor = int(self._tail[0])
+        self._unreleased = deque()
+        # records handed out, released on close so the segment can be unmapped
+        self._views: List[weakref.ref] = []
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    # producer
+
+    def reserve(self, size: int) -> memoryview:
+        """Space for a record of `size` bytes, published with `commit`."""
+        head = int(self._head[0])
+        needed = FRAME_ALIGN + _align(size)
+        if needed > self.capacity:
+            raise ValueError(f"Record of {size} bytes exceeds the ring capacity")
+
+        position = head % self.capacity
+        skip = self.capacity - position if position + needed > self.capacity else 0
+        if head + skip + needed - int(self._tail[0]) > self.capacity:
+            raise RingFull()
+
+        if skip:
+            self._header(position)[0] = WRAP
+            position = 0
+        self._reserved = (head + skip, head + skip + needed, size)
+        return self._data[position + FRAME_ALIGN : position + FRAME_ALIGN + size]
+
+    def commit(self):
+        start, end, size = self._reserved
+        self._header(start % self.capacity)[0] = size
+        # publish the record only once it is complete
+        self._head[0] = end
+        self._reserved = None
+
+    # consumer
+
+    def read(self) -> Optional[memoryview]:
+        """The next record, valid until released; None when the ring is empty."""
+        while self._cursor != int(self._head[0]):
+            position = self._cursor % self.capacity
+            size = int(self._header(position)[0])
+            if size == WRAP:
+                self._cursor += self.capacity - position
+                continue
+
+            self._cursor += FRAME_ALIGN + _align(size)
+            self._unreleased.append(self._cursor)
+            record = self._data[position + FRAME_ALIGN : position + FRAME_ALIGN + size]
+            if len(self._views) >= 64:
+                self._views = [view for view in self._views if view() is not None]
+            self._views.append(weakref.ref(record))
+            return record
+        return None
+
+    def release(self):
+        """Free the oldest record returned by `read`."""
+        self._tail[0] = self._unreleased.popleft()
+
+    def _header(self, position: int) -> np.ndarray:
+        return np.ndarray((1,), dtype=np.uint64, buffer=self._data, offset=position)
+
+    def close(self):
+        # the segment can only be unmapped once no view of it is left
+        self._head = self._tail = None
+        for view in [self._data] + [ref() for ref in self._views]:
+            try:
+                if view is not None:
+                    view.release()
+            except BufferError:
+                # a tensor was decoded in place from this record
+                pass
+        self._data = None
+        self._views = []
+
+        for shm in [*_lingering, self.shm]:
+            try:
+                shm.close()
+                if shm in _lingering:
+                    _lingering.remove(shm)
+            except BufferError:
+                if shm not in _lingering:
+                    _lingering.append(shm)
+        if self.owner:
+            # the memory itself is freed once the last mapping is closed
+            self.shm.unlink()
+
+
+class ShmConnection(Connection):
+    """A message connection between two processes on the same host.
+
+    Messages are exchanged through a pair of `ShmRing`s, with a unix socket
+    only used to wake up the reader. `WSMessage`s passed to `send` are
+    encoded as frames directly into shared memory, and `recv` returns a
+    memoryview of the message in shared memory, with no copies.
+
+    With `auto_release`, a received message is freed by the next `recv`;
+    otherwise each one must be freed with `release`, in order.
+    """
+
+    in_place = True
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        send_ring: ShmRing,
+        recv_ring: ShmRing,
+        auto_release: bool = True,
+        poll_interval: float = 0.0005,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.send_ring = send_ring
+        self.recv_ring = recv_ring
+        self.auto_release = auto_release
+        self.poll_interval = poll_interval
+        self._received = 0
+
+    async def _reserve(self, size: int) -> memoryview:
+        while True:
+            try:
+                return self.send_ring.reserve(size)
+            except RingFull:
+                # wait for the peer to release older records
+                await asyncio.sleep(self.poll_interval)
+
+    async def send(self, data: Union[bytes, WSMessage]):
+        if isinstance(data, WSMessage):
+            while True:
+                try:
+                    encode_message_frame(data, allocate=self.send_ring.reserve)
+                    break
+                except RingFull:
+                    await asyncio.sleep(self.poll_interval)
+        else:
+            view = memoryview(data).cast("B")
+            (await self._reserve(view.nbytes))[:] = view
+        self.send_ring.commit()
+
+        self.writer.write(NOTIFY)
+        await self.writer.drain()
+
+    async def recv(self) -> memoryview:
+        if self.auto_release and self._received:
+            self.release()
+        await self.reader.readexactly(1)
+        self._received += 1
+        return self.recv_ring.read()
+
+    def release(self):
+        self._received -= 1
+        self.recv_ring.release()
+
+    async def close(self):
+        self.writer.close()
+        self.send_ring.close()
+        self.recv_ring.close()
+
+
+async def connect(
+    path: str, capacity: int = 64 * 1024 * 1024, **kwargs
+) -> ShmConnection:
+    """Connect to a server listening on the unix socket `path`."""
+    reader, writer = await asyncio.open_unix_connection(path)
+    send_ring, recv_ring = ShmRing(capacity=capacity), ShmRing(capacity=capacity)
+    handshake = {
+        "requests": send_ring.name,
+        "responses": recv_ring.name,
+        "capacity": send_ring.capacity,
+    }
+    writer.write(json.dumps(handshake).encode("utf-8") + b"\n")
+    await writer.drain()
+    return ShmConnection(reader, writer, send_ring, recv_ring, **kwargs)
+
+
+async def accept(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, **kwargs
+) -> ShmConnection:
+    """Attach to the rings of a client that just connected to a unix server."""
+    handshake = json.loads(await reader.readline())
+    recv_ring = ShmRing(handshake["requests"], handshake["capacity"])
+    send_ring = ShmRing(handshake["responses"], handshake["capacity"])
+    return ShmConnection(reader, writer, send_ring, recv_ring, **kwargs)
@@ -0,0 +1,149 @@
+import asyncio
+import socket
+import struct
+from typing import Awaitable, Callable, Optional
+
+from split_learning.transport.base import Connection
+
+# Each message is sent as a little-endian uint64 length followed by the message,
+# so there is no framing, masking or size limit beyond available memory.
+
+LENGTH = struct.Struct("<Q")
+# smaller messages are sent with their length in a single write
+COALESCE_SIZE = 64 * 1024
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """Reads length-prefixed frames straight into buffers of the right size."""
+
+    def __init__(
+        self,
+        on_connect: Optional[Callable[["FrameProtocol"], None]] = None,
+        max_queued: int = 4,
+    ):
+        self.on_connect = on_connect
+        self.max_queued = max_queued
+        self.transport: Optional[asyncio.Transport] = None
+        self.frames = asyncio.Queue()
+        self._reading = True
+
+        self._length = bytearray(LENGTH.size)
+        self._frame: Optional[bytearray] = None
+        self._filled = 0
+
+        self._paused = False
+        self._drain_waiter: Optional[asyncio.Future] = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    # reading
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        buffer = self._length if self._frame is None else self._frame
+        return memoryview(buffer)[self._filled :]
+
+    def buffer_updated(self, nbytes: int):
+        self._filled += nbytes
+        if self._frame is None:
+            if self._filled < LENGTH.size:
+                return
+            (length,) = LENGTH.unpack(self._length)
+            self._frame, self._filled = bytearray(length), 0
+        if self._filled < len(self._frame):
+            return
+
+        self.frames.put_nowait(self._frame)
+        self._frame, self._filled = None, 0
+        if self._reading and self.frames.qsize() >= self.max_queued:
+            self.transport.pause_reading()
+            self._reading = False
+
+    async def get(self) -> Optional[bytearray]:
+        """The next frame, or None once the connection is closed."""
+        frame = await self.frames.get()
+        if not self._reading and self.frames.qsize() < self.max_queued:
+            self.transport.resume_reading()
+            self._reading = True
+        return frame
+
+    def eof_received(self):
+        self.frames.put_nowait(None)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.frames.put_nowait(None)
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(exc or ConnectionResetError())
+
+    # writing
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("Connection closed")
+        if self._paused:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+            await self._drain_waiter
+
+
+class TcpConnection(Connection):
+    """Length-prefixed frames over a TCP stream, with TCP_NODELAY."""
+
+    def __init__(self, protocol: FrameProtocol):
+        self.protocol = protocol
+
+    async def send(self, data: bytes):
+        transport = self.protocol.transport
+        nbytes = memoryview(data).nbytes
+        length = LENGTH.pack(nbytes)
+        if nbytes < COALESCE_SIZE:
+            transport.write(length + data)
+        else:
+            transport.write(length)
+            transport.write(data)
+        await self.protocol.drain()
+
+    async def recv(self) -> bytearray:
+        frame = await self.protocol.get()
+        if frame is None:
+            raise ConnectionResetError("Connection closed")
+        return frame
+
+    async def close(self):
+        self.protocol.transport.close()
+
+
+async def connect(host: str, port: int) -> TcpConnection:
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(FrameProtocol, host, port)
+    return TcpConnection(protocol)
+
+
+async def serve(
+    handler: Callable[[TcpConnection], Awaitable[None]], host: str, port: int
+) -> asyncio.AbstractServer:
+    """Accept connections on `host:port`, running `handler` for each one."""
+    loop = asyncio.get_running_loop()
+    handlers = set()
+
+    def on_connect(protocol: FrameProtocol):
+        task = loop.create_task(handler(TcpConnection(protocol)))
+        # the loop only keeps weak references to tasks
+        handlers.add(task)
+        task.add_done_callback(handlers.discard)
+
+    return await loop.create_server(
+        lambda: FrameProtocol(on_connect=on_connect), host, port
+    )
@@ -0,0 +1,27 @@
+from typing import Optional
+
+import websockets
+
+from split_learning.transport.base import Connection
+
+
+class WebSocketConnection(Connection):
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    async def send(self, data: bytes):
+        await self.websocket.send(data)
+
+    async def recv(self) -> bytes:
+        return await self.websocket.recv()
+
+    async def close(self):
+        await self.websocket.close()
+
+
+async def connect(
+    uri: str, max_size: Optional[int] = 64 * 1024 * 1024
+) -> WebSocketConnection:
+    return WebSocketConnection(
+        await websockets.connect(uri, max_size=max_size, compression=None)
+    )
@@ -0,0 +1,111 @@
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+from torch.nn import functional as F
+from torch.utils.data import default_collate, get_worker_info
+
+# Augmentations of a whole uint8 batch at once: a random crop of the zero
+# padded images (a shift of up to `padding` pixels) and a random rotation are
+# folded into one affine grid per image, sampled with a single grid_sample,
+# then the batch is scaled to [0, 1] and normalized. Equivalent to
+# RandomCrop(size, padding), RandomRotation(degrees), ToTensor and Normalize
+# applied image by image.
+
+
+class BatchAugment:
+    def __init__(
+        self,
+        mean: Sequence[float],
+        std: Sequence[float],
+        padding: int = 0,
+        degrees: float = 0.0,
+        interpolation: str = "nearest",
+        seed: Optional[int] = None,
+    ):
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.padding = padding
+        self.degrees = degrees
+        self.interpolation = interpolation
+        self.seed = seed
+        self.epoch = 0
+        # one generator per data loader worker (None: the main process)
+        self._generators: Dict[Optional[int], torch.Generator] = {}
+
+    def set_epoch(self, epoch: int):
+        """Draw new augmentations in the data loader workers of `epoch`."""
+        self.epoch = epoch
+
+    def _generator(self) -> torch.Generator:
+        worker = get_worker_info()
+        worker_id = worker.id if worker is not None else None
+        if worker_id not in self._generators:
+            generator = torch.Generator()
+            if worker is None:
+                if self.seed is not None:
+                    generator.manual_seed(self.seed)
+                else:
+                    generator.seed()
+            # (non persistent) workers start afresh every epoch, and must not
+            # draw the same augmentations again
+            elif self.seed is not None:
+                generator.manual_seed(
+                    self.seed + 7919 * worker.id + 104729 * self.epoch
+                )
+            else:
+                # differs per worker and per epoch
+                generator.manual_seed(torch.initial_seed())
+            self._generators[worker_id] = generator
+        return self._generators[worker_id]
+
+    def normalize(self, images: torch.Tensor) -> torch.Tensor:
+        """Scale uint8 images to [0, 1] and normalize, without augmenting."""
+        images = images.float() / 255 if images.dtype == torch.uint8 else images
+        return (images - self.mean.to(images.device)) / self.std.to(images.device)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        """Augment and normalize a batch of images (B x C x H x W)."""
+        images = images.float() / 255 if images.dtype == torch.uint8 else images
+        if self.padding or self.degrees:
+            images = self._transform(images)
+        return self.normalize(images)
+
+    def _transform(self, images: torch.Tensor) -> torch.Tensor:
+        batch_size, _, height, width = images.shape
+        generator = self._generator()
+        angles = (torch.rand(batch_size, generator=generator) * 2 - 1) * math.radians(
+            self.degrees
+        )
+        shifts = torch.randint(
+            -self.padding, self.padding + 1, (batch_size, 2), generator=generator
+        )
+
+        # output -> input coordinates, in the normalized [-1, 1] space of
+        # affine_grid: rotate about the center, then shift
+        cos, sin = torch.cos(angles), torch.sin(angles)
+        aspect = height / width
+        theta = torch.empty(batch_size, 2, 3)
+        theta[:, 0, 0] = cos
+        theta[:, 0, 1] = -sin * aspect
+        theta[:, 1, 0] = sin / aspect
+        theta[:, 1, 1] = cos
+        theta[:, 0, 2] = 2 * shifts[:, 0] / width
+        theta[:, 1, 2] = 2 * shifts[:, 1] / height
+
+        grid = F.affine_grid(
+            theta.to(images.device), list(images.shape), align_corners=False
+        )
+        return F.grid_sample(
+            images,
+            grid,
+            mode=self.interpolation,
+            padding_mode="zeros",
+            align_corners=False,
+        )
+
+    def collate(self, examples: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """A `collate_fn` that augments the batched "image" column, in workers."""
+        batch = default_collate(examples)
+        batch["image"] = self(batch["image"])
+        return batch
@@ -0,0 +1,142 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from split_learning.utils import utils
+
+# A cached split is a directory with `images.npy` (uint8, N x H x W or
+# N x H x W x C), `labels.npy` (int64) and `meta.json`. Both arrays are
+# memory-mapped when read, so startup does not decode anything and data
+# loader workers share the same pages.
+
+IMAGES = "images.npy"
+LABELS = "labels.npy"
+META = "meta.json"
+
+
+def cache_path(name: str, split: str) -> Path:
+    return utils.data_path() / "cache" / name.replace("/", "--") / split
+
+
+def is_cached(path: Union[str, Path]) -> bool:
+    return (Path(path) / META).exists()
+
+
+def build_cache(
+    examples: Iterable[Dict[str, Any]],
+    num_examples: int,
+    path: Union[str, Path],
+    image_column: str = "image",
+    label_column: str = "label",
+    mode: Optional[str] = None,
+) -> Path:
+    """Write fixed-size images and their labels as memory-mappable arrays.
+
+    PIL images are converted to `mode` (default: the mode of the first one),
+    as datasets can mix grayscale and RGB images.
+    """
+    path = Path(path)
+    partial = path.with_name(path.name + ".partial")
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+
+    images = labels = None
+    try:
+        for i, example in enumerate(examples):
+            image = example[image_column]
+            if hasattr(image, "convert"):
+                mode = mode or image.mode
+                image = image.convert(mode)
+            image = np.asarray(image, dtype=np.uint8)
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    partial / IMAGES,
+                    mode="w+",
+                    dtype=np.uint8,
+                    shape=(num_examples, *image.shape),
+                )
+                labels = np.lib.format.open_memmap(
+                    partial / LABELS, mode="w+", dtype=np.int64, shape=(num_examples,)
+                )
+            if image.shape != images.shape[1:]:
+                raise ValueError(
+                    f"Only fixed-size images can be cached, got {image.shape} "
+                    f"after {images.shape[1:]}"
+                )
+            images[i] = image
+            labels[i] = example[label_column]
+        if images is None:
+            raise ValueError("No examples to cache")
+        images.flush()
+        labels.flush()
+    except BaseException:
+        # no half written cache is left behind
+        del images, labels
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+
+    meta = {"num_examples": num_examples, "image_shape": list(images.shape[1:])}
+    with open(partial / META, "w") as f:
+        json.dump(meta, f)
+    # readers never see a half written cache
+    shutil.rmtree(path, ignore_errors=True)
+    partial.rename(path)
+    return path
+
+
+class CachedImageDataset(Dataset):
+    """Examples of a cached split, as `{"image": ..., "label": ...}`.
+
+    Images are uint8 tensors (C x H x W), or PIL images when a `transform`
+    is given, as the HF datasets this replaces return.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        transform: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.path = Path(path)
+        self.transform = transform
+        with open(self.path / META) as f:
+            self.meta = json.load(f)
+        self._images = self._labels = None
+
+    def _open(self):
+        # opened lazily, in each worker process
+        self._images = np.load(self.path / IMAGES, mmap_mode="r")
+        self._labels = np.load(self.path / LABELS, mmap_mode="r")
+
+    def __getstate__(self):
+        return {**self.__dict__, "_images": None, "_labels": None}
+
+    @property
+    def images(self) -> np.ndarray:
+        if self._images is None:
+            self._open()
+        return self._images
+
+    @property
+    def labels(self) -> np.ndarray:
+        if self._labels is None:
+            self._open()
+        return self._labels
+
+    def __len__(self) -> int:
+        return self.meta["num_examples"]
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        image = self.images[index]
+        if self.transform is not None:
+            from PIL import Image
+
+            image = self.transform(Image.fromarray(image))
+        else:
+            image = torch.from_numpy(np.array(image))
+            image = image.unsqueeze(0) if image.ndim == 2 else image.permute(2, 0, 1)
+        return {"image": image, "label": int(self.labels[index])}
@@ -1,15 +1,12 @@
 from functools import wraps
-from typing import Any, Callable, Dict, List, Union
-
-from datasets import (
-    Dataset,
-    DatasetDict,
-    IterableDataset,
-    IterableDatasetDict,
-    load_dataset,
-)
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 
 from split_learning.utils import utils
+from split_learning.utils.cache import CachedImageDataset, cache_path, is_cached
+from split_learning.utils.streaming import stream
+
+if TYPE_CHECKING:
+    from datasets import Dataset, DatasetDict, IterableDataset, IterableDatasetDict
 
 # huggingface datasets
 
@@ -29,7 +26,8 @@ def dataset_loader(
 
     def decorator(
         func: Callable[
-            [Any], Union[DatasetDict, Dataset, IterableDatasetDict, IterableDataset]
+            [Any],
+            Union["DatasetDict", "Dataset", "IterableDatasetDict", "IterableDataset"],
         ]
     ):
         @wraps(func)
@@ -41,6 +39,11 @@ def dataset_loader(
             map_func: Callable[[Any], Any] = None,
             map_kwargs: Dict[str, Any] = {},
             rename_columns: Dict[str, str] = None,
+            cache: bool = True,
+            shuffle_buffer: int = 0,
+            seed: Optional[int] = None,
+            num_clients: int = 1,
+            client_index: int = 0,
             **load_dataset_kwargs,
         ):
             format = format_ if format is None else format
@@ -58,6 +61,26 @@ def dataset_loader(
             )
             load_dataset_kwargs = {**load_dataset_kwargs_, **load_dataset_kwargs}
 
+            # read a split from the memory-mapped cache, if converted
+            # (see scripts/cache_datasets.py)
+            split = load_dataset_kwargs.get("split")
+            streaming = load_dataset_kwargs.get("streaming", False)
+            if streaming and not isinstance(split, str):
+                raise ValueError("Streaming datasets are read one split at a time")
+            if (
+                cache
+                and not streaming
+                and isinstance(split, str)
+                and format is None
+                and map_func is None
+            ):
+                path = cache_path(name, split)
+                if is_cached(path):
+                    return func(CachedImageDataset(path, transform=transform))
+
+            # imported here, it takes a while
+            from datasets import load_dataset
+
             # load dataset
             data_dir = utils.data_path() / "external" / name
             hf_load_dataset_kwargs = {"cache_dir": data_dir, **load_dataset_kwargs}
@@ -75,9 +98,27 @@ def dataset_loader(
                         example = map_func(example, *args, **kwargs)
                     return example
 
-                hf_map_kwargs = {"num_proc": 4, **map_kwargs}
+                # streamed examples are mapped lazily, as they are read
+                hf_map_kwargs = (
+                    map_kwargs if streaming else {"num_proc": 4, **map_kwargs}
+                )
                 dataset = dataset.map(map_fn, **hf_map_kwargs)
 
+            # streamed datasets, sharded between clients and shuffled in a buffer
+            if streaming:
+                if format is not None:
+                    dataset = dataset.with_format(format)
+                dataset = stream(
+                    dataset,
+                    transform=transform if format is None else None,
+                    columns=transform_columns,
+                    shuffle_buffer=shuffle_buffer,
+                    seed=seed,
+                    num_clients=num_clients,
+                    client_index=client_index,
+                )
+                return func(dataset)
+
             # set format
             hf_format_kwargs = {"columns": format_columns}
             if format is not None:
@@ -95,6 +136,7 @@ def dataset_loader(
 
             return func(dataset)
 
+        wrapper.dataset_name = name
         return wrapper
 
     return decorator
@@ -0,0 +1,282 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from split_learning.utils.profiling import Span, SpanRecorder
+
+# step phases, in order
+PHASES = [
+    "receive",
+    "decode",
+    "h2d",
+    "forward",
+    "backward",
+    "optimizer",
+    "encode",
+    "send",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted `values`."""
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class PhaseTimer:
+    """Wall time spent in each phase of a step, accumulated across steps.
+
+    Phases may be timed from several threads (e.g. encoding in an executor).
+    With a `recorder`, each phase is also recorded as a span (with `args`).
+    """
+
+    def __init__(self, recorder: Optional[SpanRecorder] = None):
+        self.recorder = recorder
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.steps = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str, **args) -> Iterator[Optional[Span]]:
+        start = time.perf_counter()
+        try:
+            if self.recorder is None:
+                yield None
+            else:
+                with self.recorder.span(name, **args) as span:
+                    yield span
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.totals[name] += seconds
+
+    def step(self):
+        with self._lock:
+            self.steps += 1
+
+    def summary(self, reset: bool = True) -> Dict[str, float]:
+        """Mean milliseconds per step for each phase."""
+        with self._lock:
+            steps = max(self.steps, 1)
+            means = {
+                name: 1000 * self.totals[name] / steps
+                for name in sorted(self.totals, key=_phase_order)
+            }
+            if reset:
+                self.totals.clear()
+                self.steps = 0
+        return means
+
+
+def _phase_order(name: str) -> int:
+    return PHASES.index(name) if name in PHASES else len(PHASES)
+
+
+def format_phases(means: Dict[str, float]) -> str:
+    return ", ".join(f"{name} {ms:.2f}ms" for name, ms in means.items())
+
+
+# prometheus
+#
+# A small subset of the Prometheus text exposition format (counters, gauges
+# and histograms with labels), enough to scrape the server without a client
+# library.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(name suffix, formatted labels, value) for each sample."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [
+                ("", _format_labels(self.labels, k), v) for k, v in self._values.items()
+            ]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, or is read from `function` when scraped.
+
+    `function` returns the values by label values, e.g. `{("train",): 3}`.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[Labels, float]]] = None,
+    ):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.function is None:
+            return super().samples()
+        return [
+            ("", _format_labels(self.labels, k), v) for k, v in self.function().items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets) + [math.inf]
+        # per label values: bucket counts, sum
+        self._values: Dict[Labels, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(
+                        self.labels + ("le",), key + (_format_value(bound),)
+                    )
+                    samples.append(("_bucket", labels, cumulative))
+                labels = _format_labels(self.labels, key)
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = "split_learning"):
+        self.namespace = namespace
+        self.metrics: List[Metric] = []
+
+    def _add(self, metric: Metric) -> Metric:
+        metric.name = f"{self.namespace}_{metric.name}"
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[Labels, float]]] = None,
+    ) -> Gauge:
+        return self._add(Gauge(name, help, labels, function=function))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets=buckets))
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics) + "\n"
@@ -0,0 +1,68 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+import torch
+from torch import nn
+
+T = TypeVar("T")
+
+# prefetching
+
+
+def prefetch(iterable: Iterable[T], depth: int = 2) -> Iterator[T]:
+    """Iterate `iterable` in a background thread, keeping `depth` items ready."""
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer if it is waiting on a full queue
+        while thread.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.01)
+
+
+# weight stashing
+
+
+def stash_parameters(model: nn.Module):
+    """Save copies of `model`'s parameters in autograd graphs built in this context.
+
+    With several micro-batches in flight, optimizer steps update parameters
+    in place before older graphs are backpropagated. Stashing the weights
+    used by each forward (as in PipeDream) keeps those graphs valid, and each
+    backward sees the weights its forward used.
+    """
+    storages = {p.untyped_storage().data_ptr() for p in model.parameters()}
+
+    def pack(tensor: torch.Tensor) -> torch.Tensor:
+        if tensor.untyped_storage().data_ptr() in storages:
+            return tensor.detach().clone()
+        return tensor
+
+    return torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor)
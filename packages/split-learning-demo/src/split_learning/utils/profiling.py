@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+# Spans are written as Chrome trace events ("X" complete events), with wall
+# clock timestamps so that traces recorded by the client and server processes
+# line up once merged. Messages carry a `trace_id` in their data, and flow
+# events ("s" -> "f") named `request` and `response` link the spans that sent
+# and received the same message across processes. Open the (merged) json in
+# chrome://tracing or https://ui.perfetto.dev.
+
+
+def now_us() -> float:
+    return time.time_ns() / 1000
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+def trace_id(session: str, seq: int, part: Optional[str] = None) -> str:
+    """The id of message `seq` of a client session (or of one `part` of its step)."""
+    return f"{session}-{seq}" if part is None else f"{session}-{seq}/{part}"
+
+
+def _flow_id(trace_id: str, direction: str) -> int:
+    digest = hashlib.blake2b(f"{trace_id}/{direction}".encode(), digest_size=6)
+    return int.from_bytes(digest.digest(), "little")
+
+
+class Span:
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = args
+        self.tid = threading.get_ident()
+        self.start = now_us()
+        self.end: Optional[float] = None
+
+
+class SpanRecorder:
+    """Records spans and message flows of one process as Chrome trace events.
+
+    A disabled recorder still hands out spans, but keeps no events.
+    """
+
+    def __init__(self, process_name: str, enabled: bool = True):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._metadata("process_name", process_name)
+
+    def _metadata(self, name: str, value: str, tid: int = 0):
+        self.events.append(
+            {
+                "ph": "M",
+                "name": name,
+                "pid": self.pid,
+                "tid": tid,
+                "args": {"name": value},
+            }
+        )
+
+    def _add(self, event: Dict[str, Any]):
+        with self._lock:
+            if event["tid"] not in self._threads:
+                self._threads.add(event["tid"])
+                self._metadata(
+                    "thread_name", threading.current_thread().name, event["tid"]
+                )
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[Span]:
+        """Time the body as a span; `args` (also settable on the span) are kept."""
+        span = Span(name, args)
+        try:
+            yield span
+        finally:
+            span.end = now_us()
+            if self.enabled:
+                self._add(
+                    {
+                        "ph": "X",
+                        "name": name,
+                        "ts": span.start,
+                        "dur": span.end - span.start,
+                        "pid": self.pid,
+                        "tid": span.tid,
+                        "args": span.args,
+                    }
+                )
+
+    def flow(
+        self,
+        trace_id: Optional[str],
+        direction: str,
+        span: Optional[Span],
+        start: bool,
+        ts: Optional[float] = None,
+    ):
+        """Start (or finish) the `direction` flow of a message inside `span`."""
+        if not self.enabled or trace_id is None or span is None:
+            return
+        event = {
+            "ph": "s" if start else "f",
+            "name": direction,
+            "cat": "message",
+            "id": _flow_id(trace_id, direction),
+            "ts": span.start if ts is None else ts,
+            "pid": self.pid,
+            "tid": span.tid,
+        }
+        if not start:
+            # bind to the enclosing span, rather than the next one
+            event["bp"] = "e"
+        self._add(event)
+
+    def save(self, path: Union[str, Path]):
+        if not self.enabled:
+            return
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def merge_traces(paths: Sequence[Union[str, Path]]) -> Dict[str, Any]:
+    """One trace with the events of every file, e.g. of a client and a server."""
+    events = []
+    for path in paths:
+        with open(path) as f:
+            trace = json.load(f)
+        events += trace["traceEvents"] if isinstance(trace, dict) else trace
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -1,14 +1,41 @@
 import base64
 import json
-from typing import Type, TypeVar
+import math
+import struct
+import threading
+import zlib
+from collections import defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
 import numpy as np
 import torch
 from bitarray import bitarray
 from bitarray.util import ba2int, int2ba
 from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
 
-from split_learning.schemas.message import WSMessage
+from split_learning.schemas.message import (
+    MessageType,
+    TensorMeta,
+    WireFormat,
+    WSMessage,
+)
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
 
 # dtypes
 
@@ -32,21 +59,44 @@ torch_to_numpy_dtype_dict = {
 # tensors
 
 
-def serialize_tensor(tensors: torch.Tensor):
+def serialize_tensor(tensors: torch.Tensor) -> memoryview:
     return serialize_numpy(tensors.numpy())
 
 
-def serialize_numpy(tensors: np.ndarray):
-    return np.ascontiguousarray(tensors).tobytes()
+def serialize_numpy(tensors: np.ndarray) -> memoryview:
+    if tensors.size == 0:
+        # memoryview cannot cast zero-size views
+        return memoryview(b"")
+    # a byte view over the (contiguous) array, no copy for contiguous inputs
+    return memoryview(np.ascontiguousarray(tensors)).cast("B")
 
 
 def deserialize_tensor(data: bytes, squeeze=True, dtype=torch.float32):
+    """Deserialize a tensor, sharing memory with `data` when it is writable."""
     if dtype not in numpy_to_torch_dtype_dict.values():
         raise ValueError(f"Invalid dtype: {dtype}")
 
     numpy_dtype = torch_to_numpy_dtype_dict[dtype]
     numpy_tensor = deserialize_numpy(data, squeeze=squeeze, dtype=numpy_dtype)
-    return torch.from_numpy(numpy_tensor.copy())
+    if not numpy_tensor.flags.writeable:
+        numpy_tensor = numpy_tensor.copy()
+    return torch.from_numpy(numpy_tensor)
+
+
+def deserialize_tensor_into(data: bytes, out: torch.Tensor) -> torch.Tensor:
+    """Copy raw bytes straight into a preallocated, contiguous tensor."""
+    if not out.is_contiguous():
+        raise ValueError("Output tensor must be contiguous")
+
+    target = memoryview(out.detach().reshape(-1).view(torch.uint8).numpy())
+    source = memoryview(data).cast("B")
+    if source.nbytes != target.nbytes:
+        raise ValueError(
+            f"Size mismatch: got {source.nbytes} bytes, expected {target.nbytes}"
+        )
+
+    target[:] = source
+    return out
 
 
 def deserialize_numpy(data: bytes, squeeze=True, dtype=np.float32):
@@ -60,6 +110,354 @@ def deserialize_numpy(data: bytes, squeeze=True, dtype=np.float32):
     return arr
 
 
+class TensorPool:
+    """Reusable receive tensors, keyed by shape and dtype.
+
+    Tensors handed out by `acquire` must be returned with `release` once the
+    step that uses them is finished.
+    """
+
+    def __init__(self, capacity: int = 4, pin_memory: bool = False):
+        self.capacity = capacity
+        self.pin_memory = pin_memory
+        self._free: Dict[Tuple, List[torch.Tensor]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, shape: Sequence[int], dtype=torch.float32) -> torch.Tensor:
+        key = (tuple(shape), dtype)
+        with self._lock:
+            if self._free[key]:
+                return self._free[key].pop()
+        return torch.empty(tuple(shape), dtype=dtype, pin_memory=self.pin_memory)
+
+    def release(self, tensor: torch.Tensor):
+        key = (tuple(tensor.shape), tensor.dtype)
+        tensor.grad = None
+        tensor.requires_grad_(False)
+        with self._lock:
+            if len(self._free[key]) < self.capacity:
+                self._free[key].append(tensor)
+
+
+# codecs
+
+
+class Codec:
+    """Encodes a tensor to bytes and back, given its original dtype and shape."""
+
+    name = "raw"
+
+    def encode(self, tensor: torch.Tensor) -> bytes:
+        return serialize_tensor(tensor)
+
+    def decode(self, data: bytes, meta: TensorMeta) -> torch.Tensor:
+        dtype = getattr(torch, meta.dtype)
+        tensor = deserialize_tensor(data, squeeze=False, dtype=dtype)
+        return tensor.reshape(*meta.shape)
+
+
+def _stochastic_round(tensor: torch.Tensor, dtype) -> torch.Tensor:
+    # round to one of the two nearest representable values, unbiased in expectation
+    nearest = tensor.to(dtype)
+    error = tensor - nearest.float()
+    towards = torch.where(error > 0, float("inf"), float("-inf")).to(dtype)
+    other = torch.nextafter(nearest, towards)
+    gap = other.float() - nearest.float()
+    probability = torch.where(gap != 0, error / gap, torch.zeros_like(error))
+    return torch.where(torch.rand_like(error) < probability, other, nearest)
+
+
+class HalfCodec(Codec):
+    name = "fp16"
+    dtype = torch.float16
+    wire_dtype = torch.float16
+
+    def __init__(self, stochastic: bool = False):
+        self.stochastic = stochastic
+        if stochastic:
+            self.name = f"{self.name}_sr"
+
+    def encode(self, tensor: torch.Tensor) -> bytes:
+        tensor = tensor.detach()
+        if self.stochastic:
+            tensor = _stochastic_round(tensor.float(), self.dtype)
+        else:
+            tensor = tensor.to(self.dtype)
+        return serialize_tensor(tensor.contiguous().view(self.wire_dtype))
+
+    def decode(self, data: bytes, meta: TensorMeta) -> torch.Tensor:
+        tensor = deserialize_tensor(data, squeeze=False, dtype=self.wire_dtype)
+        tensor = tensor.view(self.dtype).to(getattr(torch, meta.dtype))
+        return tensor.reshape(*meta.shape)
+
+
+class BFloat16Codec(HalfCodec):
+    name = "bf16"
+    dtype = torch.bfloat16
+    # numpy has no bfloat16, so the bits are shipped as int16 instead
+    wire_dtype = torch.int16
+
+
+class Int8Codec(Codec):
+    """Per-channel (dim 1) affine int8 quantization.
+
+    The payload is the float32 scales, then the float32 zero points, then the
+    int8 values, with channels moved to the front.
+    """
+
+    name = "int8"
+
+    def __init__(self, stochastic: bool = False):
+        self.stochastic = stochastic
+        if stochastic:
+            self.name = f"{self.name}_sr"
+
+    @staticmethod
+    def _channels(shape: Sequence[int]) -> int:
+        return shape[1] if len(shape) > 1 else 1
+
+    def encode(self, tensor: torch.Tensor) -> bytes:
+        if tensor.numel() == 0:
+            return b""
+        tensor = tensor.detach().float()
+        num_channels = self._channels(tensor.shape)
+        channels = tensor.movedim(1, 0) if tensor.ndim > 1 else tensor
+        channels = channels.reshape(num_channels, -1)
+
+        # the range always includes 0, so the zero point fits in int8 and
+        # constant channels still get a nonzero range (all zeros: scale 1)
+        low = channels.amin(dim=1).clamp_max(0)
+        high = channels.amax(dim=1).clamp_min(0)
+        scale = (high - low) / 255
+        scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+        zero_point = (-128 - low / scale).round().clamp(-128, 127)
+
+        quantized = channels / scale[:, None] + zero_point[:, None]
+        if self.stochastic:
+            quantized = (quantized + torch.rand_like(quantized)).floor()
+        else:
+            quantized = quantized.round()
+        quantized = quantized.clamp(-128, 127).to(torch.int8)
+
+        return b"".join(
+            [
+                serialize_tensor(scale),
+                serialize_tensor(zero_point),
+                serialize_tensor(quantized),
+            ]
+        )
+
+    def decode(self, data: bytes, meta: TensorMeta) -> torch.Tensor:
+        if math.prod(meta.shape) == 0:
+            return torch.empty(meta.shape, dtype=getattr(torch, meta.dtype))
+        num_channels = self._channels(meta.shape)
+        view = memoryview(data).cast("B")
+        params_size = 4 * num_channels
+        scale = deserialize_tensor(view[:params_size], squeeze=False)
+        zero_point = deserialize_tensor(
+            view[params_size : 2 * params_size], squeeze=False
+        )
+        quantized = deserialize_tensor(
+            view[2 * params_size :], squeeze=False, dtype=torch.int8
+        )
+
+        channels = quantized.reshape(num_channels, -1).float()
+        channels = (channels - zero_point[:, None]) * scale[:, None]
+        if len(meta.shape) > 1:
+            moved_shape = [meta.shape[1], meta.shape[0], *meta.shape[2:]]
+            tensor = channels.reshape(moved_shape).movedim(0, 1)
+        else:
+            tensor = channels.reshape(meta.shape)
+        return tensor.to(getattr(torch, meta.dtype)).contiguous()
+
+
+class SparseCodec(Codec):
+    """Lossless bitmask + packed nonzeros encoding, for post-ReLU activations.
+
+    The payload starts with a (mode, compressor) byte pair. Tensors that are
+    not sparse enough to beat `max_density` fall back to the dense layout.
+    Zeros are detected bitwise, so `-0.0` survives the round trip.
+    """
+
+    name = "sparse"
+
+    DENSE = 0
+    SPARSE = 1
+
+    compressors = {
+        "zlib": (1, lambda x: zlib.compress(x, 1), zlib.decompress),
+    }
+    if lz4_frame is not None:
+        compressors["lz4"] = (2, lz4_frame.compress, lz4_frame.decompress)
+
+    _header = struct.Struct("<BB")
+
+    def __init__(self, compressor: Optional[str] = None, max_density: float = 0.9):
+        self.compressor = compressor
+        self.max_density = max_density
+        if compressor is not None:
+            self.name = f"{self.name}_{compressor}"
+
+    def encode(self, tensor: torch.Tensor) -> bytes:
+        array = np.ascontiguousarray(tensor.detach().numpy()).reshape(-1)
+        bits = (
+            array.view(f"u{array.itemsize}")
+            if array.itemsize in (1, 2, 4, 8)
+            else array
+        )
+        mask = bits != 0
+
+        mask_size = math.ceil(array.size / 8)
+        sparse_size = mask_size + int(np.count_nonzero(mask)) * array.itemsize
+        if sparse_size < self.max_density * array.nbytes:
+            mode = self.SPARSE
+            body = b"".join([np.packbits(mask).data, array[mask].data])
+        else:
+            mode = self.DENSE
+            body = array.data.cast("B")
+
+        compressor_id = 0
+        if self.compressor is not None:
+            compressor_id, compress, _ = self.compressors[self.compressor]
+            compressed = compress(body)
+            if len(compressed) < len(body):
+                body = compressed
+            else:
+                compressor_id = 0
+
+        return b"".join([self._header.pack(mode, compressor_id), body])
+
+    def decode(self, data: bytes, meta: TensorMeta) -> torch.Tensor:
+        view = memoryview(data).cast("B")
+        mode, compressor_id = self._header.unpack_from(view, 0)
+        body = view[self._header.size :]
+        if compressor_id != 0:
+            decompress = next(
+                d for (i, _, d) in self.compressors.values() if i == compressor_id
+            )
+            body = decompress(body)
+
+        dtype = getattr(torch, meta.dtype)
+        if mode == self.DENSE:
+            tensor = deserialize_tensor(body, squeeze=False, dtype=dtype)
+            return tensor.reshape(*meta.shape)
+
+        size = math.prod(meta.shape)
+        mask_size = math.ceil(size / 8)
+        mask = np.unpackbits(np.frombuffer(body, np.uint8, mask_size), count=size)
+        array = np.zeros(size, dtype=torch_to_numpy_dtype_dict[dtype])
+        array[mask.view(bool)] = np.frombuffer(body, array.dtype, offset=mask_size)
+        return torch.from_numpy(array).reshape(*meta.shape)
+
+
+class CooCodec(Codec):
+    """Flat indices + values of the nonzero elements, for very sparse tensors
+    such as top-k sparsified gradients. Decodes back to a dense tensor."""
+
+    name = "coo"
+
+    @staticmethod
+    def _index_dtype(size: int):
+        return torch.int32 if size < 2**31 else torch.int64
+
+    def encode(self, tensor: torch.Tensor) -> bytes:
+        flat = tensor.detach().reshape(-1)
+        indices = flat.nonzero().squeeze(1).to(self._index_dtype(flat.numel()))
+        return b"".join(
+            [serialize_tensor(indices), serialize_tensor(flat[indices.long()])]
+        )
+
+    def decode(self, data: bytes, meta: TensorMeta) -> torch.Tensor:
+        dtype = getattr(torch, meta.dtype)
+        size = math.prod(meta.shape)
+        index_dtype = self._index_dtype(size)
+
+        view = memoryview(data).cast("B")
+        index_size = index_dtype.itemsize
+        count = view.nbytes // (index_size + dtype.itemsize)
+        indices = deserialize_tensor(
+            view[: count * index_size], squeeze=False, dtype=index_dtype
+        )
+        values = deserialize_tensor(
+            view[count * index_size :], squeeze=False, dtype=dtype
+        )
+
+        tensor = torch.zeros(size, dtype=dtype)
+        tensor[indices.long()] = values
+        return tensor.reshape(*meta.shape)
+
+
+codecs: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> Codec:
+    codecs[codec.name] = codec
+    return codec
+
+
+def get_codec(name: str) -> Codec:
+    if name not in codecs:
+        raise ValueError(f"Unknown codec: {name}")
+    return codecs[name]
+
+
+register_codec(Codec())
+register_codec(HalfCodec())
+register_codec(HalfCodec(stochastic=True))
+register_codec(BFloat16Codec())
+register_codec(BFloat16Codec(stochastic=True))
+register_codec(Int8Codec())
+register_codec(Int8Codec(stochastic=True))
+register_codec(SparseCodec())
+register_codec(CooCodec())
+for compressor in SparseCodec.compressors:
+    register_codec(SparseCodec(compressor=compressor))
+
+
+# message tensors
+
+
+def tensor_meta(tensor: torch.Tensor, codec: str = "raw") -> TensorMeta:
+    return TensorMeta(
+        dtype=str(tensor.dtype).replace("torch.", ""),
+        shape=list(tensor.shape),
+        codec=codec,
+    )
+
+
+def encode_tensor(tensor: torch.Tensor, codec: str = "raw") -> Tuple[bytes, TensorMeta]:
+    """Encode a tensor with a registered codec, returning the payload and its meta."""
+    return get_codec(codec).encode(tensor), tensor_meta(tensor, codec=codec)
+
+
+def deserialize_message_tensor(
+    message: WSMessage,
+    key: str = "tensor",
+    dtype=torch.float32,
+    pool: Optional[TensorPool] = None,
+) -> torch.Tensor:
+    """Deserialize `message.raw[key]`, preferring the dtype/shape in `message.meta`.
+
+    With a `pool`, the tensor is filled into a pooled buffer instead of being
+    freshly allocated.
+    """
+    meta = message.meta.get(key)
+    if meta is None:
+        tensor = deserialize_tensor(message.raw[key], dtype=dtype)
+        if key == "tensor" and "tensor_shape" in message.data:
+            tensor = tensor.reshape(*message.data["tensor_shape"])
+        return tensor
+
+    if meta.codec != Codec.name:
+        return get_codec(meta.codec).decode(message.raw[key], meta)
+
+    if pool is not None:
+        out = pool.acquire(meta.shape, dtype=getattr(torch, meta.dtype))
+        return deserialize_tensor_into(message.raw[key], out)
+
+    return get_codec(meta.codec).decode(message.raw[key], meta)
+
+
 # pydantic
 
 
@@ -81,3 +479,287 @@ def decode_message_b64(data: bytes, schema: Type[T] = WSMessage) -> T:
     message = schema(**message_dict)
 
     return message
+
+
+# binary frames
+#
+# header | data (json) | field table | padding | aligned raw payloads
+#
+# Each field table entry is a fixed struct (name length, dtype, ndim, codec
+# length, offset, nbytes) followed by the utf-8 name, the utf-8 codec name and
+# `ndim` int64 dimensions. Offsets are absolute within the frame and aligned to
+# `FRAME_ALIGN` bytes.
+
+FRAME_MAGIC = b"SLW1"
+FRAME_ALIGN = 64
+
+_FRAME_HEADER = struct.Struct("<4sBHI")
+_FRAME_FIELD = struct.Struct("<HBBBQQ")
+_FRAME_DTYPES = [
+    "bytes",
+    "uint8",
+    "int8",
+    "int16",
+    "int32",
+    "int64",
+    "float16",
+    "float32",
+    "float64",
+    "complex64",
+    "complex128",
+    "bool",
+    "bfloat16",
+]
+_FRAME_MESSAGE_TYPES = list(MessageType)
+
+
+def _align(offset: int, alignment: int = FRAME_ALIGN) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def encode_message_frame(
+    message: WSMessage, allocate: Callable[[int], Any] = bytearray
+) -> bytearray:
+    """Encode a frame into `allocate(size)`, a writable buffer of `size` bytes.
+
+    Padding is not cleared, so `allocate` may hand out reused memory.
+    """
+    data_bytes = json.dumps(message.data, default=pydantic_encoder).encode("utf-8")
+
+    fields = []
+    table_size = 0
+    for key, value in message.raw.items():
+        meta = message.meta.get(key)
+        name = key.encode("utf-8")
+        dtype = _FRAME_DTYPES.index(meta.dtype) if meta is not None else 0
+        shape = meta.shape if meta is not None else []
+        codec = (meta.codec if meta is not None else Codec.name).encode("utf-8")
+        value = memoryview(value).cast("B")
+        fields.append((name, dtype, shape, codec, value))
+        table_size += _FRAME_FIELD.size + len(name) + len(codec) + 8 * len(shape)
+
+    header_size = _FRAME_HEADER.size + len(data_bytes) + table_size
+    offsets = []
+    offset = _align(header_size)
+    for *_, value in fields:
+        offsets.append(offset)
+        offset = _align(offset + len(value))
+    frame = allocate(offset)
+
+    _FRAME_HEADER.pack_into(
+        frame,
+        0,
+        FRAME_MAGIC,
+        _FRAME_MESSAGE_TYPES.index(message.type),
+        len(fields),
+        len(data_bytes),
+    )
+    cursor = _FRAME_HEADER.size
+    frame[cursor : cursor + len(data_bytes)] = data_bytes
+    cursor += len(data_bytes)
+    for (name, dtype, shape, codec, value), offset in zip(fields, offsets):
+        _FRAME_FIELD.pack_into(
+            frame,
+            cursor,
+            len(name),
+            dtype,
+            len(shape),
+            len(codec),
+            offset,
+            len(value),
+        )
+        cursor += _FRAME_FIELD.size
+        frame[cursor : cursor + len(name)] = name
+        cursor += len(name)
+        frame[cursor : cursor + len(codec)] = codec
+        cursor += len(codec)
+        struct.pack_into(f"<{len(shape)}q", frame, cursor, *shape)
+        cursor += 8 * len(shape)
+        frame[offset : offset + len(value)] = value
+
+    # bytes-like, returned as is to avoid another copy of the payloads
+    return frame
+
+
+def decode_message_frame(data: bytes, schema: Type[T] = WSMessage) -> T:
+    """Decode a frame; raw fields are memoryviews into `data` (no copies)."""
+    view = memoryview(data)
+    magic, message_type, num_fields, data_size = _FRAME_HEADER.unpack_from(view, 0)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Invalid frame magic: {magic!r}")
+
+    cursor = _FRAME_HEADER.size
+    message_data = json.loads(bytes(view[cursor : cursor + data_size]))
+    cursor += data_size
+
+    raw, meta = {}, {}
+    for _ in range(num_fields):
+        name_size, dtype, ndim, codec_size, offset, nbytes = _FRAME_FIELD.unpack_from(
+            view, cursor
+        )
+        cursor += _FRAME_FIELD.size
+        name = bytes(view[cursor : cursor + name_size]).decode("utf-8")
+        cursor += name_size
+        codec = bytes(view[cursor : cursor + codec_size]).decode("utf-8")
+        cursor += codec_size
+        shape = list(struct.unpack_from(f"<{ndim}q", view, cursor))
+        cursor += 8 * ndim
+
+        raw[name] = view[offset : offset + nbytes]
+        if dtype != 0:
+            meta[name] = TensorMeta(
+                dtype=_FRAME_DTYPES[dtype], shape=shape, codec=codec
+            )
+
+    return schema(
+        type=_FRAME_MESSAGE_TYPES[message_type], data=message_data, raw=raw, meta=meta
+    )
+
+
+# wire formats
+
+
+def is_message_frame(data: bytes) -> bool:
+    return bytes(data[: len(FRAME_MAGIC)]) == FRAME_MAGIC
+
+
+def encode_message(
+    message: WSMessage, wire_format: WireFormat = WireFormat.B64_JSON
+) -> bytes:
+    if wire_format == WireFormat.FRAME:
+        return encode_message_frame(message)
+    return encode_message_b64(message)
+
+
+def decode_message(data: bytes, schema: Type[T] = WSMessage) -> T:
+    # base64 json always starts with "eyJ" ('{"'), so the magic is unambiguous
+    if is_message_frame(data):
+        return decode_message_frame(data, schema=schema)
+    return decode_message_b64(data, schema=schema)
+
+
+def peek_message_type(data: bytes) -> Optional[MessageType]:
+    """Read a message's type without decoding its payload, if it can be found."""
+    if is_message_frame(data):
+        return _FRAME_MESSAGE_TYPES[_FRAME_HEADER.unpack_from(data, 0)[1]]
+
+    # json encoders emit "type" first, so it is within the first few bytes
+    try:
+        head = base64.b64decode(bytes(data[:96])).decode("utf-8", errors="ignore")
+        return MessageType(head.split('"type"', 1)[1].split('"')[1])
+    except (ValueError, IndexError):
+        return None
+
+
+def hello_message(wire_formats: Sequence[WireFormat], **data) -> WSMessage:
+    return WSMessage(
+        type=MessageType.HELLO,
+        data={"wire_formats": [WireFormat(f).value for f in wire_formats], **data},
+    )
+
+
+def negotiate_wire_format(
+    offered: List[str], supported: Sequence[WireFormat]
+) -> WireFormat:
+    """Pick the first wire format offered by the peer that we also support."""
+    supported = [WireFormat(f) for f in supported]
+    for wire_format in offered:
+        if wire_format in supported:
+            return WireFormat(wire_format)
+    return WireFormat.B64_JSON
+
+
+# streaming
+#
+# A large message can be streamed as parts that each fit in a transport
+# message. Every part starts with a fixed struct (magic, stream id, field
+# index, offset): the first part (field index -1) carries the message as a
+# frame with empty payloads and their sizes in `data["stream"]`, and the
+# following parts carry chunks of each payload in order.
+
+STREAM_MAGIC = b"SLS1"
+
+_STREAM_PART = struct.Struct("<4sIhQ")
+
+
+def is_stream_part(data: bytes) -> bool:
+    return bytes(data[: len(STREAM_MAGIC)]) == STREAM_MAGIC
+
+
+def message_nbytes(message: WSMessage) -> int:
+    return sum(memoryview(v).nbytes for v in message.raw.values())
+
+
+def stream_message(
+    message: WSMessage, chunk_size: int, stream_id: int = 0
+) -> Iterator[bytes]:
+    """Stream `message` as parts, produced lazily from its payloads."""
+    payloads = [memoryview(v).cast("B") for v in message.raw.values()]
+    head = message.copy(
+        update={
+            "data": {
+                **message.data,
+                "stream": {k: p.nbytes for k, p in zip(message.raw, payloads)},
+            },
+            "raw": {k: b"" for k in message.raw},
+        }
+    )
+    yield _STREAM_PART.pack(STREAM_MAGIC, stream_id, -1, 0) + encode_message_frame(head)
+
+    for index, payload in enumerate(payloads):
+        for offset in range(0, payload.nbytes, chunk_size):
+            header = _STREAM_PART.pack(STREAM_MAGIC, stream_id, index, offset)
+            yield header + payload[offset : offset + chunk_size]
+
+
+class StreamAssembler:
+    """Reassembles streamed messages, copying each chunk into its destination.
+
+    Destinations are allocated (from `pool`, if given) as soon as a stream
+    starts, so only one chunk at a time is held besides them. With a `pool`,
+    assembled messages should be given back with `release` once used.
+    """
+
+    def __init__(self, pool: Optional[TensorPool] = None):
+        self.pool = pool
+        self._streams: Dict[int, Tuple[WSMessage, List[memoryview], int]] = {}
+        self._buffers: Dict[int, List[torch.Tensor]] = {}
+
+    def feed(self, data: bytes) -> Optional[WSMessage]:
+        """Add a stream part, returning the message once it is complete."""
+        view = memoryview(data).cast("B")
+        magic, stream_id, index, offset = _STREAM_PART.unpack_from(view, 0)
+        if magic != STREAM_MAGIC:
+            raise ValueError(f"Invalid stream magic: {magic!r}")
+        chunk = view[_STREAM_PART.size :]
+
+        if index < 0:
+            message = decode_message_frame(chunk)
+            sizes = message.data.pop("stream")
+            buffers = [self._allocate(sizes[k]) for k in message.raw]
+            message.raw = {
+                k: memoryview(b.numpy()) for k, b in zip(message.raw, buffers)
+            }
+            if self.pool is not None:
+                self._buffers[id(message)] = buffers
+            destinations = list(message.raw.values())
+            remaining = sum(sizes.values())
+        else:
+            message, destinations, remaining = self._streams[stream_id]
+            destinations[index][offset : offset + chunk.nbytes] = chunk
+            remaining -= chunk.nbytes
+
+        if remaining > 0:
+            self._streams[stream_id] = (message, destinations, remaining)
+            return None
+        self._streams.pop(stream_id, None)
+        return message
+
+    def _allocate(self, nbytes: int) -> torch.Tensor:
+        if self.pool is not None:
+            return self.pool.acquire((nbytes,), dtype=torch.uint8)
+        return torch.empty(nbytes, dtype=torch.uint8)
+
+    def release(self, message: WSMessage):
+        for buffer in self._buffers.pop(id(message), []):
+            self.pool.release(buffer)
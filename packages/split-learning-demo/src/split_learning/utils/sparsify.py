@@ -0,0 +1,47 @@
+from typing import Dict, Hashable, Optional
+
+import torch
+
+
+class ErrorFeedbackSparsifier:
+    """Top-k or threshold sparsification with per-client error feedback.
+
+    Whatever is dropped for a client is kept as a residual and added back to
+    that client's next gradient, so no gradient mass is lost, only delayed.
+    """
+
+    def __init__(
+        self, ratio: Optional[float] = None, threshold: Optional[float] = None
+    ):
+        if (ratio is None) == (threshold is None):
+            raise ValueError("Exactly one of `ratio` or `threshold` must be set")
+        if ratio is not None and not 0 < ratio <= 1:
+            raise ValueError(f"Invalid ratio: {ratio}")
+
+        self.ratio = ratio
+        self.threshold = threshold
+        self.residuals: Dict[Hashable, torch.Tensor] = {}
+
+    def mask(self, grads: torch.Tensor) -> torch.Tensor:
+        magnitudes = grads.abs().reshape(-1)
+        if self.threshold is not None:
+            return (magnitudes >= self.threshold).reshape(grads.shape)
+
+        k = max(1, int(self.ratio * magnitudes.numel()))
+        mask = torch.zeros_like(magnitudes, dtype=torch.bool)
+        mask[magnitudes.topk(k, sorted=False).indices] = True
+        return mask.reshape(grads.shape)
+
+    def __call__(self, client_id: Hashable, grads: torch.Tensor) -> torch.Tensor:
+        grads = grads.detach()
+        residual = self.residuals.get(client_id)
+        # e.g. a smaller final batch; the stale residual cannot be applied
+        if residual is not None and residual.shape == grads.shape:
+            grads = grads + residual
+
+        sparse = torch.where(self.mask(grads), grads, torch.zeros_like(grads))
+        self.residuals[client_id] = grads - sparse
+        return sparse
+
+    def reset(self, client_id: Hashable):
+        self.residuals.pop(client_id, None)
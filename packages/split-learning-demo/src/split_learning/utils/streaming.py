@@ -0,0 +1,62 @@
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, Sequence
+
+from torch.utils.data import IterableDataset
+
+if TYPE_CHECKING:
+    import datasets
+
+# Streamed datasets are read shard by shard from the hub (or local files) as
+# training goes, so nothing is materialized on disk beforehand. Each client
+# reads its own shards, data loader workers split those further, and
+# examples are shuffled within a bounded buffer rather than globally.
+
+
+class StreamingDataset(IterableDataset):
+    """Examples of a streamed dataset, with `transform` applied to `columns`."""
+
+    def __init__(
+        self,
+        source: "datasets.IterableDataset",
+        transform: Optional[Callable[[Any], Any]] = None,
+        columns: Sequence[str] = ("image",),
+    ):
+        self.source = source
+        self.transform = transform
+        self.columns = columns
+
+    def set_epoch(self, epoch: int):
+        """Reshuffle the shard order and the shuffle buffer for `epoch`."""
+        self.source.set_epoch(epoch)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # the source splits its shards between data loader workers itself
+        for example in self.source:
+            if self.transform is not None:
+                for column in self.columns:
+                    example[column] = self.transform(example[column])
+            yield example
+
+
+def stream(
+    dataset: "datasets.IterableDataset",
+    transform: Optional[Callable[[Any], Any]] = None,
+    columns: Sequence[str] = ("image",),
+    shuffle_buffer: int = 0,
+    seed: Optional[int] = None,
+    num_clients: int = 1,
+    client_index: int = 0,
+) -> StreamingDataset:
+    """Assign a client its share of `dataset`, shuffled within `shuffle_buffer`.
+
+    Clients get whole shards when the shard count divides evenly between
+    them, otherwise every `num_clients`-th example.
+    """
+    if num_clients > 1:
+        from datasets.distributed import split_dataset_by_node
+
+        dataset = split_dataset_by_node(
+            dataset, rank=client_index, world_size=num_clients
+        )
+    if shuffle_buffer > 0:
+        dataset = dataset.shuffle(seed=seed, buffer_size=shuffle_buffer)
+    return StreamingDataset(dataset, transform, columns)
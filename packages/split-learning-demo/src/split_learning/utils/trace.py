@@ -0,0 +1,110 @@
+import itertools
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Union
+
+import torch
+
+from split_learning.schemas.message import WSMessage
+from split_learning.schemas.trace import TraceEvent
+from split_learning.utils.serde import (
+    decode_message_b64,
+    decode_message_frame,
+    get_codec,
+    is_message_frame,
+)
+
+# Message traces are json lines of `TraceEvent`s: the type, data, tensor meta
+# and payload sizes of every message a server received, with its arrival
+# time and a small client index. Payloads are not recorded; replaying a
+# trace sends random tensors of the recorded shapes, dtypes and codecs.
+
+
+class TraceRecorder:
+    """Writes the messages a server receives to a trace, off the event loop.
+
+    Frames are recorded from their header and field table, without touching
+    their payloads. Base64 json messages have to be decoded whole, which is
+    left to the recorder's own thread, as is writing the trace.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.file = open(path, "w")
+        self.start = time.perf_counter()
+        # connection ids are only unique while connected, so clients are
+        # numbered in the order they are first seen
+        self.clients: Dict[int, int] = {}
+        self._indices = itertools.count()
+        # one thread, so events are written in the order they were received
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def record(self, client: int, message: Union[WSMessage, bytes, memoryview]):
+        """Record a received message, decoded or as received."""
+        if client not in self.clients:
+            self.clients[client] = next(self._indices)
+        index = self.clients[client]
+        elapsed = time.perf_counter() - self.start
+
+        if isinstance(message, WSMessage) or is_message_frame(message):
+            if not isinstance(message, WSMessage):
+                message = decode_message_frame(message)
+            self._executor.submit(self._write, self._event(elapsed, index, message))
+        else:
+            # copied: the buffer may be reused before the thread gets to it
+            self._executor.submit(self._record_b64, elapsed, index, bytes(message))
+
+    def _record_b64(self, elapsed: float, client: int, data: bytes):
+        self._write(self._event(elapsed, client, decode_message_b64(data)))
+
+    @staticmethod
+    def _event(elapsed: float, client: int, message: WSMessage) -> TraceEvent:
+        return TraceEvent(
+            time=elapsed,
+            client=client,
+            type=message.type,
+            data=message.data,
+            meta=message.meta,
+            nbytes={k: memoryview(v).nbytes for k, v in message.raw.items()},
+        )
+
+    def _write(self, event: TraceEvent):
+        self.file.write(event.json() + "\n")
+
+    def forget(self, client: int):
+        self.clients.pop(client, None)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.file.close()
+
+
+def read_trace(path: Union[str, Path]) -> Dict[int, List[TraceEvent]]:
+    """Recorded events by client, in order."""
+    events = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = TraceEvent.parse_raw(line)
+                events[event.client].append(event)
+    return dict(events)
+
+
+def synthesize_message(event: TraceEvent, num_classes: int = 10) -> WSMessage:
+    """A message like the recorded one, with random tensors in its payloads."""
+    raw = {}
+    for key, nbytes in event.nbytes.items():
+        meta = event.meta.get(key)
+        if meta is None:
+            # clients without meta send raw float32 tensors
+            raw[key] = bytes(torch.randn(nbytes // 4).numpy())
+            continue
+
+        dtype = getattr(torch, meta.dtype)
+        if dtype.is_floating_point:
+            tensor = torch.randn(meta.shape).to(dtype)
+        else:
+            tensor = torch.randint(0, num_classes, meta.shape, dtype=dtype)
+        raw[key] = get_codec(meta.codec).encode(tensor)
+    return WSMessage(type=event.type, data=event.data, raw=raw, meta=event.meta)
@@ -0,0 +1,71 @@
+import logging
+import sys
+import time
+from typing import Tuple
+
+import click
+
+import split_learning
+from split_learning.utils import datasets as datasets
+from split_learning.utils.cache import build_cache, cache_path, is_cached
+
+# logger
+_logger = logging.getLogger(__name__)
+
+# fixed-size image datasets that can be cached
+loaders = {
+    "mnist": datasets.mnist,
+    "fashion_mnist": datasets.fashion_mnist,
+    "cifar10": datasets.cifar10,
+    "tiny_imagenet": datasets.tiny_imagenet,
+}
+# image modes of datasets that mix them (default: the mode of the first image)
+modes = {
+    "tiny_imagenet": "RGB",
+}
+
+
+@click.command()
+@click.option(
+    "--dataset",
+    "dataset_names",
+    type=click.Choice(list(loaders)),
+    multiple=True,
+    default=["mnist"],
+)
+@click.option("--split", "splits", type=str, multiple=True, default=["train", "test"])
+@click.option("--force", "force", is_flag=True, help="rebuild existing caches")
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(
+    dataset_names: Tuple[str, ...], splits: Tuple[str, ...], force: bool, log_level: int
+):
+    """Convert dataset splits to memory-mapped arrays under data/cache."""
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+
+    for dataset_name in dataset_names:
+        loader = loaders[dataset_name]
+        for split in splits:
+            path = cache_path(loader.dataset_name, split)
+            if is_cached(path) and not force:
+                _logger.info(f"{dataset_name}/{split} is already cached in {path}")
+                continue
+
+            start = time.perf_counter()
+            dataset = loader(split=split, cache=False)
+            build_cache(dataset, len(dataset), path, mode=modes.get(dataset_name))
+            _logger.info(
+                f"Cached {len(dataset)} examples of {dataset_name}/{split} in {path} "
+                f"({time.perf_counter() - start:.1f} s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,48 @@
 import asyncio
+import functools
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
 
 import click
 import lightning as L
 import torch
-import websockets
+from torch import nn
 from torch.utils.data import DataLoader
 from torchvision import transforms
 from tqdm import tqdm
 
 import split_learning
-from split_learning.models.vision.cnn_2d import CNN2DClient
-from split_learning.schemas.message import MessageType, WSMessage
+from split_learning.models.vision.cnn_2d import (
+    CNN2D,
+    CNN2DBackClient,
+    CNN2DClient,
+    CNN2DFrontClient,
+)
+from split_learning.schemas.message import MessageType, WireFormat, WSMessage
+from split_learning.transport.base import use_uvloop
+from split_learning.transport.connect import SCHEMES, connect
 from split_learning.utils import datasets as datasets
+from split_learning.utils.augment import BatchAugment
+from split_learning.utils.metrics import PhaseTimer, format_phases
+from split_learning.utils.pipeline import prefetch, stash_parameters
+from split_learning.utils.profiling import SpanRecorder, new_session_id, trace_id
 from split_learning.utils.serde import (
-    decode_message_b64,
-    deserialize_tensor,
+    StreamAssembler,
+    TensorPool,
+    codecs,
+    decode_message,
+    deserialize_message_tensor,
+    encode_message,
     encode_message_b64,
-    serialize_tensor,
+    encode_tensor,
+    hello_message,
+    is_stream_part,
+    message_nbytes,
+    stream_message,
 )
 
 # logger
@@ -39,14 +62,115 @@ _logger = logging.getLogger(__name__)
 @click.option("--batch-size", "batch_size", type=int, default=128)
 @click.option("--learning-rate", "learning_rate", type=float, default=1e-4)
 @click.option("--grad-clip", "grad_clip", type=float, default=0.5)
+@click.option(
+    "--seed", "seed", type=int, default=None, help="seed of the data augmentation"
+)
+@click.option(
+    "--augment-in",
+    "augment_in",
+    type=click.Choice(["loop", "collate"]),
+    default="loop",
+    help="augment batches in the training loop (on the device) or in loader workers",
+)
+@click.option(
+    "--streaming",
+    "streaming",
+    is_flag=True,
+    help="stream the training split instead of downloading it first",
+)
+@click.option(
+    "--shuffle-buffer",
+    "shuffle_buffer",
+    type=int,
+    default=10000,
+    help="examples shuffled together when streaming",
+)
+@click.option(
+    "--num-clients",
+    "num_clients",
+    type=int,
+    default=1,
+    help="clients sharing the streamed dataset, each reads its own shards",
+)
+@click.option("--client-index", "client_index", type=int, default=0)
+@click.option(
+    "--max-in-flight",
+    "max_in_flight",
+    type=int,
+    default=1,
+    help="micro-batches sent ahead of their gradients (1 = lock-step)",
+)
+@click.option("--prefetch-depth", "prefetch_depth", type=int, default=2)
+@click.option(
+    "--u-shape",
+    "u_shape",
+    is_flag=True,
+    help="keep the first and last layers (and the labels) on the client",
+)
 # param server
 @click.option("--host", "host", type=str, default="127.0.0.1")
 @click.option("--port", "port", type=int, default=8000)
 @click.option("--endpoint", "endpoint", type=str, default="/ws")
+@click.option(
+    "--uri",
+    "uri",
+    type=str,
+    default=None,
+    help=f"server uri, one of {', '.join(s + '://' for s in SCHEMES)} "
+    "(default: the websocket at --host, --port and --endpoint)",
+)
+@click.option(
+    "--shm-capacity-mb",
+    "shm_capacity_mb",
+    type=int,
+    default=64,
+    help="size of each shared memory ring",
+)
+@click.option("--uvloop", "uvloop", is_flag=True, help="use uvloop, if installed")
+@click.option(
+    "--chunk-size-kb",
+    "chunk_size_kb",
+    type=int,
+    default=None,
+    help="stream messages larger than this in chunks (frame wire format only)",
+)
+@click.option(
+    "--wire-format",
+    "wire_format",
+    type=click.Choice([f.value for f in WireFormat]),
+    default=WireFormat.FRAME.value,
+)
+@click.option(
+    "--activation-codec",
+    "activation_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+)
+@click.option(
+    "--grad-codec",
+    "grad_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+    help="codec requested for gradients sent back by the server",
+)
 # logging
 @click.option("--grad-accumulate-every", "grad_accumulate_every", type=int, default=4)
 @click.option("--validate-every", "validate_every", type=int, default=100)
 @click.option("--generate-every", "generate_every", type=int, default=500)
+@click.option(
+    "--report-every",
+    "report_every",
+    type=int,
+    default=100,
+    help="log the step timing breakdown every this many steps",
+)
+@click.option(
+    "--profile",
+    "profile",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write a chrome trace of client steps, see scripts/merge_traces.py",
+)
 # log levels
 @click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
 @click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
@@ -60,14 +184,32 @@ def main(
     batch_size: int,
     learning_rate: float,
     grad_clip: float,
+    seed: Optional[int],
+    augment_in: str,
+    streaming: bool,
+    shuffle_buffer: int,
+    num_clients: int,
+    client_index: int,
+    max_in_flight: int,
+    prefetch_depth: int,
+    u_shape: bool,
     # param server
     host: str,
     port: int,
     endpoint: str,
+    uri: str,
+    shm_capacity_mb: int,
+    uvloop: bool,
+    chunk_size_kb: Optional[int],
+    wire_format: str,
+    activation_codec: str,
+    grad_codec: str,
     # logging
     grad_accumulate_every: int,
     validate_every: int,
     generate_every: int,
+    report_every: int,
+    profile: Optional[Path],
     # log levels
     log_level: int,
 ):
@@ -85,13 +227,9 @@ def main(
 
     # dataset
     mnist_normalize = transforms.Normalize((0.1307,), (0.3081,))
-    mnist_train_transform = transforms.Compose(
-        [
-            transforms.RandomCrop(28, padding=4),
-            transforms.RandomRotation(10),
-            transforms.ToTensor(),
-            mnist_normalize,
-        ]
+    # training images stay uint8, they are augmented a batch at a time
+    mnist_train_augment = BatchAugment(
+        (0.1307,), (0.3081,), padding=4, degrees=10, seed=seed
     )
     mnist_test_transform = transforms.Compose(
         [
@@ -101,80 +239,336 @@ def main(
     )
     dataset_mnist_train = datasets.mnist(
         split="train",
-        transform=mnist_train_transform,
+        transform=transforms.PILToTensor(),
+        streaming=streaming,
+        shuffle_buffer=shuffle_buffer,
+        seed=seed,
+        num_clients=num_clients,
+        client_index=client_index,
     )
     dataset_mnist_val = datasets.mnist(
         split="test",
         transform=mnist_test_transform,
+        streaming=streaming,
     )
 
     train_loader = DataLoader(
-        dataset_mnist_train, batch_size=batch_size, shuffle=True, num_workers=2
+        dataset_mnist_train,
+        batch_size=batch_size,
+        # streamed examples are shuffled in a buffer instead
+        shuffle=not streaming,
+        num_workers=2,
+        collate_fn=mnist_train_augment.collate if augment_in == "collate" else None,
     )
     val_loader = DataLoader(
-        dataset_mnist_val, batch_size=batch_size, shuffle=True, num_workers=2
+        dataset_mnist_val,
+        batch_size=batch_size,
+        shuffle=not streaming,
+        num_workers=2,
     )
     train_loader, val_loader = fabric.setup_dataloaders(train_loader, val_loader)
 
     # model
-    model = CNN2DClient(in_channels=1, dim_out=10, img_size=28)
-    optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate, momentum=0.9)
+    if u_shape:
+        full_model = CNN2D(in_channels=1, dim_out=10, img_size=28)
+        model = CNN2DFrontClient(model=full_model)
+        back_model = CNN2DBackClient(model=full_model)
+        parameters = [*model.parameters(), *back_model.parameters()]
+    else:
+        model = CNN2DClient(in_channels=1, dim_out=10, img_size=28)
+        back_model = None
+        parameters = model.parameters()
+    optimizer = torch.optim.SGD(parameters, lr=learning_rate, momentum=0.9)
     model, optimizer = fabric.setup(model, optimizer)
+    if back_model is not None:
+        back_model = fabric.setup_module(back_model)
+    criterion = nn.CrossEntropyLoss()
+    pool = TensorPool()
+
+    uri = uri or f"ws://{host}:{port}{endpoint}"
+    chunk_size = chunk_size_kb * 1024 if chunk_size_kb else None
 
-    uri = f"ws://{host}:{port}{endpoint}"
+    executor = ThreadPoolExecutor(max_workers=1)
+    profiler = SpanRecorder("client", enabled=profile is not None)
+    timer = PhaseTimer(profiler)
+    traffic = {"sent": 0, "received": 0}
+    # messages are traced as `<session>-<seq>`
+    session = new_session_id()
+
+    def encode_request(
+        message_type: MessageType,
+        tensor: torch.Tensor,
+        labels: Optional[torch.Tensor],
+        seq: int,
+        request_trace_id: str,
+        connection_format: WireFormat,
+        in_place: bool,
+        **data,
+    ) -> Union[bytes, WSMessage, Iterator[bytes]]:
+        with timer.phase("encode", trace_id=request_trace_id):
+            serialized_inputs, inputs_meta = encode_tensor(
+                tensor.cpu(), activation_codec
+            )
+            raw, meta = {"tensor": serialized_inputs}, {"tensor": inputs_meta}
+            if labels is not None:
+                raw["labels"], meta["labels"] = encode_tensor(labels.cpu())
+        request_message = WSMessage(
+            type=message_type,
+            data={
+                "tensor_shape": tensor.shape,
+                "seq": seq,
+                "trace_id": request_trace_id,
+                **data,
+            },
+            raw=raw,
+            meta=meta,
+        )
+        if connection_format == WireFormat.FRAME:
+            if chunk_size and message_nbytes(request_message) > chunk_size:
+                return stream_message(request_message, chunk_size, seq)
+        if in_place and connection_format == WireFormat.FRAME:
+            # encoded directly into the transport's buffers when sent
+            return request_message
+        with timer.phase("encode", trace_id=request_trace_id):
+            return encode_message(request_message, connection_format)
 
     async def train_splitnn():
+        loop = asyncio.get_running_loop()
         try:
             _logger.info(f"Connecting to {uri} ...")
-            async with websockets.connect(uri, max_size=64 * 1024 * 1024) as websocket:
+            connection = await connect(uri, capacity=shm_capacity_mb * 1024 * 1024)
+            async with connection:
+                # negotiate wire format
+                hello = hello_message(
+                    [wire_format, WireFormat.B64_JSON],
+                    grad_codec=grad_codec,
+                    chunk_size=chunk_size,
+                )
+                await connection.send(encode_message_b64(hello))
+                hello_response = decode_message(await connection.recv())
+                connection_format = WireFormat(hello_response.data["wire_format"])
+                _logger.info(f"Using wire format: {connection_format.value}")
+
                 # start training
+                seq = 0
                 for epoch in range(num_epochs):
+                    if streaming:
+                        dataset_mnist_train.set_epoch(epoch)
+                    mnist_train_augment.set_epoch(epoch)
                     running_loss = 0.0
-                    pbar = tqdm(enumerate(train_loader))
-                    for i, data in pbar:
-                        images, labels = data["image"], data["label"]
+                    num_steps = 0
+                    # seq -> activations (and their autograd graph) awaiting grads
+                    in_flight: Dict[int, torch.Tensor] = {}
+                    # U-shape: seq -> labels, awaiting the middle activations
+                    awaiting_middle: Dict[int, torch.Tensor] = {}
+                    outgoing = asyncio.Queue()
+                    assembler = StreamAssembler(pool)
 
-                        model.train()
-                        optimizer.zero_grad()
-
-                        activations = model(images)
-                        server_inputs = activations.detach().clone()
-
-                        # send smashed activations
-                        serialized_inputs = serialize_tensor(server_inputs.cpu())
-                        serialized_labels = serialize_tensor(labels.cpu())
-                        request_message = WSMessage(
-                            type=MessageType.ACTIVATIONS_AND_LABELS,
-                            data={"tensor_shape": server_inputs.shape},
-                            raw={
-                                "tensor": serialized_inputs,
-                                "labels": serialized_labels,
-                            },
+                    async def send_request(
+                        message_type: MessageType,
+                        tensor: torch.Tensor,
+                        labels: Optional[torch.Tensor],
+                        seq: int,
+                        request_trace_id: str,
+                        **data,
+                    ):
+                        # serialized and sent in the background
+                        encoded_request = loop.run_in_executor(
+                            executor,
+                            functools.partial(
+                                encode_request,
+                                message_type,
+                                tensor,
+                                labels,
+                                seq,
+                                request_trace_id,
+                                connection_format,
+                                connection.in_place,
+                                **data,
+                            ),
+                        )
+                        await outgoing.put((request_trace_id, encoded_request))
+
+                    async def send_requests():
+                        while True:
+                            item = await outgoing.get()
+                            if item is None:
+                                return
+                            request_trace_id, encoded_request = item
+                            encoded_request = await encoded_request
+                            with timer.phase("send", trace_id=request_trace_id) as span:
+                                profiler.flow(
+                                    request_trace_id, "request", span, start=True
+                                )
+                                if isinstance(encoded_request, Iterator):
+                                    for part in encoded_request:
+                                        await connection.send(part)
+                                        traffic["sent"] += memoryview(part).nbytes
+                                elif isinstance(encoded_request, WSMessage):
+                                    await connection.send(encoded_request)
+                                    traffic["sent"] += message_nbytes(encoded_request)
+                                else:
+                                    await connection.send(encoded_request)
+                                    traffic["sent"] += memoryview(
+                                        encoded_request
+                                    ).nbytes
+
+                    async def train_back(
+                        response: WSMessage, response_seq: int, response_trace_id: str
+                    ):
+                        """Finish the forward on the client, and return the grads."""
+                        labels = awaiting_middle.pop(response_seq)
+                        with timer.phase("decode", trace_id=response_trace_id):
+                            received = deserialize_message_tensor(
+                                response, "tensor", pool=pool
+                            )
+                        with timer.phase("h2d", trace_id=response_trace_id):
+                            # a new leaf, the pooled buffer must not require grad
+                            middle = received.to(fabric.device).detach()
+                            middle.requires_grad = True
+                        with timer.phase("forward", trace_id=response_trace_id):
+                            back_model.train()
+                            loss = criterion(back_model(middle), labels)
+                        with timer.phase("backward", trace_id=response_trace_id):
+                            optimizer.zero_grad()
+                            fabric.backward(loss)
+                        with timer.phase("optimizer", trace_id=response_trace_id):
+                            optimizer.step()
+                        pool.release(received)
+                        assembler.release(response)
+
+                        await send_request(
+                            MessageType.MIDDLE_GRADS,
+                            middle.grad,
+                            None,
+                            response_seq,
+                            trace_id(session, response_seq, "grads"),
+                            loss=loss.item(),
+                        )
+
+                    async def receive_response():
+                        nonlocal running_loss, num_steps
+
+                        with timer.phase("receive") as receive_span:
+                            response_byes = await connection.recv()
+                        traffic["received"] += memoryview(response_byes).nbytes
+                        while is_stream_part(response_byes):
+                            with timer.phase("decode"):
+                                response = assembler.feed(response_byes)
+                            if response is not None:
+                                break
+                            with timer.phase("receive"):
+                                response_byes = await connection.recv()
+                            traffic["received"] += memoryview(response_byes).nbytes
+                        else:
+                            with timer.phase("decode"):
+                                response = decode_message(response_byes)
+                        if response.type not in (
+                            MessageType.GRADS,
+                            MessageType.MIDDLE_ACTIVATIONS,
+                        ):
+                            _logger.warning(f"Unexpected message: {response.type}")
+                            return
+
+                        # older servers don't echo seq, but do reply in order
+                        response_seq = response.data.get("seq", next(iter(in_flight)))
+                        response_trace_id = response.data.get("trace_id") or trace_id(
+                            session, response_seq
+                        )
+                        profiler.flow(
+                            response_trace_id,
+                            "response",
+                            receive_span,
+                            start=False,
+                            ts=receive_span.end - 1,
                         )
-                        encoded_request = encode_message_b64(request_message)
-                        await websocket.send(encoded_request)
+                        if response.type == MessageType.MIDDLE_ACTIVATIONS:
+                            await train_back(response, response_seq, response_trace_id)
+                            return
 
-                        # receive gradients
-                        response_byes = await websocket.recv()
-                        response = decode_message_b64(response_byes)
+                        activations = in_flight.pop(response_seq)
 
-                        if response.type == MessageType.GRADS:
-                            grads = deserialize_tensor(
-                                response.raw["tensor"], dtype=torch.float32
+                        with timer.phase("decode", trace_id=response_trace_id):
+                            received_grads = deserialize_message_tensor(
+                                response, "tensor", pool=pool
                             )
-                            grads = grads.reshape(*response.data["tensor_shape"])
-                            grads = grads.to(fabric.device)
+                        with timer.phase("h2d", trace_id=response_trace_id):
+                            grads = received_grads.to(fabric.device)
+                        with timer.phase("backward", trace_id=response_trace_id):
+                            optimizer.zero_grad()
                             fabric.backward(activations, grads)
+                        with timer.phase("optimizer", trace_id=response_trace_id):
                             optimizer.step()
+                        pool.release(received_grads)
+                        assembler.release(response)
+
+                        running_loss += response.data["loss"]
+                        num_steps += 1
+                        timer.step()
+                        if timer.steps == report_every:
+                            _logger.info(
+                                f"Step timing: {format_phases(timer.summary())}; "
+                                f"sent {traffic['sent'] / 1e6:.1f} MB, "
+                                f"received {traffic['received'] / 1e6:.1f} MB"
+                            )
+                        pbar.set_description(
+                            f"[Epoch {epoch}] training loss: {running_loss / num_steps:.4f}"
+                        )
+
+                    sender = asyncio.create_task(send_requests())
+                    pbar = tqdm(enumerate(prefetch(train_loader, prefetch_depth)))
+                    for i, data in pbar:
+                        images, labels = data["image"], data["label"]
+                        if augment_in == "loop":
+                            images = mnist_train_augment(images)
+
+                        model.train()
+                        # graphs stay alive across optimizer steps when pipelined,
+                        # U-shape steps always overlap with the next one
+                        pipelined = max_in_flight > 1 or u_shape
+                        stash = stash_parameters(model) if pipelined else None
+                        forward = timer.phase(
+                            "forward", trace_id=trace_id(session, seq)
+                        )
+                        with stash or nullcontext(), forward:
+                            activations = model(images)
 
-                            running_loss += response.data["loss"]
-                            pbar.set_description(
-                                f"[Epoch {epoch}] training loss: {running_loss / (i+1):.4f}"
+                        # send smashed activations (labels stay here in U-shape)
+                        in_flight[seq] = activations
+                        if u_shape:
+                            awaiting_middle[seq] = labels
+                            await send_request(
+                                MessageType.FRONT_ACTIVATIONS,
+                                activations.detach(),
+                                None,
+                                seq,
+                                trace_id(session, seq),
+                            )
+                        else:
+                            await send_request(
+                                MessageType.ACTIVATIONS_AND_LABELS,
+                                activations.detach(),
+                                labels,
+                                seq,
+                                trace_id(session, seq),
                             )
+                        seq += 1
+
+                        # receive gradients, keeping at most `max_in_flight` pending;
+                        # U-shape steps only wait for their middle activations, so
+                        # the next step's front activations go out with the grads
+                        pending = awaiting_middle if u_shape else in_flight
+                        while len(pending) >= max_in_flight:
+                            await receive_response()
 
                         if i % validate_every == 0:
                             pass
 
+                    while in_flight:
+                        await receive_response()
+                    await outgoing.put(None)
+                    await sender
+
                     _logger.info(f"[Epoch {epoch}] train loss: {running_loss}")
         except ConnectionRefusedError:
             _logger.error("Connection refused.")
@@ -182,7 +576,13 @@ def main(
             _logger.error(e)
             raise e
 
-    asyncio.get_event_loop().run_until_complete(train_splitnn())
+    if uvloop and not use_uvloop():
+        _logger.warning("uvloop is not installed, using asyncio")
+    try:
+        asyncio.get_event_loop().run_until_complete(train_splitnn())
+    finally:
+        if profile is not None:
+            profiler.save(profile)
 
 
 if __name__ == "__main__":
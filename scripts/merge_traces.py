@@ -0,0 +1,56 @@
+import json
+import logging
+import sys
+from typing import Tuple
+
+import click
+
+import split_learning
+from split_learning.utils.profiling import merge_traces
+
+# logger
+_logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "-o",
+    "--output",
+    "output",
+    type=click.Path(dir_okay=False),
+    default="trace.json",
+    help="merged trace, for chrome://tracing or https://ui.perfetto.dev",
+)
+# log levels
+@click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
+@click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
+@click.version_option(split_learning.__version__)
+def main(paths: Tuple[str, ...], output: str, log_level: int):
+    """Merge the `--profile` traces of clients and the server into one."""
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M",
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+    )
+
+    trace = merge_traces(paths)
+    with open(output, "w") as f:
+        json.dump(trace, f)
+
+    flows = [e for e in trace["traceEvents"] if e["ph"] in ("s", "f")]
+    starts = {e["id"] for e in flows if e["ph"] == "s"}
+    ends = {e["id"] for e in flows if e["ph"] == "f"}
+    _logger.info(
+        f"Merged {len(paths)} traces into {output}, "
+        f"{len(starts & ends)} linked messages"
+    )
+    if starts ^ ends:
+        _logger.warning(f"{len(starts ^ ends)} messages were only seen by one side")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import logging
 import sys
 from pathlib import Path
+from typing import List, Optional, Tuple
 
 import click
 import lightning as L
@@ -13,14 +14,22 @@ from tqdm import tqdm
 
 import split_learning
 from split_learning.models.vision.cnn_2d import CNN2DClient, CNN2DServer
-from split_learning.schemas.message import MessageType, WSMessage
+from split_learning.schemas.message import MessageType, WireFormat, WSMessage
+from split_learning.server.scheduler import POLICIES, ClientScheduler
+from split_learning.transport.mpi import transports
 from split_learning.utils import datasets as datasets
+from split_learning.utils.augment import BatchAugment
+from split_learning.utils.metrics import PhaseTimer
+from split_learning.utils.pipeline import prefetch
+from split_learning.utils.profiling import SpanRecorder, new_session_id, trace_id
 from split_learning.utils.serde import (
-    decode_message_b64,
-    deserialize_tensor,
-    encode_message_b64,
-    serialize_tensor,
+    codecs,
+    deserialize_message_tensor,
+    encode_tensor,
+    hello_message,
+    negotiate_wire_format,
 )
+from split_learning.utils.sparsify import ErrorFeedbackSparsifier
 
 # logger
 _logger = logging.getLogger(__name__)
@@ -39,10 +48,96 @@ _logger = logging.getLogger(__name__)
 @click.option("--batch-size", "batch_size", type=int, default=128)
 @click.option("--learning-rate", "learning_rate", type=float, default=1e-4)
 @click.option("--grad-clip", "grad_clip", type=float, default=0.5)
+@click.option(
+    "--seed", "seed", type=int, default=None, help="seed of the data augmentation"
+)
+@click.option(
+    "--augment-in",
+    "augment_in",
+    type=click.Choice(["loop", "collate"]),
+    default="loop",
+    help="augment batches in the training loop (on the device) or in loader workers",
+)
+@click.option(
+    "--streaming",
+    "streaming",
+    is_flag=True,
+    help="stream the training split instead of downloading it first",
+)
+@click.option(
+    "--shuffle-buffer",
+    "shuffle_buffer",
+    type=int,
+    default=10000,
+    help="examples shuffled together when streaming",
+)
+# interconnect
+@click.option(
+    "--transport",
+    "transport_name",
+    type=click.Choice(list(transports)),
+    default="buffer",
+    help="raw buffers with Isend/Recv, or pickled encoded messages",
+)
+@click.option(
+    "--wire-format",
+    "wire_format",
+    type=click.Choice([f.value for f in WireFormat]),
+    default=WireFormat.FRAME.value,
+)
+@click.option(
+    "--activation-codec",
+    "activation_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+)
+@click.option(
+    "--grad-codec",
+    "grad_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+    help="codec requested for gradients sent back by the server",
+)
+@click.option(
+    "--grad-topk-ratio",
+    "grad_topk_ratio",
+    type=float,
+    default=None,
+    help="send only this fraction of gradient entries (error feedback keeps the rest)",
+)
+@click.option(
+    "--grad-threshold",
+    "grad_threshold",
+    type=float,
+    default=None,
+    help="send only gradient entries with at least this magnitude",
+)
+# scheduling
+@click.option(
+    "--schedule",
+    "schedule",
+    type=click.Choice(POLICIES),
+    default="first-come",
+    help="order in which the server serves client ranks",
+)
+@click.option(
+    "--max-batch-size",
+    "max_batch_size",
+    type=int,
+    default=None,
+    help="maximum number of clients merged into one step (parallel schedule)",
+)
 # logging
 @click.option("--grad-accumulate-every", "grad_accumulate_every", type=int, default=4)
 @click.option("--validate-every", "validate_every", type=int, default=100)
 @click.option("--generate-every", "generate_every", type=int, default=500)
+@click.option(
+    "--profile",
+    "profile",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write a chrome trace per rank (trace.json -> trace.rank0.json, ...)",
+)
 # log levels
 @click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
 @click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
@@ -56,10 +151,25 @@ def main(
     batch_size: int,
     learning_rate: float,
     grad_clip: float,
+    seed: Optional[int],
+    augment_in: str,
+    streaming: bool,
+    shuffle_buffer: int,
+    # interconnect
+    transport_name: str,
+    wire_format: str,
+    activation_codec: str,
+    grad_codec: str,
+    grad_topk_ratio: float,
+    grad_threshold: float,
+    # scheduling
+    schedule: str,
+    max_batch_size: int,
     # logging
     grad_accumulate_every: int,
     validate_every: int,
     generate_every: int,
+    profile: Optional[str],
     # log levels
     log_level: int,
 ):
@@ -78,58 +188,160 @@ def main(
     # interconnect
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
+    transport = transports[transport_name](comm)
 
     sever_id = 0
     num_clients = comm.Get_size()
     is_sever = rank == sever_id
+    client_ids = [r for r in range(num_clients) if r != sever_id]
+
+    # profiling
+    profiler = SpanRecorder(
+        f"rank {rank} ({'server' if is_sever else 'client'})",
+        enabled=profile is not None,
+    )
+    timer = PhaseTimer(profiler)
 
     if is_sever:
-        active_client = 1
+        scheduler = ClientScheduler(
+            transport, client_ids, policy=schedule, max_batch_size=max_batch_size
+        )
 
         # model
         model = CNN2DServer(in_channels=1, dim_out=10, img_size=28)
         optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate, momentum=0.9)
         criterion = nn.CrossEntropyLoss()
         model, optimizer = fabric.setup(model, optimizer)
-
-        try:
-            while True:
-                model.train()
-                optimizer.zero_grad()
-
-                messages_bytes = comm.recv(source=active_client)
-                message = decode_message_b64(messages_bytes)
-
-                if message.type == MessageType.ACTIVATIONS_AND_LABELS:
-                    activations = deserialize_tensor(
-                        message.raw["tensor"], dtype=torch.float32
+        sparsifier = (
+            ErrorFeedbackSparsifier(ratio=grad_topk_ratio, threshold=grad_threshold)
+            if grad_topk_ratio is not None or grad_threshold is not None
+            else None
+        )
+        grad_codecs = {}
+
+        def train_step(batch: List[Tuple[int, WSMessage]]) -> List[WSMessage]:
+            """One forward/backward over the concatenated activations of `batch`."""
+            with timer.phase("decode"):
+                received = [deserialize_message_tensor(m, "tensor") for _, m in batch]
+            if len({r.shape[1:] for r in received}) > 1:
+                # activations of different shapes cannot be concatenated
+                return [train_step([item])[0] for item in batch]
+
+            with timer.phase("decode"):
+                labels = [
+                    deserialize_message_tensor(m, "labels", dtype=torch.int64)
+                    for _, m in batch
+                ]
+            sizes = [r.shape[0] for r in received]
+
+            model.train()
+            optimizer.zero_grad()
+
+            with timer.phase("h2d"):
+                activations = received[0] if len(received) == 1 else torch.cat(received)
+                activations = activations.to(fabric.device)
+                labels = torch.cat(labels).to(fabric.device)
+
+            with timer.phase("forward"):
+                activations.requires_grad = True
+                outputs = model(activations)
+                loss = criterion(outputs, labels)
+            with timer.phase("backward"):
+                fabric.backward(loss)
+
+            with timer.phase("optimizer"):
+                optimizer.step()
+
+            # send grads
+            responses = []
+            for (source, message), grads, client_outputs, client_labels in zip(
+                batch,
+                activations.grad.split(sizes),
+                outputs.split(sizes),
+                labels.split(sizes),
+            ):
+                with timer.phase("encode"):
+                    # the merged mean scales each client's grads by its share of
+                    # the batch; undo it, so updates do not depend on who shared
+                    # the step
+                    client_grads = grads.detach() * (sum(sizes) / grads.shape[0])
+                    if sparsifier is not None:
+                        client_grads = sparsifier(source, client_grads)
+                    serialized_grads, grads_meta = encode_tensor(
+                        client_grads.cpu().contiguous(),
+                        "coo" if sparsifier is not None else grad_codecs[source],
                     )
-                    labels = deserialize_tensor(
-                        message.raw["labels"], dtype=torch.int64
+                    client_loss = criterion(client_outputs.detach(), client_labels)
+                    responses.append(
+                        WSMessage(
+                            type=MessageType.GRADS,
+                            data={
+                                "tensor_shape": grads.shape,
+                                "loss": client_loss.item(),
+                                "seq": message.data.get("seq"),
+                                "trace_id": message.data.get("trace_id"),
+                            },
+                            raw={"tensor": serialized_grads},
+                            meta={"tensor": grads_meta},
+                        )
                     )
+            return responses
 
-                    activations = activations.to(fabric.device)
-                    activations = activations.reshape(*message.data["tensor_shape"])
-                    labels = labels.to(fabric.device)
-
-                    activations.requires_grad = True
-                    outputs = model(activations)
-                    loss = criterion(outputs, labels)
-                    fabric.backward(loss)
-
-                    optimizer.step()
-
-                    # send grads
-                    grads = activations.grad
-                    client_grads = grads.detach().clone()
-                    serialized_grads = serialize_tensor(client_grads.cpu())
-                    response_message = WSMessage(
-                        type=MessageType.GRADS,
-                        data={"tensor_shape": grads.shape, "loss": loss.item()},
-                        raw={"tensor": serialized_grads},
-                    )
-                    encoded_response = encode_message_b64(response_message)
-                    comm.send(encoded_response, dest=active_client)
+        try:
+            while scheduler:
+                train_batch = []
+                with profiler.span("wait"):
+                    ready = scheduler.next()
+                for source, message in ready:
+                    if message.type == MessageType.HELLO:
+                        connection_format = negotiate_wire_format(
+                            message.data.get("wire_formats", []), list(WireFormat)
+                        )
+                        grad_codecs[source] = message.data.get("grad_codec", "raw")
+                        response_message = WSMessage(
+                            type=MessageType.HELLO,
+                            data={
+                                "wire_format": connection_format.value,
+                                "grad_codec": grad_codecs[source],
+                            },
+                        )
+                        transport.send(response_message, source)
+                        transport.wire_formats[source] = connection_format
+                    elif message.type == MessageType.BYE:
+                        _logger.info(f"Client {source} finished")
+                        scheduler.finish(source)
+                        if sparsifier is not None:
+                            sparsifier.reset(source)
+                    elif message.type == MessageType.ACTIVATIONS_AND_LABELS:
+                        train_batch.append((source, message))
+                        continue
+                    transport.release(message)
+
+                if train_batch:
+                    trace_ids = [m.data.get("trace_id") for _, m in train_batch]
+                    with profiler.span("train_step", trace_ids=trace_ids) as span:
+                        responses = train_step(train_batch)
+                        for (source, message), response_message in zip(
+                            train_batch, responses
+                        ):
+                            # the next messages are received while the grads are sent
+                            with timer.phase("send"):
+                                transport.isend(response_message, source)
+                            transport.release(message)
+                    for request_trace_id in trace_ids:
+                        profiler.flow(request_trace_id, "request", span, start=False)
+                        profiler.flow(
+                            request_trace_id,
+                            "response",
+                            span,
+                            start=True,
+                            ts=span.end - 1,
+                        )
+
+            transport.flush()
+            if profile is not None:
+                profiler.save(Path(profile).with_suffix(f".rank{rank}.json"))
+            _logger.info("All clients finished, shutting down")
         except Exception as e:
             print(e)
             raise e
@@ -139,13 +351,13 @@ def main(
 
         # dataset
         mnist_normalize = transforms.Normalize((0.1307,), (0.3081,))
-        mnist_train_transform = transforms.Compose(
-            [
-                transforms.RandomCrop(28, padding=4),
-                transforms.RandomRotation(10),
-                transforms.ToTensor(),
-                mnist_normalize,
-            ]
+        # training images stay uint8, they are augmented a batch at a time
+        mnist_train_augment = BatchAugment(
+            (0.1307,),
+            (0.3081,),
+            padding=4,
+            degrees=10,
+            seed=seed + rank if seed is not None else None,
         )
         mnist_test_transform = transforms.Compose(
             [
@@ -155,18 +367,32 @@ def main(
         )
         dataset_mnist_train = datasets.mnist(
             split="train",
-            transform=mnist_train_transform,
+            transform=transforms.PILToTensor(),
+            streaming=streaming,
+            shuffle_buffer=shuffle_buffer,
+            seed=seed,
+            num_clients=len(client_ids),
+            client_index=client_ids.index(rank),
         )
         dataset_mnist_val = datasets.mnist(
             split="test",
             transform=mnist_test_transform,
+            streaming=streaming,
         )
 
         train_loader = DataLoader(
-            dataset_mnist_train, batch_size=batch_size, shuffle=True, num_workers=2
+            dataset_mnist_train,
+            batch_size=batch_size,
+            # streamed examples are shuffled in a buffer instead
+            shuffle=not streaming,
+            num_workers=2,
+            collate_fn=mnist_train_augment.collate if augment_in == "collate" else None,
         )
         val_loader = DataLoader(
-            dataset_mnist_val, batch_size=batch_size, shuffle=True, num_workers=2
+            dataset_mnist_val,
+            batch_size=batch_size,
+            shuffle=not streaming,
+            num_workers=2,
         )
         train_loader, val_loader = fabric.setup_dataloaders(train_loader, val_loader)
 
@@ -178,55 +404,103 @@ def main(
         try:
             _logger.info(f"Connecting to {sever_id} ...")
 
+            # negotiate wire format
+            hello = hello_message(
+                [wire_format, WireFormat.B64_JSON], grad_codec=grad_codec
+            )
+            transport.send(hello, sever_id)
+            _, hello_response = transport.recv(source=sever_id)
+            connection_format = WireFormat(hello_response.data["wire_format"])
+            transport.wire_formats[sever_id] = connection_format
+            _logger.info(f"Using wire format: {connection_format.value}")
+
+            # messages are traced as `<session>-<seq>`
+            session = new_session_id()
+            seq = 0
+
             # start training
             for epoch in range(num_epochs):
+                if streaming:
+                    dataset_mnist_train.set_epoch(epoch)
+                mnist_train_augment.set_epoch(epoch)
                 running_loss = 0.0
-                pbar = tqdm(enumerate(train_loader))
+                # the next batch is loaded while waiting for the server
+                pbar = tqdm(enumerate(prefetch(train_loader)))
                 for i, data in pbar:
                     images, labels = data["image"], data["label"]
+                    if augment_in == "loop":
+                        images = mnist_train_augment(images)
+
+                    step_trace_id = trace_id(session, seq)
+                    seq += 1
 
                     model.train()
                     optimizer.zero_grad()
 
-                    activations = model(images)
-                    server_inputs = activations.detach().clone()
+                    with timer.phase("forward", trace_id=step_trace_id):
+                        activations = model(images)
+                    server_inputs = activations.detach()
 
                     # send smashed activations
-                    serialized_inputs = serialize_tensor(server_inputs.cpu())
-                    serialized_labels = serialize_tensor(labels.cpu())
-                    request_message = WSMessage(
-                        type=MessageType.ACTIVATIONS_AND_LABELS,
-                        data={"tensor_shape": server_inputs.shape},
-                        raw={
-                            "tensor": serialized_inputs,
-                            "labels": serialized_labels,
-                        },
-                    )
-                    encoded_request = encode_message_b64(request_message)
-                    comm.send(encoded_request, dest=sever_id)
+                    with timer.phase("encode", trace_id=step_trace_id):
+                        serialized_inputs, inputs_meta = encode_tensor(
+                            server_inputs.cpu(), activation_codec
+                        )
+                        serialized_labels, labels_meta = encode_tensor(labels.cpu())
+                        request_message = WSMessage(
+                            type=MessageType.ACTIVATIONS_AND_LABELS,
+                            data={
+                                "tensor_shape": server_inputs.shape,
+                                "trace_id": step_trace_id,
+                            },
+                            raw={
+                                "tensor": serialized_inputs,
+                                "labels": serialized_labels,
+                            },
+                            meta={
+                                "tensor": inputs_meta,
+                                "labels": labels_meta,
+                            },
+                        )
+                    with timer.phase("send", trace_id=step_trace_id) as span:
+                        profiler.flow(step_trace_id, "request", span, start=True)
+                        transport.isend(request_message, sever_id)
 
                     # receive gradients
-                    response_byes = comm.recv(source=sever_id)
-                    response = decode_message_b64(response_byes)
+                    with timer.phase("receive", trace_id=step_trace_id) as span:
+                        _, response = transport.recv(source=sever_id)
+                    profiler.flow(
+                        step_trace_id, "response", span, start=False, ts=span.end - 1
+                    )
 
                     if response.type == MessageType.GRADS:
-                        grads = deserialize_tensor(
-                            response.raw["tensor"], dtype=torch.float32
-                        )
-                        grads = grads.reshape(*response.data["tensor_shape"])
-                        grads = grads.to(fabric.device)
-                        fabric.backward(activations, grads)
-                        optimizer.step()
+                        with timer.phase("decode", trace_id=step_trace_id):
+                            received_grads = deserialize_message_tensor(
+                                response, "tensor"
+                            )
+                        with timer.phase("h2d", trace_id=step_trace_id):
+                            grads = received_grads.to(fabric.device)
+                        with timer.phase("backward", trace_id=step_trace_id):
+                            fabric.backward(activations, grads)
+                        with timer.phase("optimizer", trace_id=step_trace_id):
+                            optimizer.step()
 
                         running_loss += response.data["loss"]
                         pbar.set_description(
                             f"[Epoch {epoch}] training loss: {running_loss / (i+1):.4f}"
                         )
+                    transport.release(response)
 
                     if i % validate_every == 0:
                         pass
 
                 _logger.info(f"[Epoch {epoch}] train loss: {running_loss}")
+
+            # let the server stop once every client is done
+            transport.send(WSMessage(type=MessageType.BYE), sever_id)
+            transport.flush()
+            if profile is not None:
+                profiler.save(Path(profile).with_suffix(f".rank{rank}.json"))
         except Exception as e:
             _logger.error(e)
             raise e
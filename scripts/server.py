@@ -1,26 +1,58 @@
+import asyncio
 import logging
 import sys
+import time
 from pathlib import Path
-from typing import Any
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import click
 import lightning as L
 import torch
 from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from torch import nn
 from uvicorn import Config, Server
 
 import split_learning
-from split_learning.models.vision.cnn_2d import CNN2D, CNN2DServer
-from split_learning.schemas.message import MessageType, WSMessage
+from split_learning.models.vision.cnn_2d import CNN2D, CNN2DServer, CNN2DUServer
+from split_learning.schemas.message import MessageType, WireFormat, WSMessage
+from split_learning.server.engine import ComputeEngine
+from split_learning.server.replica import BACKENDS, InferenceReplica
+from split_learning.transport import shm, tcp
 from split_learning.utils import utils
+from split_learning.utils.metrics import CONTENT_TYPE, MetricsRegistry, PhaseTimer
+from split_learning.utils.pipeline import stash_parameters
+from split_learning.utils.profiling import Span, SpanRecorder
 from split_learning.utils.serde import (
-    decode_message_b64,
-    deserialize_tensor,
+    StreamAssembler,
+    TensorPool,
+    codecs,
+    decode_message,
+    deserialize_message_tensor,
+    encode_message,
     encode_message_b64,
+    encode_tensor,
+    is_stream_part,
+    message_nbytes,
+    negotiate_wire_format,
+    peek_message_type,
     serialize_tensor,
+    stream_message,
+    tensor_meta,
 )
+from split_learning.utils.sparsify import ErrorFeedbackSparsifier
+from split_learning.utils.trace import TraceRecorder
 
 
 class ConnectionManager:
@@ -49,6 +81,36 @@ class ConnectionManager:
             await connection.send_bytes(message)
 
 
+class ClientState:
+    def __init__(
+        self,
+        id: int,
+        wire_format: WireFormat = WireFormat.B64_JSON,
+        grad_codec: str = "raw",
+        chunk_size: Optional[int] = None,
+    ):
+        self.id = id
+        self.wire_format = wire_format
+        self.grad_codec = grad_codec
+        # replies larger than this are streamed in chunks
+        self.chunk_size = chunk_size
+        # U-shape: seq -> (received, middle activations) awaiting middle grads
+        self.middle_graphs: Dict[int, Tuple[torch.Tensor, torch.Tensor]] = {}
+
+
+# metrics label of the steps run for each message type
+STEPS = {
+    MessageType.ACTIVATIONS_AND_LABELS: "train",
+    MessageType.ACTIVATIONS: "inference",
+    MessageType.FRONT_ACTIVATIONS: "u_forward",
+    MessageType.MIDDLE_GRADS: "u_backward",
+}
+
+# a received message, either encoded or reassembled from a stream
+Received = Union[bytes, WSMessage]
+# an encoded reply, or the parts of a streamed one
+Reply = Union[bytes, Iterator[bytes]]
+
 # logger
 _logger = logging.getLogger(__name__)
 
@@ -64,10 +126,153 @@ _logger = logging.getLogger(__name__)
 # training
 @click.option("--learning-rate", "learning_rate", type=float, default=1e-4)
 @click.option("--grad-clip", "grad_clip", type=float, default=0.5)
+# webserver
+@click.option(
+    "--wire-format",
+    "wire_formats",
+    type=click.Choice([f.value for f in WireFormat]),
+    multiple=True,
+    default=[WireFormat.FRAME.value, WireFormat.B64_JSON.value],
+    help="wire formats to accept, in order of preference",
+)
+@click.option(
+    "--grad-codec",
+    "grad_codec",
+    type=click.Choice(list(codecs)),
+    default="raw",
+    help="default codec for gradients, unless the client requests one",
+)
+@click.option(
+    "--grad-topk-ratio",
+    "grad_topk_ratio",
+    type=float,
+    default=None,
+    help="send only this fraction of gradient entries (error feedback keeps the rest)",
+)
+@click.option(
+    "--grad-threshold",
+    "grad_threshold",
+    type=float,
+    default=None,
+    help="send only gradient entries with at least this magnitude",
+)
+@click.option(
+    "--shm-socket",
+    "shm_socket",
+    type=click.Path(),
+    default=None,
+    help="also accept clients on this host over shared memory, via this unix socket",
+)
+@click.option(
+    "--tcp-port",
+    "tcp_port",
+    type=int,
+    default=None,
+    help="also accept clients over raw TCP (length-prefixed frames) on this port",
+)
+@click.option(
+    "--loop",
+    "loop",
+    type=click.Choice(["auto", "asyncio", "uvloop"]),
+    default="auto",
+    help="event loop implementation (auto uses uvloop if installed)",
+)
+# compute
+@click.option(
+    "--max-queue-depth",
+    "max_queue_depth",
+    type=int,
+    default=64,
+    help="maximum number of messages queued for compute across all clients",
+)
+@click.option(
+    "--max-pending",
+    "max_pending",
+    type=int,
+    default=2,
+    help="maximum number of messages queued for compute per client",
+)
+@click.option(
+    "--max-batch-size",
+    "max_batch_size",
+    type=int,
+    default=1,
+    help="maximum number of client messages merged into one training step",
+)
+@click.option(
+    "--max-batch-delay-ms",
+    "max_batch_delay_ms",
+    type=float,
+    default=5.0,
+    help="how long to wait for other clients' messages before a training step",
+)
+@click.option(
+    "--merge-mode",
+    "merge_mode",
+    type=click.Choice(["merged", "per-client"]),
+    default="merged",
+    help="mean loss over the merged batch, or the sum of per-client mean losses",
+)
+@click.option(
+    "--inference-max-batch-size",
+    "inference_max_batch_size",
+    type=int,
+    default=32,
+    help="maximum number of inference requests run as one forward",
+)
+@click.option(
+    "--inference-max-delay-ms",
+    "inference_max_delay_ms",
+    type=float,
+    default=2.0,
+    help="how long an inference request may wait for others to batch with",
+)
+@click.option(
+    "--replica-every-steps",
+    "replica_every_steps",
+    type=int,
+    default=None,
+    help="serve inference from a frozen copy of the model, refreshed every N steps",
+)
+@click.option(
+    "--replica-every-seconds",
+    "replica_every_seconds",
+    type=float,
+    default=None,
+    help="serve inference from a frozen copy of the model, refreshed every N seconds",
+)
+@click.option(
+    "--replica-backend",
+    "replica_backend",
+    type=click.Choice(BACKENDS),
+    default="torch",
+    help="run the inference replica eagerly, or exported to torchscript/onnxruntime",
+)
 # logging
 @click.option("--grad-accumulate-every", "grad_accumulate_every", type=int, default=4)
 @click.option("--validate-every", "validate_every", type=int, default=100)
 @click.option("--generate-every", "generate_every", type=int, default=500)
+@click.option(
+    "--report-every",
+    "report_every",
+    type=int,
+    default=100,
+    help="log batching metrics every this many batches",
+)
+@click.option(
+    "--record-trace",
+    "record_trace",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="record received messages (without payloads) for benchmarks/loadgen.py",
+)
+@click.option(
+    "--profile",
+    "profile",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="write a chrome trace of server steps, see scripts/merge_traces.py",
+)
 # log levels
 @click.option("-q", "--quiet", "log_level", flag_value=logging.WARNING)
 @click.option("-v", "--verbose", "log_level", flag_value=logging.INFO, default=True)
@@ -79,10 +284,32 @@ def main(
     # training
     learning_rate: float,
     grad_clip: float,
+    # webserver
+    wire_formats: tuple,
+    grad_codec: str,
+    grad_topk_ratio: float,
+    grad_threshold: float,
+    shm_socket: Path,
+    tcp_port: int,
+    loop: str,
+    # compute
+    max_queue_depth: int,
+    max_pending: int,
+    max_batch_size: int,
+    max_batch_delay_ms: float,
+    merge_mode: str,
+    inference_max_batch_size: int,
+    inference_max_delay_ms: float,
+    replica_every_steps: int,
+    replica_every_seconds: float,
+    replica_backend: str,
     # logging
     grad_accumulate_every: int,
     validate_every: int,
     generate_every: int,
+    report_every: int,
+    record_trace: Optional[Path],
+    profile: Optional[Path],
     # log levels
     log_level: int,
 ):
@@ -110,6 +337,8 @@ def main(
         allow_headers=["*"],
     )
     manager = ConnectionManager()
+    recorder = TraceRecorder(record_trace) if record_trace is not None else None
+    profiler = SpanRecorder("server", enabled=profile is not None)
 
     # model
     model = CNN2D(
@@ -121,84 +350,573 @@ def main(
     model_path = utils.data_path() / "models/mnist/model.pt"
     model.load_state_dict(torch.load(model_path))
 
+    # U-shape clients train the middle layers, which are not part of the
+    # server half, with their own optimizer
+    middle_model = CNN2DUServer(model=model)
     model = CNN2DServer(in_channels=1, dim_out=10, img_size=28, model=model)
     optimizer = torch.optim.SGD(model.parameters(), lr=learning_rate, momentum=0.9)
+    middle_optimizer = torch.optim.SGD(
+        middle_model.parameters(), lr=learning_rate, momentum=0.9
+    )
     criterion = nn.CrossEntropyLoss()
     model, optimizer = fabric.setup(model, optimizer)
+    middle_model, middle_optimizer = fabric.setup(middle_model, middle_optimizer)
+    pool = TensorPool(capacity=8)
+    sparsifier = (
+        ErrorFeedbackSparsifier(ratio=grad_topk_ratio, threshold=grad_threshold)
+        if grad_topk_ratio is not None or grad_threshold is not None
+        else None
+    )
 
-    @app.websocket("/ws", api_prefix)
-    async def websocket_endpoint(websocket: WebSocket):
-        await manager.connect(websocket)
-        try:
-            while True:
-                optimizer.zero_grad()
+    # compute
+    engine = ComputeEngine(
+        max_queue_depth=max_queue_depth,
+        max_pending=max_pending,
+        max_batch_size=max_batch_size,
+        max_batch_delay=max_batch_delay_ms / 1000,
+    )
+
+    # inference replica, served by its own worker so that inference does not
+    # wait behind training steps
+    replica = None
+    inference_engine = engine
+    if replica_every_steps is not None or replica_every_seconds is not None:
+        replica = InferenceReplica(
+            model,
+            every_steps=replica_every_steps,
+            every_seconds=replica_every_seconds,
+            backend=replica_backend,
+        )
+        inference_engine = ComputeEngine(
+            max_queue_depth=max_queue_depth,
+            max_pending=max_pending,
+            name="inference-engine",
+        )
+
+    # metrics
+    metrics = MetricsRegistry()
+    step_seconds = metrics.histogram(
+        "step_phase_seconds",
+        "Time spent in each phase of a step (receive includes waiting for clients)",
+        ["step", "phase"],
+    )
+    received_bytes = metrics.counter(
+        "received_bytes_total", "Bytes received from each client", ["client"]
+    )
+    sent_bytes = metrics.counter(
+        "sent_bytes_total", "Bytes sent to each client", ["client"]
+    )
+    received_messages = metrics.counter(
+        "received_messages_total", "Messages received by type", ["type"]
+    )
+    train_loss = metrics.gauge(
+        "train_loss", "Loss of each client's latest training step", ["client"]
+    )
+    metrics.gauge(
+        "queue_depth",
+        "Jobs queued for compute",
+        ["engine"],
+        function=lambda: {
+            ("train",): engine.queue_depth,
+            ("inference",): inference_engine.queue_depth,
+        },
+    )
+    # websocket connections are tracked by the connection manager
+    open_connections = {"tcp": 0, "shm": 0}
+    metrics.gauge(
+        "active_connections",
+        "Open client connections by transport",
+        ["transport"],
+        function=lambda: {
+            ("websocket",): len(manager.active_connections),
+            **{(t,): n for t, n in open_connections.items()},
+        },
+    )
 
-                messages_bytes = await websocket.receive_bytes()
-                message = decode_message_b64(messages_bytes)
+    def observe_step(step: str, timer: PhaseTimer):
+        for phase, seconds in timer.totals.items():
+            step_seconds.observe(seconds, step=step, phase=phase)
+
+    @app.get(f"{api_prefix}/metrics")
+    async def metrics_endpoint():
+        return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+    def encode_response(client: ClientState, message: WSMessage) -> Reply:
+        # chunks need a binary wire format
+        if (
+            client.chunk_size
+            and client.wire_format == WireFormat.FRAME
+            and message_nbytes(message) > client.chunk_size
+        ):
+            return stream_message(message, client.chunk_size)
+        return encode_message(message, client.wire_format)
+
+    def train_step(
+        batch: List[Tuple[ClientState, WSMessage]], timer: PhaseTimer
+    ) -> List[Reply]:
+        """One forward/backward over the concatenated activations of `batch`."""
+        with timer.phase("decode"):
+            received = [
+                deserialize_message_tensor(m, "tensor", pool=pool) for _, m in batch
+            ]
+        if len({r.shape[1:] for r in received}) > 1:
+            # activations of different shapes cannot be concatenated
+            for r in received:
+                pool.release(r)
+            return [train_step([item], timer)[0] for item in batch]
+
+        with timer.phase("decode"):
+            labels = [
+                deserialize_message_tensor(m, "labels", dtype=torch.int64)
+                for _, m in batch
+            ]
+        sizes = [r.shape[0] for r in received]
+
+        with timer.phase("h2d"):
+            activations = received[0] if len(received) == 1 else torch.cat(received)
+            activations = activations.to(fabric.device)
+            labels = torch.cat(labels).to(fabric.device)
+
+        with timer.phase("forward"):
+            optimizer.zero_grad()
+            model.train()
+            activations.requires_grad = True
+            outputs = model(activations)
+            client_losses = [
+                criterion(o, l)
+                for o, l in zip(outputs.split(sizes), labels.split(sizes))
+            ]
+            if merge_mode == "merged":
+                loss = criterion(outputs, labels)
+            else:
+                # each client gets the gradients it would get if served alone
+                loss = sum(client_losses)
+
+        with timer.phase("backward"):
+            fabric.backward(loss)
+
+        with timer.phase("optimizer"):
+            optimizer.step()
+            if replica is not None:
+                replica.step()
+
+        # send grads
+        responses = []
+        for (client, message), grads, client_loss in zip(
+            batch, activations.grad.split(sizes), client_losses
+        ):
+            if merge_mode == "merged":
+                # the merged mean scales each client's grads by its share of the
+                # batch; undo it, so updates do not depend on who shared the step
+                grads = grads * (sum(sizes) / grads.shape[0])
+            with timer.phase("encode"):
+                responses.append(
+                    grads_response(client, message, grads, client_loss.item())
+                )
+            train_loss.set(client_loss.item(), client=client.id)
+
+        for r in received:
+            pool.release(r)
+        return responses
+
+    def grads_response(
+        client: ClientState, message: WSMessage, grads: torch.Tensor, loss: float
+    ) -> Reply:
+        client_grads = grads.detach()
+        if sparsifier is not None:
+            client_grads = sparsifier(client.id, client_grads)
+        serialized_grads, grads_meta = encode_tensor(
+            client_grads.cpu().contiguous(),
+            "coo" if sparsifier is not None else client.grad_codec,
+        )
+        response_message = WSMessage(
+            type=MessageType.GRADS,
+            data={
+                "tensor_shape": grads.shape,
+                "loss": loss,
+                "seq": message.data.get("seq"),
+                "trace_id": message.data.get("trace_id"),
+            },
+            raw={"tensor": serialized_grads},
+            meta={"tensor": grads_meta},
+        )
+        return encode_response(client, response_message)
+
+    def middle_forward_step(
+        client: ClientState, message: WSMessage, timer: PhaseTimer
+    ) -> Reply:
+        """Forward the middle layers of a U-shape step, keeping its graph."""
+        with timer.phase("decode"):
+            received = deserialize_message_tensor(message, "tensor")
+
+        with timer.phase("h2d"):
+            # the graph keeps the activations until the middle grads arrive, so
+            # they must not share memory with the transport's receive buffers
+            activations = received.to(fabric.device, copy=True)
+
+        with timer.phase("forward"):
+            middle_model.train()
+            activations.requires_grad = True
+            # other steps update the parameters before this graph is backpropagated
+            with stash_parameters(middle_model):
+                outputs = middle_model(activations)
+            client.middle_graphs[message.data["seq"]] = (activations, outputs)
+
+        with timer.phase("encode"):
+            middle = outputs.detach().cpu().contiguous()
+            response_message = WSMessage(
+                type=MessageType.MIDDLE_ACTIVATIONS,
+                data={
+                    "tensor_shape": middle.shape,
+                    "seq": message.data["seq"],
+                    "trace_id": message.data.get("trace_id"),
+                },
+                raw={"tensor": serialize_tensor(middle)},
+                meta={"tensor": tensor_meta(middle)},
+            )
+            return encode_response(client, response_message)
+
+    def middle_backward_step(
+        client: ClientState, message: WSMessage, timer: PhaseTimer
+    ) -> Reply:
+        """Backpropagate the client's gradients through the middle layers."""
+        activations, outputs = client.middle_graphs.pop(message.data["seq"])
+        with timer.phase("decode"):
+            received = deserialize_message_tensor(message, "tensor", pool=pool)
+
+        with timer.phase("h2d"):
+            grads = received.to(fabric.device)
+
+        with timer.phase("backward"):
+            middle_optimizer.zero_grad()
+            fabric.backward(outputs, grads)
+
+        with timer.phase("optimizer"):
+            middle_optimizer.step()
+
+        # the loss is computed (and optionally reported) by the client
+        loss = message.data.get("loss")
+        with timer.phase("encode"):
+            response = grads_response(client, message, activations.grad, loss)
+        if loss is not None:
+            train_loss.set(loss, client=client.id)
+
+        pool.release(received)
+        return response
+
+    def inference_step(
+        batch: List[Tuple[ClientState, WSMessage]], timer: PhaseTimer
+    ) -> List[Reply]:
+        """One no-autograd forward over the concatenated activations of `batch`."""
+        with timer.phase("decode"):
+            received = [
+                deserialize_message_tensor(m, "tensor", pool=pool) for _, m in batch
+            ]
+        if len({r.shape[1:] for r in received}) > 1:
+            for r in received:
+                pool.release(r)
+            return [inference_step([item], timer)[0] for item in batch]
+
+        sizes = [r.shape[0] for r in received]
+        with timer.phase("h2d"):
+            activations = received[0] if len(received) == 1 else torch.cat(received)
+            activations = activations.to(fabric.device)
+
+        with timer.phase("forward"):
+            if replica is not None:
+                outputs = replica(activations)
+            else:
+                model.eval()
+                with torch.inference_mode():
+                    outputs = model(activations)
 
-                if message.type == MessageType.ACTIVATIONS_AND_LABELS:
-                    activations = deserialize_tensor(
-                        message.raw["tensor"], dtype=torch.float32
+        # send logits
+        responses = []
+        for (client, message), logits in zip(batch, outputs.split(sizes)):
+            with timer.phase("encode"):
+                logits = logits.cpu().contiguous()
+                serialized_logits = serialize_tensor(logits)
+                response_message = WSMessage(
+                    type=MessageType.LOGITS,
+                    data={
+                        "tensor_shape": logits.shape,
+                        "trace_id": message.data.get("trace_id"),
+                    },
+                    raw={"tensor": serialized_logits},
+                    meta={"tensor": tensor_meta(logits)},
+                )
+                responses.append(encode_response(client, response_message))
+
+        for r in received:
+            pool.release(r)
+
+        stats = inference_engine.batch_stats.get("process_inference_batch")
+        if stats is not None and stats.batches % report_every == 0:
+            _logger.info(f"Inference batching: {stats.summary()}")
+        return responses
+
+    def process_inference_batch(
+        items: List[Tuple[ClientState, Received]],
+    ) -> List[Reply]:
+        timer = PhaseTimer(profiler)
+        with profiler.span("inference_step") as span:
+            with timer.phase("decode"):
+                batch = [(client, decode(r)) for client, r in items]
+            trace_ids = [m.data.get("trace_id") for _, m in batch]
+            span.args["trace_ids"] = trace_ids
+            responses = inference_step(batch, timer)
+        trace_step(span, trace_ids)
+        observe_step("inference", timer)
+        return responses
+
+    def process_train_batch(items: List[Tuple[ClientState, Received]]) -> List[Reply]:
+        timer = PhaseTimer(profiler)
+        with profiler.span("train_step") as span:
+            with timer.phase("decode"):
+                batch = [(client, decode(r)) for client, r in items]
+            trace_ids = [m.data.get("trace_id") for _, m in batch]
+            span.args["trace_ids"] = trace_ids
+            responses = train_step(batch, timer)
+        trace_step(span, trace_ids)
+        observe_step("train", timer)
+        return responses
+
+    def process_middle_message(client: ClientState, message: WSMessage) -> Reply:
+        timer = PhaseTimer(profiler)
+        step = STEPS[message.type]
+        trace_ids = [message.data.get("trace_id")]
+        with profiler.span(f"{step}_step", trace_ids=trace_ids) as span:
+            if message.type == MessageType.FRONT_ACTIVATIONS:
+                response = middle_forward_step(client, message, timer)
+            else:
+                response = middle_backward_step(client, message, timer)
+        trace_step(span, trace_ids)
+        observe_step(step, timer)
+        return response
+
+    def trace_step(span: Span, trace_ids: List[Optional[str]]):
+        # link each client's request to this step, and this step to its reply
+        for trace_id in trace_ids:
+            profiler.flow(trace_id, "request", span, start=False)
+            profiler.flow(trace_id, "response", span, start=True, ts=span.end - 1)
+
+    def process_message(client: ClientState, received: Received) -> Optional[Reply]:
+        """Handle a client message on the compute worker, returning the reply."""
+        message = decode(received)
+
+        if message.type == MessageType.HELLO:
+            client.wire_format = negotiate_wire_format(
+                message.data.get("wire_formats", []), wire_formats
+            )
+            requested_codec = message.data.get("grad_codec", grad_codec)
+            if requested_codec in codecs:
+                client.grad_codec = requested_codec
+            client.chunk_size = message.data.get("chunk_size")
+            response_message = WSMessage(
+                type=MessageType.HELLO,
+                data={
+                    "wire_format": client.wire_format.value,
+                    "grad_codec": client.grad_codec,
+                    "chunk_size": client.chunk_size,
+                },
+            )
+            return encode_message_b64(response_message)
+        elif message.type == MessageType.ACTIVATIONS_AND_LABELS:
+            return process_train_batch([(client, message)])[0]
+        elif message.type == MessageType.ACTIVATIONS:
+            return process_inference_batch([(client, message)])[0]
+        elif message.type in (MessageType.FRONT_ACTIVATIONS, MessageType.MIDDLE_GRADS):
+            return process_middle_message(client, message)
+
+    def decode(received: Received) -> WSMessage:
+        return received if isinstance(received, WSMessage) else decode_message(received)
+
+    def close_client(client: ClientState):
+        client.middle_graphs.clear()
+        if sparsifier is not None:
+            sparsifier.reset(client.id)
+
+    async def serve(
+        client: ClientState,
+        receive: Callable[[], Awaitable[bytes]],
+        send: Callable[[bytes], Awaitable[None]],
+        abort: Callable[[], Awaitable[None]],
+        release: Optional[Callable[[], None]] = None,
+    ):
+        """Answer the messages of one connection, whatever its transport.
+
+        `release` is called, in order, once a received message is no longer used.
+        """
+        # replies are sent in order by a separate task, so that the next
+        # message can be received while the previous one is being computed
+        responses = asyncio.Queue()
+        no_reply = asyncio.get_running_loop().create_future()
+        no_reply.set_result(None)
+        assembler = StreamAssembler()
+
+        async def send_responses():
+            try:
+                while True:
+                    step, response = await responses.get()
+                    encoded_response = await response
+                    if release is not None:
+                        release()
+                    if encoded_response is None:
+                        continue
+
+                    start = time.perf_counter()
+                    parts = (
+                        encoded_response
+                        if isinstance(encoded_response, Iterator)
+                        else [encoded_response]
                     )
-                    labels = deserialize_tensor(
-                        message.raw["labels"], dtype=torch.int64
+                    with profiler.span("send", step=step):
+                        for part in parts:
+                            await send(part)
+                            sent_bytes.inc(memoryview(part).nbytes, client=client.id)
+                    step_seconds.observe(
+                        time.perf_counter() - start, step=step, phase="send"
                     )
+            except Exception as e:
+                _logger.error(e)
+                await abort()
 
-                    activations = activations.to(fabric.device)
-                    activations = activations.reshape(*message.data["tensor_shape"])
-                    labels = labels.to(fabric.device)
-
-                    model.train()
-                    activations.requires_grad = True
-                    outputs = model(activations)
-                    loss = criterion(outputs, labels)
-                    fabric.backward(loss)
-
-                    optimizer.step()
-
-                    # send grads
-                    grads = activations.grad
-                    client_grads = grads.detach().clone()
-                    serialized_grads = serialize_tensor(client_grads.cpu())
-                    response_message = WSMessage(
-                        type=MessageType.GRADS,
-                        data={"tensor_shape": grads.shape, "loss": loss.item()},
-                        raw={"tensor": serialized_grads},
+        sender = asyncio.create_task(send_responses())
+        receiving = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                received = await receive()
+                receiving += time.perf_counter() - start
+                received_bytes.inc(memoryview(received).nbytes, client=client.id)
+                if is_stream_part(received):
+                    received = assembler.feed(received)
+                    if received is None:
+                        # keeps one entry per received message, for `release`
+                        await responses.put((None, no_reply))
+                        continue
+                    message_type = received.type
+                else:
+                    message_type = peek_message_type(received)
+                if recorder is not None:
+                    recorder.record(client.id, received)
+
+                step = STEPS.get(message_type, "other")
+                received_messages.inc(type=getattr(message_type, "value", "unknown"))
+                step_seconds.observe(receiving, step=step, phase="receive")
+                receiving = 0.0
+
+                if message_type == MessageType.ACTIVATIONS_AND_LABELS:
+                    response = await engine.submit_batched(
+                        client.id, process_train_batch, (client, received)
                     )
-                    encoded_response = encode_message_b64(response_message)
-                    await websocket.send_bytes(encoded_response)
-                elif message.type == MessageType.ACTIVATIONS:
-                    activations = deserialize_tensor(
-                        message.raw["tensor"], dtype=torch.float32
+                elif message_type == MessageType.ACTIVATIONS:
+                    response = await inference_engine.submit_batched(
+                        client.id,
+                        process_inference_batch,
+                        (client, received),
+                        max_batch_size=inference_max_batch_size,
+                        max_batch_delay=inference_max_delay_ms / 1000,
                     )
-
-                    activations = activations.to(fabric.device)
-                    activations = activations.reshape(*message.data["tensor_shape"])
-
-                    model.eval()
-                    outputs = model(activations)
-
-                    # send logits
-                    logits = outputs.detach().clone()
-                    serialized_logits = serialize_tensor(logits.cpu())
-                    response_message = WSMessage(
-                        type=MessageType.LOGITS,
-                        data={"tensor_shape": logits.shape},
-                        raw={"tensor": serialized_logits},
+                else:
+                    response = await engine.submit(
+                        client.id, process_message, client, received
                     )
-                    encoded_response = encode_message_b64(response_message)
-                    await websocket.send_bytes(encoded_response)
+                await responses.put((step, response))
+        finally:
+            sender.cancel()
+            for metric in (received_bytes, sent_bytes, train_loss):
+                metric.remove(client=client.id)
+            if recorder is not None:
+                recorder.forget(client.id)
+            await engine.run(client.id, close_client, client)
+            engine.close(client.id)
+            inference_engine.close(client.id)
+
+    @app.websocket("/ws", api_prefix)
+    async def websocket_endpoint(websocket: WebSocket):
+        await manager.connect(websocket)
+        # clients that never say hello (e.g. the web demo) speak base64 json
+        client = ClientState(id(websocket), grad_codec=grad_codec)
+        try:
+            await serve(
+                client,
+                websocket.receive_bytes,
+                websocket.send_bytes,
+                lambda: websocket.close(code=1011),
+            )
         except WebSocketDisconnect:
             manager.disconnect(websocket)
         except Exception as e:
             _logger.error(e)
             raise e
 
+    async def shm_endpoint(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = await shm.accept(reader, writer, auto_release=False)
+        client = ClientState(id(connection), grad_codec=grad_codec)
+        open_connections["shm"] += 1
+        try:
+            await serve(
+                client,
+                connection.recv,
+                connection.send,
+                connection.close,
+                release=connection.release,
+            )
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            _logger.error(e)
+        finally:
+            open_connections["shm"] -= 1
+            await connection.close()
+
+    async def tcp_endpoint(connection: tcp.TcpConnection):
+        client = ClientState(id(connection), grad_codec=grad_codec)
+        open_connections["tcp"] += 1
+        try:
+            await serve(client, connection.recv, connection.send, connection.close)
+        except ConnectionError:
+            pass
+        except Exception as e:
+            _logger.error(e)
+        finally:
+            open_connections["tcp"] -= 1
+            await connection.close()
+
+    if recorder is not None:
+        app.add_event_handler("shutdown", recorder.close)
+    if profile is not None:
+        app.add_event_handler("shutdown", lambda: profiler.save(profile))
+
+    if tcp_port is not None:
+
+        @app.on_event("startup")
+        async def start_tcp_server():
+            app.state.tcp_server = await tcp.serve(tcp_endpoint, "127.0.0.1", tcp_port)
+            _logger.info(f"Accepting TCP clients on port {tcp_port}")
+
+    if shm_socket is not None:
+
+        @app.on_event("startup")
+        async def start_shm_server():
+            # keep a reference, the server is closed once garbage collected
+            app.state.shm_server = await asyncio.start_unix_server(
+                shm_endpoint, path=shm_socket
+            )
+            _logger.info(f"Accepting shared memory clients on {shm_socket}")
+
     server_config = Config(
-        app=app, host="127.0.0.1", port=8000, ws_max_size=64 * 1024 * 1024
+        app=app, host="127.0.0.1", port=8000, ws_max_size=64 * 1024 * 1024, loop=loop
     )
     server = Server(config=server_config)
+    engine.start()
+    if inference_engine is not engine:
+        inference_engine.start()
     server.run()
+    engine.stop()
+    if inference_engine is not engine:
+        inference_engine.stop()
 
 
 if __name__ == "__main__":